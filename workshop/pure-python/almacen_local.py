@@ -0,0 +1,141 @@
+
+import pathlib
+import numpy as np
+import pandas
+import pyarrow
+import pyarrow.dataset
+
+from grillas import dimensiones_espaciales
+from pentadas import pentadas_año_a_fecha_fin
+
+
+# Almacén local de datos descargados de la API del CRC-SAS.
+# Los datos tabulares de estaciones se guardan como Parquet particionado por conjunto de datos, estación
+# (omm_id) y año, y los productos grillados (chirps, ndvi, esi, grace, smap, etc.) como Zarr dividido en
+# bloques. Las consultas solamente leen las particiones y bloques necesarios: los filtros por estación y año
+# descartan particiones completas, y los filtros por fecha y variable se aplican al leer cada archivo Parquet.
+
+
+# Definición de los conjuntos de datos tabulares: columna de fecha, columna de variable (o configuración)
+# y columnas que identifican a un registro (para reemplazar registros ya almacenados al guardar).
+tablas = {
+    'registros_diarios': {
+        'fecha': 'fecha', 'variable': 'variable_id', 'clave': ['omm_id', 'fecha', 'variable_id']},
+    'indices_sequia_valores': {
+        'fecha': 'fecha', 'variable': 'indice_configuracion_id',
+        'clave': ['indice_configuracion_id', 'omm_id', 'ano', 'pentada_fin']},
+    'estadisticas_moviles': {
+        'fecha': 'fecha_hasta', 'variable': 'variable_id', 'clave': ['omm_id', 'fecha_desde', 'fecha_hasta', 'variable_id']},
+}
+
+_particiones = pyarrow.dataset.partitioning(
+    pyarrow.schema([('omm_id', pyarrow.int32()), ('ano', pyarrow.int16())]), flavor='hive')
+
+
+class AlmacenLocal:
+
+    def __init__(self, raiz):
+        self.raiz = pathlib.Path(raiz)
+
+    def _directorio_tabla(self, dataset):
+        return self.raiz / 'tablas' / dataset
+
+    def _archivo_raster(self, producto, zona):
+        return self.raiz / 'rasters' / producto / f"{zona}.zarr"
+
+    # Prepara un Data Frame para ser guardado: agrega la columna de fecha (en el caso de los índices
+    # de sequía se calcula a partir de la péntada de fin) y la columna de año usada para particionar.
+    @staticmethod
+    def _preparar(dataset, datos):
+        definicion = tablas[dataset]
+        datos = datos.copy()
+        if dataset == 'indices_sequia_valores' and 'fecha' not in datos:
+            datos['fecha'] = pentadas_año_a_fecha_fin(datos['pentada_fin'], datos['ano'])
+        datos[definicion['fecha']] = pandas.to_datetime(datos[definicion['fecha']])
+        datos['omm_id'] = datos['omm_id'].astype('int32')
+        datos['ano'] = datos[definicion['fecha']].dt.year.astype('int16')
+        return datos
+
+    # Guarda datos tabulares de un conjunto de datos. Los registros que ya estaban almacenados en las mismas
+    # particiones (estación y año) se unen con los nuevos; ante registros repetidos se conserva el nuevo.
+    def guardar_tabla(self, dataset, datos):
+        if datos.empty:
+            return
+        datos = self._preparar(dataset, datos)
+        directorio = self._directorio_tabla(dataset)
+        particiones = datos[['omm_id', 'ano']].drop_duplicates()
+        if directorio.exists():
+            existentes = self.consultar_tabla(dataset, omm_ids=particiones['omm_id'].unique(),
+                                              anos=particiones['ano'].unique())
+            if not existentes.empty:
+                existentes = existentes.merge(particiones, on=['omm_id', 'ano'])
+                datos = pandas.concat([existentes, datos], ignore_index=True)\
+                    .drop_duplicates(subset=tablas[dataset]['clave'], keep='last')
+        datos = datos.sort_values(['omm_id', tablas[dataset]['fecha']], kind='stable')
+        pyarrow.dataset.write_dataset(pyarrow.Table.from_pandas(datos, preserve_index=False), directorio,
+                                      format='parquet', partitioning=_particiones,
+                                      existing_data_behavior='delete_matching',
+                                      basename_template='parte-{i}.parquet')
+
+    # Consulta datos tabulares. Todos los filtros son opcionales: estaciones, variables (o configuraciones de
+    # índices), rango de fechas, años y columnas a devolver.
+    def consultar_tabla(self, dataset, omm_ids=None, variables=None, fecha_desde=None, fecha_hasta=None,
+                        anos=None, columnas=None):
+        directorio = self._directorio_tabla(dataset)
+        if not directorio.exists():
+            return pandas.DataFrame()
+        definicion = tablas[dataset]
+        campo_fecha = pyarrow.dataset.field(definicion['fecha'])
+        filtros = []
+        if omm_ids is not None:
+            filtros.append(pyarrow.dataset.field('omm_id').isin(np.atleast_1d(omm_ids).astype('int32')))
+        if anos is not None:
+            filtros.append(pyarrow.dataset.field('ano').isin(np.atleast_1d(anos).astype('int16')))
+        if variables is not None:
+            filtros.append(pyarrow.dataset.field(definicion['variable']).isin(list(np.atleast_1d(variables))))
+        # Los filtros de fecha se acompañan de filtros por año, para descartar particiones completas
+        if fecha_desde is not None:
+            fecha_desde = pandas.Timestamp(fecha_desde)
+            filtros += [pyarrow.dataset.field('ano') >= fecha_desde.year, campo_fecha >= fecha_desde]
+        if fecha_hasta is not None:
+            fecha_hasta = pandas.Timestamp(fecha_hasta)
+            filtros += [pyarrow.dataset.field('ano') <= fecha_hasta.year, campo_fecha <= fecha_hasta]
+
+        filtro = None
+        for f in filtros:
+            filtro = f if filtro is None else filtro & f
+        datos = pyarrow.dataset.dataset(directorio, format='parquet', partitioning=_particiones)
+        return datos.to_table(columns=columnas, filter=filtro).to_pandas()
+
+    # Guarda un producto grillado (xarray.Dataset con dimensión time) para una zona determinada.
+    # Si el producto ya estaba almacenado, se agregan solamente los pasos de tiempo posteriores al último.
+    def guardar_raster(self, producto, zona, datos, chunks=None):
+        import xarray
+        archivo = self._archivo_raster(producto, zona)
+        chunks = chunks or {d: (1 if d == 'time' else 256) for d in datos.dims}
+        datos = datos.chunk({d: c for d, c in chunks.items() if d in datos.dims})
+        for variable in datos.variables.values():
+            variable.encoding.pop('chunks', None)
+            variable.encoding.pop('preferred_chunks', None)
+        if archivo.exists():
+            ultima = xarray.open_zarr(archivo).time.max().values
+            datos = datos.sel(time=datos.time > ultima)
+            if datos.sizes['time'] > 0:
+                datos.to_zarr(archivo, append_dim='time')
+        else:
+            archivo.parent.mkdir(parents=True, exist_ok=True)
+            datos.to_zarr(archivo)
+
+    # Consulta un producto grillado de forma perezosa: solamente se leen los bloques correspondientes al
+    # período y a la ventana geográfica (xmin, ymin, xmax, ymax) seleccionados.
+    def consultar_raster(self, producto, zona, fecha_desde=None, fecha_hasta=None, ventana=None):
+        import xarray
+        datos = xarray.open_zarr(self._archivo_raster(producto, zona))
+        datos = datos.sel(time=slice(fecha_desde, fecha_hasta))
+        if ventana is not None:
+            xmin, ymin, xmax, ymax = ventana
+            dim_x, dim_y = dimensiones_espaciales(datos)
+            y = datos[dim_y].values
+            datos = datos.sel({dim_x: slice(xmin, xmax),
+                               dim_y: slice(ymin, ymax) if y[0] <= y[-1] else slice(ymax, ymin)})
+        return datos
@@ -0,0 +1,258 @@
+
+import argparse
+import datetime
+import io
+import json
+import multiprocessing
+import os
+import pathlib
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas
+import requests
+
+from benchmarks.servidor_simulado import iniciar_servidor
+from consultas_lote import consumir_servicios_JSON_lote
+from funciones_api import consumir_servicio_espacial, consumir_servicio_JSON, consumir_servicio_JSON_tipado
+from json_tipado import esquema_para_url, leer_json_tipado
+from mapas_lote import DibujoZonas, renderizar_mapas
+from pentadas import fecha_a_pentada_año, fechas_a_pentada_año, pentada_año_a_fecha_inicio, \
+    pentadas_año_a_fecha_inicio
+
+
+# Suite de benchmarks del cliente de la API, ejecutada contra el servidor simulado (o contra otra URL base).
+# Para cada caso y tamaño de respuesta se mide la latencia (percentiles 50, 90 y 99), el caudal, el pico de
+# memoria (ver medir_memoria) y, en el caso de las respuestas JSON, el tiempo de decodificación sin red. Los
+# resultados pueden guardarse en un archivo JSON y compararse con una ejecución anterior para detectar regresiones.
+#
+# Uso (desde workshop/pure-python):
+#   python -m benchmarks.benchmark --repeticiones 10 --salida resultados.json
+#   python -m benchmarks.benchmark --comparar resultados.json
+
+
+usuario, clave = 'benchmark', 'benchmark'
+directorio_codigo = pathlib.Path(__file__).resolve().parent.parent
+archivo_zona = directorio_codigo / 'Uruguay.geojson'
+
+
+# Pico de memoria de una ejecución de la función, medido como el máximo de memoria residente (RSS, que incluye
+# los buffers de las bibliotecas en C como netCDF-C/HDF5) en una ejecución adicional, para no afectar los tiempos.
+# La función se ejecuta en un proceso hijo (fork), de manera que cada caso parte de la memoria ya ocupada por este
+# proceso y no queda oculto por los picos de los casos anteriores. Devuelve (memoria_pico_mb, memoria_procesos_mb):
+# el aumento del RSS máximo del proceso que ejecuta la función y el del mayor de los procesos que lanzó (por
+# ejemplo, los procesos de un pool creados con fork), respecto de la memoria que heredaron. Si la función no lanza
+# procesos, memoria_procesos_mb es None. Sin fork ni el módulo resource (Windows) se devuelve (None, None).
+def medir_memoria(funcion):
+    try:
+        import resource
+        contexto = multiprocessing.get_context('fork')
+    except (ImportError, ValueError):
+        return None, None
+    unidad = 2 ** 20 if sys.platform == 'darwin' else 2 ** 10  # ru_maxrss está en bytes en macOS y en KB en Linux
+
+    def ejecutar_en_hijo(conexion):
+        import funciones_api
+        funciones_api._clientes.clear()  # las conexiones abiertas del proceso padre no se comparten
+        inicial = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        funcion()
+        propio = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - inicial
+        hijos = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        conexion.send((propio / unidad, max(hijos - inicial, 0) / unidad if hijos else None))
+
+    receptor, emisor = contexto.Pipe(duplex=False)
+    proceso = contexto.Process(target=ejecutar_en_hijo, args=(emisor,))
+    proceso.start()
+    emisor.close()
+    try:
+        return receptor.recv()
+    except EOFError:
+        raise RuntimeError(f"La medición de memoria terminó con código {proceso.exitcode}")
+    finally:
+        proceso.join()
+
+
+# Ejecuta una función varias veces. Devuelve las duraciones (en segundos), el pico de memoria (ver medir_memoria)
+# y el último resultado.
+def medir(funcion, repeticiones):
+    duraciones = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion()
+        duraciones.append(time.perf_counter() - inicio)
+    return np.array(duraciones), medir_memoria(funcion), resultado
+
+
+def _fila(caso, tamano, duraciones, memoria, filas=None, megabytes=None):
+    p50, p90, p99 = np.percentile(duraciones, [50, 90, 99]) * 1000
+    memoria_pico_mb, memoria_procesos_mb = memoria
+    return {'caso': caso, 'tamano': tamano, 'repeticiones': len(duraciones), 'p50_ms': p50, 'p90_ms': p90,
+            'p99_ms': p99, 'memoria_pico_mb': memoria_pico_mb, 'memoria_procesos_mb': memoria_procesos_mb,
+            'filas': filas,
+            'filas_por_s': filas / np.median(duraciones) if filas else None,
+            'mb_por_s': megabytes / np.median(duraciones) if megabytes else None}
+
+
+# Respuestas JSON: descarga + decodificación, y decodificación sola (a partir de los bytes ya descargados)
+def benchmark_json(base_url, repeticiones, anos=(1, 5, 10)):
+    filas = []
+    for cantidad in anos:
+        hasta = datetime.date(1980 + cantidad - 1, 12, 31).isoformat()
+        url = f"{base_url}/registros_diarios/87544/1980-01-01T00:00:00/{hasta}T00:00:00"
+        contenido = requests.get(url, auth=(usuario, clave)).content
+        megabytes = len(contenido) / 2 ** 20
+
+        for nombre, funcion in [
+            ('consumir_servicio_JSON', lambda: consumir_servicio_JSON(url=url, usuario=usuario, clave=clave)),
+            ('consumir_servicio_JSON_tipado', lambda: consumir_servicio_JSON_tipado(url, usuario, clave)),
+            ('decodificar json_normalize', lambda: pandas.json_normalize(json.loads(contenido))),
+            ('decodificar json_tipado', lambda: leer_json_tipado(io.BytesIO(contenido), esquema_para_url(url))),
+        ]:
+            duraciones, memoria, resultado = medir(funcion, repeticiones)
+            filas.append(_fila(nombre, f"{cantidad} años", duraciones, memoria, len(resultado), megabytes))
+    return filas
+
+
+# Productos espaciales (NetCDF): grillas de distinta resolución, enviando la zona completa o simplificada de
+# acuerdo a la resolución del producto (ver registro_zonas)
+def benchmark_espacial(servidor, base_url, repeticiones, escalas=(0.5, 1, 2)):
+    filas = []
+    url = f"{base_url}/chirps/spi/3/2019-01-01T00:00:00/2019-03-31T00:00:00"
+    for escala in escalas:
+        if servidor is not None:
+            servidor.escala_grilla = escala
+        for nombre, resolucion in [('consumir_servicio_espacial', None),
+                                   ('consumir_servicio_espacial (zona simplificada)', 'auto')]:
+            duraciones, memoria, (fechas, rasters) = medir(
+                lambda: consumir_servicio_espacial(url=url, usuario=usuario, clave=clave,
+                                                   archivo_geojson_zona=archivo_zona, raster_var_tag='spi',
+                                                   resolucion=resolucion),
+                repeticiones)
+            filas.append(_fila(nombre, f"grilla x{escala} {rasters.shape}", duraciones, memoria, rasters.size,
+                               rasters.nbytes / 2 ** 20))
+    if servidor is not None:
+        servidor.escala_grilla = 1.0
+    return filas
+
+
+# Caudal de consultas concurrentes (una consulta de índices de sequía por estación)
+def benchmark_lote(base_url, repeticiones, estaciones=64, concurrencias=(1, 8)):
+    filas = []
+    trabajos = [({'estacion': 87000 + i}, f"{base_url}/indices_sequia_valores/43/{87000 + i}/"
+                                          f"2000-01-01T00:00:00/2019-12-31T00:00:00")
+                for i in range(estaciones)]
+    for concurrencia in concurrencias:
+        duraciones, memoria, (datos, _) = medir(
+            lambda: consumir_servicios_JSON_lote(trabajos, usuario, clave, max_concurrencia=concurrencia),
+            repeticiones)
+        fila = _fila('consumir_servicios_JSON_lote', f"{estaciones} estaciones, concurrencia {concurrencia}",
+                     duraciones, memoria, len(datos))
+        fila['consultas_por_s'] = estaciones / np.median(duraciones)
+        filas.append(fila)
+    return filas
+
+
+# Conversiones de péntadas: funciones escalares (fecha por fecha) y vectorizadas
+def benchmark_pentadas(repeticiones, tamanos=(1000, 100000, 1000000)):
+    filas = []
+    for n in tamanos:
+        fechas = np.datetime64('1961-01-01') + np.arange(n) % 22000
+        pentadas, anos = fechas_a_pentada_año(fechas), fechas.astype('datetime64[Y]').astype(int) + 1970
+        casos = [('fechas_a_pentada_año', lambda: fechas_a_pentada_año(fechas)),
+                 ('pentadas_año_a_fecha_inicio', lambda: pentadas_año_a_fecha_inicio(pentadas, anos))]
+        if n <= 100000:
+            fechas_python = fechas.astype(datetime.date).tolist()
+            casos += [('fecha_a_pentada_año (escalar)', lambda: [fecha_a_pentada_año(f) for f in fechas_python]),
+                      ('pentada_año_a_fecha_inicio (escalar)',
+                       lambda: [pentada_año_a_fecha_inicio(int(p), int(a)) for p, a in zip(pentadas, anos)])]
+        for nombre, funcion in casos:
+            duraciones, memoria, _ = medir(funcion, repeticiones)
+            filas.append(_fila(nombre, f"{n} fechas", duraciones, memoria, n))
+    return filas
+
+
+# Mapas en lote: cuadros de un raster sobre una capa base con las zonas, en este proceso y en un pool de procesos.
+# La imagen de fondo se prepara en la primera repetición y se reutiliza desde la cache en las siguientes.
+def benchmark_mapas(repeticiones, cuadros=24, procesos=(0, 4)):
+    filas = []
+    x, y = np.arange(-58.45, -53, 0.05), np.arange(-30.05, -35.1, -0.05)
+    lote = [{'archivo': f"spi_{i:03d}.png", 'raster': np.sin(i + x[None, :] * y[:, None]), 'vmin': -1, 'vmax': 1,
+             'extension_raster': (-58.5, -53, -35.1, -30), 'titulo': f"Cuadro {i}"} for i in range(cuadros)]
+    with tempfile.TemporaryDirectory() as directorio:
+        for cantidad in procesos:
+            duraciones, memoria, _ = medir(
+                lambda: list(renderizar_mapas(lote, directorio, capa_base=DibujoZonas(archivo_zona),
+                                              extension=(-59, -53, -35.5, -29.5), procesos=cantidad)),
+                repeticiones)
+            fila = _fila('renderizar_mapas', f"{cuadros} cuadros, procesos {cantidad}", duraciones, memoria)
+            fila['cuadros_por_s'] = cuadros / np.median(duraciones)
+            filas.append(fila)
+    return filas
+
+
+# Tiempo de arranque en frío de procesos cortos: importación del módulo de acceso a la API y comandos de crcsas.py
+# (los comandos con salida .nc verifican además la conversión de las columnas tipadas a NetCDF). La memoria no se
+# mide: el RSS máximo de un proceso lanzado desde este incluye la memoria de este proceso al momento de lanzarlo.
+def benchmark_arranque(base_url, repeticiones):
+    entorno = {**os.environ, 'CRCSAS_BASE_URL': base_url, 'CRCSAS_USUARIO': usuario, 'CRCSAS_CLAVE': clave}
+    filas = []
+    with tempfile.TemporaryDirectory() as directorio:
+        for nombre, argumentos in [
+            ('python (sin importaciones)', ['-c', 'pass']),
+            ('import funciones_api', ['-c', 'import funciones_api']),
+            ('crcsas --help', ['crcsas.py', '--help']),
+            ('crcsas fetch estaciones (csv)', ['crcsas.py', 'fetch', 'estaciones', 'AR']),
+            ('crcsas fetch estaciones (nc)', ['crcsas.py', 'fetch', 'estaciones', 'AR',
+                                              '--salida', os.path.join(directorio, 'estaciones.nc')]),
+            ('crcsas fetch registros (nc)', ['crcsas.py', 'fetch', 'registros', '87544', '2019-01-01', '2019-12-31',
+                                             '--salida', os.path.join(directorio, 'registros.nc')]),
+        ]:
+            duraciones = []
+            for _ in range(repeticiones):
+                inicio = time.perf_counter()
+                subprocess.run([sys.executable, *argumentos], cwd=directorio_codigo, env=entorno, check=True,
+                               stdout=subprocess.DEVNULL)
+                duraciones.append(time.perf_counter() - inicio)
+            filas.append(_fila(nombre, 'proceso', np.array(duraciones), (None, None)))
+    return filas
+
+
+# Compara dos ejecuciones: cociente de la latencia mediana (actual / anterior) para cada caso y tamaño
+def comparar(actual, anterior):
+    claves = ['caso', 'tamano']
+    unidos = actual.merge(anterior[claves + ['p50_ms']], on=claves, how='left', suffixes=('', '_anterior'))
+    return unidos.assign(cociente_p50=unidos['p50_ms'] / unidos['p50_ms_anterior'])
+
+
+def ejecutar(base_url=None, repeticiones=5, latencia=0.0):
+    servidor = None
+    if base_url is None:
+        servidor = iniciar_servidor(latencia=latencia)
+        base_url = servidor.base_url
+    try:
+        filas = benchmark_json(base_url, repeticiones) + benchmark_espacial(servidor, base_url, repeticiones) + \
+            benchmark_lote(base_url, repeticiones) + benchmark_pentadas(repeticiones) + \
+            benchmark_mapas(repeticiones) + benchmark_arranque(base_url, repeticiones)
+    finally:
+        if servidor is not None:
+            servidor.shutdown()
+    return pandas.DataFrame(filas)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmarks del cliente de la API del CRC-SAS')
+    parser.add_argument('--base-url', help='URL base a utilizar (por defecto se inicia el servidor simulado)')
+    parser.add_argument('--repeticiones', type=int, default=5)
+    parser.add_argument('--latencia', type=float, default=0.0, help='latencia del servidor simulado, en segundos')
+    parser.add_argument('--salida', help='archivo JSON donde guardar los resultados')
+    parser.add_argument('--comparar', help='archivo JSON con resultados anteriores')
+    argumentos = parser.parse_args()
+
+    resultados = ejecutar(argumentos.base_url, argumentos.repeticiones, argumentos.latencia)
+    if argumentos.comparar:
+        resultados = comparar(resultados, pandas.read_json(argumentos.comparar))
+    print(resultados.to_markdown(tablefmt="github", index=False, floatfmt='.2f'))
+    if argumentos.salida:
+        resultados.to_json(argumentos.salida, orient='records', indent=1)
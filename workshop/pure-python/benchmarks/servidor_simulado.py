@@ -0,0 +1,336 @@
+
+import argparse
+import datetime
+import gzip
+import http.server
+import json
+import re
+import threading
+import time
+import urllib.parse
+import zlib
+import netCDF4
+import numpy as np
+
+from funciones_api import netcdf_lock
+
+
+# Servidor local que simula la API del CRC-SAS, para medir el rendimiento del cliente sin depender de la red.
+# Las respuestas son sintéticas (valores aleatorios reproducibles) pero tienen la misma forma que las de la API:
+# JSON para los servicios de estaciones, registros diarios, índices de sequía, eventos y estadísticas, y NetCDF
+# para los productos espaciales (chirps, indices_vegetacion, esi, grace y smap). Se pueden configurar la
+# latencia de cada respuesta, la cantidad de estaciones, la resolución de las grillas y la compresión gzip.
+#
+# Uso como script (desde workshop/pure-python):
+#   python -m benchmarks.servidor_simulado --puerto 8080 --latencia 0.05
+
+
+# Grillas de los productos espaciales: dimensiones, paso (en grados o en metros) y paso temporal (en días)
+_grillas = {
+    'chirps': {'dims': ('longitude', 'latitude'), 'paso': 0.05, 'dias': 5},
+    'esi': {'dims': ('longitude', 'latitude'), 'paso': 0.05, 'dias': 7},
+    'grace': {'dims': ('longitude', 'latitude'), 'paso': 0.125, 'dias': 7},
+    'indices_vegetacion': {'dims': ('easting', 'northing'), 'paso': 1000.0, 'dias': 8},
+    'smap': {'dims': ('easting', 'northing'), 'paso': 9000.0, 'dias': 1},
+}
+
+# Zona por defecto (Uruguay) cuando el GeoJSON enviado no puede interpretarse: lon/lat y Gauss-Krüger
+_zona_default = {'longitude': (-58.5, -53.0), 'latitude': (-35.0, -30.0),
+                 'easting': (5620000.0, 6130000.0), 'northing': (6120000.0, 6680000.0)}
+
+_crs_proyectado = '+proj=tmerc +lat_0=-90 +lon_0=-60 +k=1 +x_0=5500000 +y_0=0 +ellps=intl +units=m +no_defs'
+
+_variables = ('prcp', 'tmax', 'tmin')
+
+
+def _fecha(texto):
+    return datetime.date.fromisoformat(texto[:10])
+
+
+def _dias(desde, hasta):
+    return np.arange(np.datetime64(desde), np.datetime64(hasta) + 1)
+
+
+# Límites (xmin, xmax, ymin, ymax) de la zona enviada en el cuerpo del request, en lon/lat
+def _limites_zona(cuerpo):
+    try:
+        geojson = json.loads(json.loads(cuerpo)['zona.geojson'])
+        features = geojson['features'] if geojson.get('type') == 'FeatureCollection' else [geojson]
+        coordenadas = np.array(re.findall(r'-?\d+\.?\d*(?:[eE]-?\d+)?',
+                                          json.dumps([f['geometry']['coordinates'] for f in features])),
+                               dtype=float).reshape(-1, 2)
+        return coordenadas[:, 0].min(), coordenadas[:, 0].max(), coordenadas[:, 1].min(), coordenadas[:, 1].max()
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+class ServidorSimulado(http.server.ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    # capacidad: cantidad máxima de consultas simultáneas; las que la superan reciben una respuesta 429
+    def __init__(self, direccion, latencia=0.0, cantidad_estaciones=200, escala_grilla=1.0, comprimir=True,
+                 semilla=0, capacidad=None):
+        super().__init__(direccion, _Manejador)
+        self.latencia = latencia
+        self.cantidad_estaciones = cantidad_estaciones
+        self.escala_grilla = escala_grilla
+        self.comprimir = comprimir
+        self.semilla = semilla
+        self.capacidad = capacidad
+        self.activas = 0
+        self.rechazadas = 0
+        self._lock_activas = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    # Generador de números aleatorios reproducible para cada ruta
+    def aleatorio(self, ruta):
+        return np.random.default_rng([self.semilla, zlib.crc32(ruta.encode())])
+
+    # --- Respuestas JSON ---
+
+    def estaciones(self, ruta):
+        rng = self.aleatorio('estaciones')
+        n = self.cantidad_estaciones
+        return [{'omm_id': 86000 + i, 'nombre': f"Estación {i}", 'latitud': float(lat), 'longitud': float(lon),
+                 'elevacion': float(elev), 'nivel_adm1': f"Provincia {i % 20}", 'nivel_adm2': f"Partido {i % 200}",
+                 'tipo': 'C'}
+                for i, lat, lon, elev in zip(range(n), rng.uniform(-55, -20, n), rng.uniform(-72, -50, n),
+                                             rng.uniform(0, 1500, n))]
+
+    def estaciones_vecinas(self, ruta, omm_id):
+        estaciones = self.estaciones(ruta)
+        central = next((e for e in estaciones if e['omm_id'] == int(omm_id)), estaciones[0])
+        vecinas = []
+        for e in estaciones:
+            if e is central:
+                continue
+            distancia = 111.2 * np.hypot(e['latitud'] - central['latitud'],
+                                         (e['longitud'] - central['longitud']) * np.cos(np.radians(central['latitud'])))
+            vecinas.append(dict(e, distancia=float(distancia),
+                                diferencia_elevacion=abs(e['elevacion'] - central['elevacion'])))
+        return sorted(vecinas, key=lambda e: e['distancia'])[:10]
+
+    def registros_diarios(self, ruta, omm_id, variable_id, desde, hasta):
+        dias = _dias(_fecha(desde), _fecha(hasta))
+        rng = self.aleatorio(ruta)
+        variables = [variable_id] if variable_id else _variables
+        registros = []
+        for variable in variables:
+            valores = rng.gamma(0.3, 15, len(dias)) if variable == 'prcp' else rng.normal(20, 5, len(dias))
+            registros += [{'omm_id': int(omm_id), 'fecha': str(d), 'variable_id': variable, 'estado': 'A',
+                           'valor': round(float(v), 1)} for d, v in zip(dias, valores)]
+        return registros
+
+    def indices_sequia_valores(self, ruta, configuracion, omm_id, desde=None, hasta=None):
+        desde, hasta = (_fecha(desde), _fecha(hasta)) if desde else (datetime.date(1961, 1, 1), datetime.date.today())
+        rng = self.aleatorio(ruta)
+        pentadas = np.arange(desde.year * 72, hasta.year * 72 + 72)
+        indices = rng.normal(size=len(pentadas))
+        return [{'indice_configuracion_id': int(configuracion), 'omm_id': int(omm_id), 'pentada_fin': int(p % 72 + 1),
+                 'ano': int(p // 72), 'metodo_imputacion_id': 0, 'valor_dato': round(float(abs(v) * 100), 1),
+                 'valor_indice': round(float(v), 4), 'percentil_dato': round(float(50 + 30 * np.tanh(v)), 4)}
+                for p, v in zip(pentadas, indices)]
+
+    def indices_sequia_configuraciones(self, ruta):
+        return [{'id': i, 'indice': indice, 'escala': escala, 'distribucion': 'Gamma', 'metodo_ajuste': 'ML',
+                 'referencia_comienzo': 1971, 'referencia_fin': 2010}
+                for i, (indice, escala) in enumerate([(ind, esc) for ind in ('SPI', 'SPEI')
+                                                      for esc in (1, 2, 3, 6, 9, 12, 18, 24, 36, 48)], start=1)]
+
+    def eventos(self, ruta, configuracion, omm_id, tipo, umbral, duracion_minima):
+        rng = self.aleatorio(ruta)
+        inicios = np.sort(rng.choice(np.arange(np.datetime64('1961-01-01'), np.datetime64('2020-01-01'), 30),
+                                     size=40, replace=False))
+        eventos = []
+        for numero, inicio in enumerate(inicios, start=1):
+            duracion = int(duracion_minima) + int(rng.integers(0, 20))
+            valores = float(umbral) + (-1 if tipo == 'seco' else 1) * rng.gamma(1, 0.5, duracion)
+            eventos.append({'omm_id': int(omm_id), 'numero_evento': numero, 'fecha_inicio': str(inicio),
+                            'fecha_fin': str(inicio + 5 * duracion - 1), 'intensidad': float(valores.mean()),
+                            'magnitud': float(valores.sum()), 'duracion': duracion, 'minimo': float(valores.min()),
+                            'maximo': float(valores.max())})
+        return eventos
+
+    def estadisticas_moviles(self, ruta, omm_id, estadistico, ancho, desde, hasta):
+        rng = self.aleatorio(ruta)
+        inicios = _dias(_fecha(desde), _fecha(hasta))[::5]
+        return [{'omm_id': int(omm_id), 'fecha_desde': str(inicio), 'fecha_hasta': str(inicio + 5 * int(ancho) - 1),
+                 'variable_id': variable, 'valor': round(float(rng.gamma(2, 10)), 4)}
+                for inicio in inicios for variable in _variables]
+
+    # --- Respuestas NetCDF ---
+
+    def raster(self, ruta, producto, variable, desde, hasta, cuerpo):
+        grilla = _grillas[producto]
+        dim_x, dim_y = grilla['dims']
+        paso = grilla['paso'] / self.escala_grilla
+        limites = _limites_zona(cuerpo) if dim_x == 'longitude' else None
+        xmin, xmax = limites[:2] if limites else _zona_default[dim_x]
+        ymin, ymax = limites[2:] if limites else _zona_default[dim_y]
+        # La zona se recorta sobre una grilla global fija: se devuelven los píxeles que tocan el rectángulo de la zona
+        ix = np.arange(np.floor(xmin / paso), np.ceil(xmax / paso))
+        iy = np.arange(np.ceil(ymax / paso) - 1, np.floor(ymin / paso) - 1, -1)
+        x, y = (ix + 0.5) * paso, (iy + 0.5) * paso
+        fechas = _dias(_fecha(desde), _fecha(hasta))[::grilla['dias']]
+
+        # Valores pseudoaleatorios que dependen solamente del píxel y la fecha (iguales en consultas superpuestas)
+        semilla = zlib.crc32(f"{self.semilla}{producto}{variable}".encode()) % 1000
+        argumento = fechas.astype(int)[:, None, None] * 37.719 + iy[None, :, None] * 78.233 + \
+            ix[None, None, :] * 12.9898 + semilla
+        valores = (4 * ((np.sin(argumento) * 43758.5453) % 1) - 2).astype('float32')
+
+        # El servidor corre en el mismo proceso que el cliente: se comparte el lock de acceso a netCDF4
+        with netcdf_lock:
+            nc = netCDF4.Dataset('simulado.nc', mode='w', memory=1024, format='NETCDF4')
+            nc.crs = '+proj=longlat +datum=WGS84 +no_defs' if dim_x == 'longitude' else _crs_proyectado
+            nc.start_date = str(fechas[0]) if len(fechas) else str(_fecha(desde))
+            nc.createDimension('time', len(fechas))
+            nc.createDimension(dim_y, len(y))
+            nc.createDimension(dim_x, len(x))
+            tiempo = nc.createVariable('time', 'f8', ('time',))
+            tiempo.units = 'days since 1970-01-01'
+            tiempo[:] = fechas.astype(int)
+            nc.createVariable(dim_y, 'f8', (dim_y,))[:] = y
+            nc.createVariable(dim_x, 'f8', (dim_x,))[:] = x
+            nc.createVariable(variable, 'f4', ('time', dim_y, dim_x), fill_value=np.float32(-9999))[:] = valores
+            return nc.close().tobytes()
+
+
+# Rutas soportadas: expresión regular -> (método del servidor, tipo de respuesta). Los grupos con nombre son
+# los parámetros de la ruta.
+_fecha_re = r'[^/]+'
+_rutas = [
+    (r'/estaciones(/[^/]+){0,2}$', 'estaciones'),
+    (r'/estaciones_vecinas/(?P<omm_id>\d+)$', 'estaciones_vecinas'),
+    (rf'/registros_diarios/(?P<omm_id>\d+)(/(?P<variable_id>[a-z]+))?/(?P<desde>{_fecha_re})/(?P<hasta>{_fecha_re})$',
+     'registros_diarios'),
+    (r'/indices_sequia_configuraciones$', 'indices_sequia_configuraciones'),
+    (rf'/indices_sequia_valores/(?P<configuracion>\d+)/(?P<omm_id>\d+)'
+     rf'(/(?P<desde>{_fecha_re})/(?P<hasta>{_fecha_re}))?$', 'indices_sequia_valores'),
+    (r'/eventos/(?P<configuracion>\d+)/(?P<omm_id>\d+)/(?P<tipo>seco|humedo)/(?P<umbral>[-\d.]+)/'
+     r'(?P<duracion_minima>\d+)$', 'eventos'),
+    (rf'/estadisticas_moviles/(?P<omm_id>\d+)/(?P<estadistico>\w+)/(?P<ancho>\d+)/(?P<desde>{_fecha_re})/'
+     rf'(?P<hasta>{_fecha_re})$', 'estadisticas_moviles'),
+]
+_rutas = [(re.compile(patron), metodo) for patron, metodo in _rutas]
+
+# Productos espaciales: la variable del NetCDF es el producto indicado en la ruta o un nombre fijo
+_rutas_raster = [
+    (re.compile(rf'/chirps/pronostico/\w+/\d+/(?P<desde>{_fecha_re})/(?P<hasta>{_fecha_re})$'),
+     'chirps', lambda m: 'forecasted_total'),
+    (re.compile(rf'/chirps/(?P<producto>[a-z]+)/\d+/(?P<desde>{_fecha_re})/(?P<hasta>{_fecha_re})$'),
+     'chirps', lambda m: m['producto']),
+    (re.compile(rf'/chirps/[PM]/(?P<desde>{_fecha_re})/(?P<hasta>{_fecha_re})$'), 'chirps', lambda m: 'prcp'),
+    (re.compile(rf'/esi/\w+/\w+/(?P<desde>{_fecha_re})/(?P<hasta>{_fecha_re})$'), 'esi', lambda m: 'esi'),
+    (re.compile(rf'/grace/(?P<producto>\w+)/(?P<desde>{_fecha_re})/(?P<hasta>{_fecha_re})$'),
+     'grace', lambda m: m['producto']),
+    (re.compile(rf'/smap/(?P<producto>\w+)/(?P<desde>{_fecha_re})/(?P<hasta>{_fecha_re})$'),
+     'smap', lambda m: m['producto']),
+    (re.compile(rf'/indices_veg[ae]tacion/(?P<producto>\w+)/(?P<desde>{_fecha_re})/(?P<hasta>{_fecha_re})$'),
+     'indices_vegetacion', lambda m: m['producto']),
+]
+
+
+class _Manejador(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def _responder(self, estado, cuerpo=b'', tipo='application/json', cabeceras=None):
+        comprimir = self.server.comprimir and 'gzip' in self.headers.get('Accept-Encoding', '') and cuerpo
+        if comprimir:
+            cuerpo = gzip.compress(cuerpo, compresslevel=1)
+        self.send_response(estado)
+        self.send_header('Content-Type', tipo)
+        self.send_header('Content-Length', str(len(cuerpo)))
+        if comprimir:
+            self.send_header('Content-Encoding', 'gzip')
+        for nombre, valor in (cabeceras or {}).items():
+            self.send_header(nombre, valor)
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    # Registra una consulta en curso. Devuelve False (y responde 429) si se superó la capacidad del servidor.
+    def _admitir(self):
+        with self.server._lock_activas:
+            if self.server.capacidad and self.server.activas >= self.server.capacidad:
+                self.server.rechazadas += 1
+                admitida = False
+            else:
+                self.server.activas += 1
+                admitida = True
+        if not admitida:
+            self._responder(429, json.dumps({'error': 'Demasiadas consultas'}).encode(), cabeceras={'Retry-After': '1'})
+        return admitida
+
+    def _liberar(self):
+        with self.server._lock_activas:
+            self.server.activas -= 1
+
+    def _ruta(self):
+        ruta = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path)
+        return re.sub(r'^/ws-api', '', ruta).rstrip('/')
+
+    def do_GET(self):
+        if not self._admitir():
+            return
+        try:
+            if self.server.latencia:
+                time.sleep(self.server.latencia)
+            ruta = self._ruta()
+            for patron, metodo in _rutas:
+                coincidencia = patron.match(ruta)
+                if coincidencia:
+                    datos = getattr(self.server, metodo)(ruta, **coincidencia.groupdict())
+                    return self._responder(200, json.dumps(datos).encode())
+            self._responder(404, json.dumps({'error': f"Ruta desconocida: {ruta}"}).encode())
+        finally:
+            self._liberar()
+
+    def do_POST(self):
+        cuerpo = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if not self._admitir():
+            return
+        try:
+            if self.server.latencia:
+                time.sleep(self.server.latencia)
+            ruta = self._ruta()
+            for patron, producto, variable in _rutas_raster:
+                coincidencia = patron.match(ruta)
+                if coincidencia:
+                    datos = self.server.raster(ruta, producto, variable(coincidencia), coincidencia['desde'],
+                                               coincidencia['hasta'], cuerpo)
+                    return self._responder(200, datos, tipo='application/x-netcdf')
+            self._responder(404, json.dumps({'error': f"Ruta desconocida: {ruta}"}).encode())
+        finally:
+            self._liberar()
+
+    def log_message(self, formato, *argumentos):
+        pass
+
+
+# Inicia el servidor simulado en un hilo en segundo plano (puerto=0: se elige un puerto libre).
+# Devuelve el servidor; su URL base está en servidor.base_url y se detiene con servidor.shutdown().
+def iniciar_servidor(puerto=0, **configuracion):
+    servidor = ServidorSimulado(('127.0.0.1', puerto), **configuracion)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Servidor local que simula la API del CRC-SAS')
+    parser.add_argument('--puerto', type=int, default=8080)
+    parser.add_argument('--latencia', type=float, default=0.0, help='demora de cada respuesta, en segundos')
+    parser.add_argument('--estaciones', type=int, default=200, help='cantidad de estaciones simuladas')
+    parser.add_argument('--escala-grilla', type=float, default=1.0, help='factor de resolución de las grillas')
+    parser.add_argument('--sin-compresion', action='store_true', help='no comprimir las respuestas con gzip')
+    parser.add_argument('--capacidad', type=int, help='consultas simultáneas admitidas (las demás reciben 429)')
+    argumentos = parser.parse_args()
+    servidor = ServidorSimulado(('127.0.0.1', argumentos.puerto), latencia=argumentos.latencia,
+                                cantidad_estaciones=argumentos.estaciones, escala_grilla=argumentos.escala_grilla,
+                                comprimir=not argumentos.sin_compresion, capacidad=argumentos.capacidad)
+    print(f"Servidor simulado en {servidor.base_url}")
+    servidor.serve_forever()
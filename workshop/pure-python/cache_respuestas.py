@@ -0,0 +1,169 @@
+
+import contextlib
+import datetime
+import hashlib
+import io
+import json
+import pathlib
+import re
+import sqlite3
+import time
+import requests
+import requests.structures
+import requests.utils
+
+
+# Cache persistente (en disco) de respuestas de la API del CRC-SAS.
+# Las respuestas se guardan en una base de datos SQLite, lo cual permite que varios procesos compartan
+# la misma cache de forma segura (SQLite se encarga del bloqueo de la base de datos entre procesos).
+# Cada respuesta se identifica por el método HTTP, la URL, el hash del cuerpo de la consulta (en el caso
+# de las consultas espaciales, el cuerpo incluye la zona GeoJSON) y el hash de las credenciales con las que se
+# obtuvo: una respuesta guardada solamente se devuelve a un cliente con el mismo usuario y clave, de manera que
+# la cache (compartida por todos los clientes del proceso) no permite saltear la autenticación de la API.
+# Cuando el tamaño total de la cache supera el máximo indicado, se eliminan las respuestas usadas menos
+# recientemente (LRU).
+
+
+# Reglas de tiempo de vida (en segundos) por servicio. Se evalúan en orden y se aplica la primera que
+# coincida con la URL. Un valor None indica que la respuesta no expira y un valor 0 que no se guarda.
+reglas_ttl_default = [
+    (r'/indices_sequia_valores/\d+/\d+/?$', 15 * 60),  # último valor disponible de un índice
+    (r'/estaciones', 24 * 3600),
+    (r'/indices_sequia_configuraciones', 24 * 3600),
+]
+
+# Tiempo de vida de las consultas que no son alcanzadas por ninguna regla y no refieren a un período cerrado.
+ttl_default = 3600
+
+# Cantidad de días que deben transcurrir desde el fin de un período para considerarlo cerrado. Los datos
+# recientes pueden ser corregidos por el control de calidad o recalculados, por lo que no se consideran cerrados.
+dias_consolidacion_default = 30
+
+_patron_fecha = re.compile(r'/(\d{4}-\d{2}-\d{2})(?:T[\d:.]+)?(?=/|$|\?)')
+_patron_anos = re.compile(r'/(normales_climatologicas_mensuales|estadisticas_mensuales)/.*/(\d{4})/?(?:\?|$)')
+
+
+# Determina la fecha de fin del período consultado en una URL (o None si la URL no refiere a un período).
+def fecha_fin_periodo(url):
+    fechas = _patron_fecha.findall(url)
+    if fechas:
+        return datetime.date.fromisoformat(fechas[-1])
+    anos = _patron_anos.search(url)
+    if anos:
+        return datetime.date(int(anos.group(2)), 12, 31)
+    return None
+
+
+class CacheRespuestas:
+
+    def __init__(self, directorio, max_bytes=2 * 1024 ** 3, reglas_ttl=None, ttl=ttl_default,
+                 dias_consolidacion=dias_consolidacion_default):
+        pathlib.Path(directorio).mkdir(parents=True, exist_ok=True)
+        self.archivo = pathlib.Path(directorio) / 'respuestas.sqlite'
+        self.max_bytes = max_bytes
+        self.reglas_ttl = [(re.compile(patron), ttl) for patron, ttl in (reglas_ttl or reglas_ttl_default)]
+        self.ttl = ttl
+        self.dias_consolidacion = dias_consolidacion
+        with self._conectar() as conexion:
+            conexion.execute('PRAGMA journal_mode=WAL')
+            conexion.execute('CREATE TABLE IF NOT EXISTS respuestas ('
+                             ' clave TEXT PRIMARY KEY, url TEXT, estado INTEGER, cabeceras TEXT, contenido BLOB,'
+                             ' tamano INTEGER, expira REAL, ultimo_acceso REAL)')
+            conexion.execute('CREATE INDEX IF NOT EXISTS respuestas_ultimo_acceso ON respuestas (ultimo_acceso)')
+
+    # Se abre una conexión por operación: las conexiones SQLite no deben compartirse entre hilos,
+    # y el timeout permite esperar a que otro proceso libere el bloqueo de escritura.
+    @contextlib.contextmanager
+    def _conectar(self):
+        conexion = sqlite3.connect(self.archivo, timeout=60, isolation_level=None)
+        try:
+            yield conexion
+        finally:
+            conexion.close()
+
+    # Clave de una consulta. credencial es el hash del usuario y la clave (ver funciones_api.ClienteAPI).
+    @staticmethod
+    def clave(metodo, url, cuerpo=None, credencial=None):
+        if isinstance(cuerpo, str):
+            cuerpo = cuerpo.encode('utf-8')
+        hash_cuerpo = hashlib.sha256(cuerpo or b'').hexdigest()
+        clave = f"{metodo.upper()}\n{url}\n{hash_cuerpo}\n{credencial or ''}"
+        return hashlib.sha256(clave.encode('utf-8')).hexdigest()
+
+    # Determina el tiempo de vida de una respuesta en función de la URL consultada.
+    def tiempo_de_vida(self, url):
+        for patron, ttl in self.reglas_ttl:
+            if patron.search(url):
+                return ttl
+        fecha_fin = fecha_fin_periodo(url)
+        if fecha_fin and fecha_fin < datetime.date.today() - datetime.timedelta(days=self.dias_consolidacion):
+            return None  # período cerrado, los datos históricos no cambian
+        return self.ttl
+
+    # Busca una respuesta en la cache. Devuelve un objeto requests.Response o None si no está o expiró.
+    def obtener(self, metodo, url, cuerpo=None, credencial=None):
+        clave = self.clave(metodo, url, cuerpo, credencial)
+        ahora = time.time()
+        with self._conectar() as conexion:
+            fila = conexion.execute('SELECT estado, cabeceras, contenido, expira FROM respuestas WHERE clave = ?',
+                                    (clave,)).fetchone()
+            if fila is None:
+                return None
+            estado, cabeceras, contenido, expira = fila
+            if expira is not None and expira < ahora:
+                conexion.execute('DELETE FROM respuestas WHERE clave = ?', (clave,))
+                return None
+            conexion.execute('UPDATE respuestas SET ultimo_acceso = ? WHERE clave = ?', (ahora, clave))
+
+        respuesta = requests.Response()
+        respuesta.status_code = estado
+        respuesta.headers = requests.structures.CaseInsensitiveDict(json.loads(cabeceras))
+        respuesta.encoding = requests.utils.get_encoding_from_headers(respuesta.headers)
+        respuesta.url = url
+        # La respuesta se comporta como una ya leída: iter_content/iter_lines devuelven el contenido guardado y
+        # raw permite leerlo como un stream (por ejemplo, con shutil.copyfileobj).
+        respuesta._content = contenido
+        respuesta._content_consumed = True
+        respuesta.raw = io.BytesIO(contenido)
+        respuesta.desde_cache = True
+        return respuesta
+
+    # Guarda una respuesta exitosa en la cache y luego elimina las menos usadas si se superó el tamaño máximo.
+    def guardar(self, metodo, url, cuerpo, respuesta, credencial=None):
+        ttl = self.tiempo_de_vida(url)
+        if respuesta.status_code != 200 or ttl == 0:
+            return
+        # El contenido ya fue descomprimido por requests, por lo que no se guardan las cabeceras de codificación
+        cabeceras = {k: v for k, v in respuesta.headers.items()
+                     if k.lower() not in ('content-encoding', 'content-length', 'transfer-encoding')}
+        contenido = respuesta.content
+        ahora = time.time()
+        with self._conectar() as conexion:
+            conexion.execute('BEGIN IMMEDIATE')
+            conexion.execute('INSERT OR REPLACE INTO respuestas VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                             (self.clave(metodo, url, cuerpo, credencial), url, respuesta.status_code,
+                              json.dumps(cabeceras), contenido, len(contenido),
+                              None if ttl is None else ahora + ttl, ahora))
+            self._desalojar(conexion)
+            conexion.execute('COMMIT')
+
+    def _desalojar(self, conexion):
+        total, = conexion.execute('SELECT COALESCE(SUM(tamano), 0) FROM respuestas').fetchone()
+        if total <= self.max_bytes:
+            return
+        liberar = total - self.max_bytes
+        claves = []
+        for clave, tamano in conexion.execute('SELECT clave, tamano FROM respuestas ORDER BY ultimo_acceso'):
+            claves.append((clave,))
+            liberar -= tamano
+            if liberar <= 0:
+                break
+        conexion.executemany('DELETE FROM respuestas WHERE clave = ?', claves)
+
+    # Elimina las respuestas expiradas (o todas, si se indica).
+    def limpiar(self, todas=False):
+        with self._conectar() as conexion:
+            if todas:
+                conexion.execute('DELETE FROM respuestas')
+            else:
+                conexion.execute('DELETE FROM respuestas WHERE expira IS NOT NULL AND expira < ?', (time.time(),))
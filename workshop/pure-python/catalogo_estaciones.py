@@ -0,0 +1,80 @@
+
+import numpy as np
+import pandas
+import sklearn.neighbors
+
+from funciones_api import base_url_default, consumir_servicio_JSON
+
+
+# Radio medio de la Tierra (en km) utilizado para convertir distancias angulares (haversine) a kilómetros
+radio_tierra_km = 6371.0
+
+
+# Catálogo de estaciones con un índice espacial (BallTree con métrica haversine).
+# Se construye una única vez a partir del servicio /estaciones (o /estaciones/{iso_pais}) y permite responder
+# búsquedas de estaciones vecinas para muchas estaciones centrales en una sola llamada, sin consultar a la API.
+# Las búsquedas reproducen la semántica del servicio /estaciones_vecinas: se excluye a la estación central,
+# se filtra por distancia máxima (en km) y diferencia máxima de elevación (en m), y las vecinas se ordenan
+# por distancia y luego por diferencia de elevación antes de aplicar la cantidad máxima de vecinas.
+class CatalogoEstaciones:
+
+    def __init__(self, estaciones):
+        self.estaciones = estaciones.reset_index(drop=True)
+        self._posiciones = pandas.Series(self.estaciones.index, index=self.estaciones['omm_id'].astype(int))
+        self._coordenadas = np.radians(self.estaciones[['latitud', 'longitud']].to_numpy(dtype=float))
+        self._elevaciones = self.estaciones['elevacion'].to_numpy(dtype=float)
+        self._arbol = sklearn.neighbors.BallTree(self._coordenadas, metric='haversine')
+
+    # Construye el catálogo a partir de la API (todas las estaciones o las de un país).
+    @classmethod
+    def desde_api(cls, usuario, clave, iso_pais=None, base_url=base_url_default):
+        url = f"{base_url}/estaciones" + (f"/{iso_pais}" if iso_pais else "")
+        return cls(consumir_servicio_JSON(url=url, usuario=usuario, clave=clave))
+
+    # Busca las estaciones vecinas de una o más estaciones centrales.
+    # Devuelve un Data Frame con las columnas del catálogo más omm_id_central, distancia y diferencia_elevacion.
+    def vecinas(self, omm_ids, max_distancia=None, max_diferencia_elevacion=None, max_vecinas=None):
+        centrales = self._posiciones.loc[np.atleast_1d(omm_ids).astype(int)].to_numpy()
+        puntos = self._coordenadas[centrales]
+
+        # a. Candidatas: dentro del radio máximo o, si no se indica radio, todas las estaciones
+        if max_distancia is not None:
+            indices, distancias = self._arbol.query_radius(puntos, r=max_distancia / radio_tierra_km,
+                                                           return_distance=True)
+        else:
+            distancias, indices = self._arbol.query(puntos, k=len(self.estaciones))
+        cantidades = [len(i) for i in indices]
+        origen = np.repeat(centrales, cantidades)
+        vecina = np.concatenate(list(indices)).astype(int) if len(indices) else np.array([], dtype=int)
+        distancia = np.concatenate(list(distancias)) * radio_tierra_km if len(indices) else np.array([])
+        diferencia_elevacion = np.abs(self._elevaciones[vecina] - self._elevaciones[origen])
+
+        # b. Filtros: se excluye la estación central y se aplica la diferencia máxima de elevación
+        validas = vecina != origen
+        if max_diferencia_elevacion is not None:
+            validas &= diferencia_elevacion <= max_diferencia_elevacion
+        origen, vecina = origen[validas], vecina[validas]
+        distancia, diferencia_elevacion = distancia[validas], diferencia_elevacion[validas]
+
+        # c. Orden por estación central, distancia y diferencia de elevación; luego se limita la cantidad
+        orden = np.lexsort((diferencia_elevacion, distancia, origen))
+        origen, vecina = origen[orden], vecina[orden]
+        distancia, diferencia_elevacion = distancia[orden], diferencia_elevacion[orden]
+        if max_vecinas is not None:
+            inicio_grupo = np.r_[0, np.flatnonzero(np.diff(origen)) + 1]
+            posicion = np.arange(len(origen)) - np.repeat(inicio_grupo, np.diff(np.r_[inicio_grupo, len(origen)]))
+            seleccion = posicion < max_vecinas
+            origen, vecina = origen[seleccion], vecina[seleccion]
+            distancia, diferencia_elevacion = distancia[seleccion], diferencia_elevacion[seleccion]
+
+        resultado = self.estaciones.iloc[vecina].reset_index(drop=True)
+        resultado.insert(0, 'omm_id_central', self.estaciones['omm_id'].to_numpy()[origen])
+        return resultado.assign(distancia=distancia, diferencia_elevacion=diferencia_elevacion)
+
+    # Clasifica todas las estaciones del catálogo (o las indicadas) como 'Central', 'Vecina' u 'Otra'
+    # respecto de una estación central.
+    def clasificar(self, omm_id_central, omm_ids=None, **criterios):
+        omm_ids = self.estaciones['omm_id'] if omm_ids is None else pandas.Series(omm_ids)
+        vecinas = self.vecinas(omm_id_central, **criterios)['omm_id']
+        return pandas.Series(np.where(omm_ids == omm_id_central, 'Central',
+                                      np.where(omm_ids.isin(vecinas), 'Vecina', 'Otra')), index=omm_ids.index)
@@ -0,0 +1,109 @@
+
+import asyncio
+import concurrent.futures
+import pandas
+
+from funciones_api import leer_netcdf, obtener_cliente
+from instrumentacion import medir
+
+
+# Funciones para ejecutar lotes de consultas a la API de forma concurrente.
+# Cada trabajo es un par (etiquetas, url), donde etiquetas es un diccionario con los valores que identifican
+# al trabajo (por ejemplo {'omm_id': 87544, 'indice_configuracion_id': 43}). Las etiquetas se agregan como
+# columnas al resultado de cada consulta, de manera que luego puedan concatenarse todos los resultados en un
+# único Data Frame sin perder la referencia al trabajo de origen.
+
+
+# Ejecuta una consulta GET y convierte la respuesta JSON en un Data Frame etiquetado.
+def _ejecutar_trabajo(cliente, etiquetas, url):
+    with medir('consumir_servicios_JSON_lote', url) as medicion:
+        respuesta = cliente.get(url)
+        medicion.respuesta(respuesta)
+        respuesta.raise_for_status()
+        datos = pandas.json_normalize(respuesta.json()).assign(**etiquetas)
+        medicion.decodificacion(filas=len(datos))
+    return datos
+
+
+# Une los resultados (en el orden de los trabajos) y arma la tabla de errores.
+def _unir_resultados(trabajos, resultados):
+    datos, errores = [], []
+    for (etiquetas, url), resultado in zip(trabajos, resultados):
+        if isinstance(resultado, Exception):
+            errores.append({**etiquetas, 'url': url, 'error': repr(resultado)})
+        elif not resultado.empty:
+            datos.append(resultado)
+    datos = pandas.concat(datos, ignore_index=True) if datos else pandas.DataFrame()
+    errores = pandas.DataFrame(errores) if errores else pandas.DataFrame(columns=['url', 'error'])
+    return datos, errores
+
+
+# Función para ejecutar un lote de consultas GET (con respuestas JSON) utilizando un pool de hilos.
+# Como máximo se ejecutan max_concurrencia consultas en simultáneo. Devuelve un Data Frame con todos
+# los resultados concatenados y otro Data Frame con los trabajos que fallaron (etiquetas, url y error).
+# Un error en un trabajo no interrumpe la ejecución de los demás.
+def consumir_servicios_JSON_lote(trabajos, usuario, clave, max_concurrencia=8, cliente=None):
+    cliente = cliente or obtener_cliente(usuario, clave)
+    trabajos = list(trabajos)
+    resultados = [None] * len(trabajos)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrencia) as ejecutor:
+        futuros = {ejecutor.submit(_ejecutar_trabajo, cliente, etiquetas, url): i
+                   for i, (etiquetas, url) in enumerate(trabajos)}
+        for futuro in concurrent.futures.as_completed(futuros):
+            try:
+                resultados[futuros[futuro]] = futuro.result()
+            except Exception as e:
+                resultados[futuros[futuro]] = e
+    return _unir_resultados(trabajos, resultados)
+
+
+# Versión asyncio de consumir_servicios_JSON_lote, para ser utilizada dentro de un event loop
+# (por ejemplo, desde Jupyter Notebook o desde una aplicación asíncrona). La concurrencia se limita
+# mediante un semáforo y cada consulta se ejecuta en un hilo para no bloquear el event loop.
+async def consumir_servicios_JSON_lote_async(trabajos, usuario, clave, max_concurrencia=8, cliente=None):
+    cliente = cliente or obtener_cliente(usuario, clave)
+    trabajos = list(trabajos)
+    semaforo = asyncio.Semaphore(max_concurrencia)
+
+    async def ejecutar(etiquetas, url):
+        async with semaforo:
+            return await asyncio.to_thread(_ejecutar_trabajo, cliente, etiquetas, url)
+
+    resultados = await asyncio.gather(*[ejecutar(etiquetas, url) for etiquetas, url in trabajos],
+                                      return_exceptions=True)
+    return _unir_resultados(trabajos, resultados)
+
+
+# Ejecuta una consulta espacial (POST) y decodifica la respuesta NetCDF en memoria.
+def _ejecutar_trabajo_espacial(cliente, url, cuerpo):
+    with medir('consumir_servicios_espaciales_lote', url, 'POST') as medicion:
+        respuesta = cliente.post(url, data=cuerpo)
+        medicion.respuesta(respuesta)
+        respuesta.raise_for_status()
+        datos = leer_netcdf(respuesta.content)
+        medicion.decodificacion(celdas=sum(v.size for v in datos.data_vars.values()))
+    return datos
+
+
+# Función para ejecutar un lote de consultas espaciales utilizando un pool de hilos. Cada trabajo es una terna
+# (etiquetas, url, cuerpo), por ejemplo las generadas por registro_zonas.trabajos_espaciales para todas las
+# combinaciones de zonas, productos y períodos. Devuelve una lista de pares (etiquetas, dataset de xarray), en el
+# orden de los trabajos, con los trabajos exitosos, y un Data Frame con los trabajos que fallaron.
+def consumir_servicios_espaciales_lote(trabajos, usuario, clave, max_concurrencia=4, cliente=None):
+    cliente = cliente or obtener_cliente(usuario, clave)
+    trabajos = list(trabajos)
+    resultados = [None] * len(trabajos)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrencia) as ejecutor:
+        futuros = {ejecutor.submit(_ejecutar_trabajo_espacial, cliente, url, cuerpo): i
+                   for i, (etiquetas, url, cuerpo) in enumerate(trabajos)}
+        for futuro in concurrent.futures.as_completed(futuros):
+            try:
+                resultados[futuros[futuro]] = futuro.result()
+            except Exception as e:
+                resultados[futuros[futuro]] = e
+    datos = [(etiquetas, resultado) for (etiquetas, _, _), resultado in zip(trabajos, resultados)
+             if not isinstance(resultado, Exception)]
+    errores = [{**etiquetas, 'url': url, 'error': repr(resultado)}
+               for (etiquetas, url, _), resultado in zip(trabajos, resultados) if isinstance(resultado, Exception)]
+    errores = pandas.DataFrame(errores) if errores else pandas.DataFrame(columns=['url', 'error'])
+    return datos, errores
@@ -0,0 +1,232 @@
+
+import argparse
+import datetime
+import os
+import sys
+
+
+# Interfaz de línea de comandos para descargar datos de la API del CRC-SAS, pensada para tareas programadas que
+# lanzan muchos procesos cortos. Solamente se importan los paquetes que necesita el comando ejecutado: las tablas
+# en formato CSV se escriben directamente a partir del JSON recibido (sin pandas) y los rasters se guardan tal
+# como los devuelve la API (sin decodificar el NetCDF). Las credenciales se toman de las variables de entorno
+# CRCSAS_USUARIO y CRCSAS_CLAVE o del archivo credencial.yml (ver funciones_api.cargar_credencial).
+#
+# Uso (desde workshop/pure-python):
+#   python crcsas.py fetch estaciones AR --salida estaciones.csv
+#   python crcsas.py fetch registros 87544 2019-01-01 2019-12-31 --salida registros.parquet
+#   python crcsas.py fetch spi 87544 2017-01-01 2019-12-31 --escala 3 --salida spi.csv
+#   python crcsas.py raster chirps/spi/3 2019-01-01 2019-03-31 --zona Uruguay.geojson --salida spi.nc
+#
+# El formato de las tablas se determina por la extensión del archivo de salida (.csv, .parquet o .nc).
+# Sin --salida, las tablas se escriben en formato CSV por la salida estándar.
+
+
+def _fecha(texto):
+    return datetime.date.fromisoformat(texto).isoformat() + 'T00:00:00'
+
+
+def _ruta_estaciones(argumentos, credencial):
+    return f"estaciones/{argumentos.iso_pais}" if argumentos.iso_pais else 'estaciones'
+
+
+def _ruta_vecinas(argumentos, credencial):
+    ruta = f"estaciones_vecinas/{argumentos.omm_id}"
+    return f"{ruta}?max_distancia={argumentos.max_distancia}" if argumentos.max_distancia else ruta
+
+
+def _ruta_configuraciones(argumentos, credencial):
+    return 'indices_sequia_configuraciones'
+
+
+def _ruta_registros(argumentos, credencial):
+    variable = f"/{argumentos.variable}" if argumentos.variable else ''
+    return f"registros_diarios/{argumentos.omm_id}{variable}/{_fecha(argumentos.desde)}/{_fecha(argumentos.hasta)}"
+
+
+def _ruta_indice(argumentos, credencial):
+    configuracion = argumentos.configuracion or _buscar_configuracion(argumentos, credencial)
+    return f"indices_sequia_valores/{configuracion}/{argumentos.omm_id}/" \
+           f"{_fecha(argumentos.desde)}/{_fecha(argumentos.hasta)}"
+
+
+# Busca el id de la configuración de índice de sequía que coincide con los criterios indicados
+def _buscar_configuracion(argumentos, credencial):
+    from funciones_api import consumir_servicio_GET
+    respuesta = consumir_servicio_GET(f"{argumentos.base_url}/indices_sequia_configuraciones", *credencial)
+    respuesta.raise_for_status()
+    criterios = {'indice': argumentos.indice, 'escala': argumentos.escala, 'distribucion': argumentos.distribucion,
+                 'metodo_ajuste': argumentos.metodo_ajuste}
+    if argumentos.referencia:
+        criterios.update(referencia_comienzo=argumentos.referencia[0], referencia_fin=argumentos.referencia[1])
+    candidatas = [c for c in respuesta.json()
+                  if all(valor is None or str(c.get(campo)).lower() == str(valor).lower()
+                         for campo, valor in criterios.items())]
+    if len(candidatas) != 1:
+        descripcion = ', '.join(f"{campo}={valor}" for campo, valor in criterios.items() if valor is not None)
+        opciones = '; '.join(f"{c['id']}: {c.get('distribucion')} {c.get('metodo_ajuste')} "
+                             f"{c.get('referencia_comienzo')}-{c.get('referencia_fin')}" for c in candidatas)
+        sys.exit(f"Se encontraron {len(candidatas)} configuraciones para {descripcion}. "
+                 f"Indicar --configuracion o más criterios. {opciones}")
+    return candidatas[0]['id']
+
+
+# Aplana los objetos anidados de un registro con la misma convención que pandas.json_normalize
+def _aplanar(registro, prefijo=''):
+    plano = {}
+    for campo, valor in registro.items():
+        if isinstance(valor, dict):
+            plano.update(_aplanar(valor, f"{prefijo}{campo}."))
+        else:
+            plano[f"{prefijo}{campo}"] = valor
+    return plano
+
+
+def _escribir_csv(registros, salida):
+    import csv
+    registros = [_aplanar(r) for r in registros]
+    columnas = list(dict.fromkeys(columna for registro in registros for columna in registro))
+    archivo = open(salida, 'w', newline='') if salida else sys.stdout
+    try:
+        escritor = csv.DictWriter(archivo, fieldnames=columnas)
+        escritor.writeheader()
+        escritor.writerows(registros)
+    finally:
+        if salida:
+            archivo.close()
+
+
+# NetCDF no admite columnas categóricas ni los tipos de pandas con valores faltantes (Int32, Float64, etc.): las
+# categorías se guardan como texto y las columnas numéricas con faltantes como float64 (NaN).
+def _escribir_netcdf(datos, salida):
+    import numpy as np
+    import pandas
+    columnas = {}
+    for columna, serie in datos.items():
+        if isinstance(serie.dtype, pandas.CategoricalDtype):
+            columnas[columna] = serie.astype(str)
+        elif isinstance(serie.dtype, pandas.api.extensions.ExtensionDtype):
+            if serie.dtype.kind in 'iubf':
+                columnas[columna] = serie.to_numpy(dtype='float64', na_value=np.nan)
+            else:
+                columnas[columna] = serie.astype(object)
+    datos.assign(**columnas).to_xarray().to_netcdf(salida)
+
+
+def comando_fetch(argumentos, credencial):
+    url = f"{argumentos.base_url}/{argumentos.ruta(argumentos, credencial)}"
+    extension = os.path.splitext(argumentos.salida)[1].lower() if argumentos.salida else '.csv'
+    if extension == '.csv':
+        from funciones_api import consumir_servicio_GET
+        respuesta = consumir_servicio_GET(url, *credencial)
+        respuesta.raise_for_status()
+        _escribir_csv(respuesta.json(), argumentos.salida)
+    elif extension in ('.parquet', '.nc'):
+        from funciones_api import consumir_servicio_JSON_tipado
+        datos = consumir_servicio_JSON_tipado(url, *credencial)
+        if extension == '.parquet':
+            datos.to_parquet(argumentos.salida, index=False)
+        else:
+            _escribir_netcdf(datos, argumentos.salida)
+    else:
+        sys.exit(f"Formato de salida no admitido: {extension} (utilizar .csv, .parquet o .nc)")
+
+
+# Los rasters se guardan tal como los devuelve la API (NetCDF)
+def comando_raster(argumentos, credencial):
+    import json
+    import pathlib
+    from funciones_api import consumir_servicio_POST
+    url = f"{argumentos.base_url}/{argumentos.producto.strip('/')}/{_fecha(argumentos.desde)}/" \
+          f"{_fecha(argumentos.hasta)}"
+    zona_geojson = pathlib.Path(argumentos.zona).read_text()
+    respuesta = consumir_servicio_POST(url, *credencial, json.dumps({'zona.geojson': zona_geojson}))
+    respuesta.raise_for_status()
+    pathlib.Path(argumentos.salida).write_bytes(respuesta.content)
+
+
+def _argumentos_periodo(parser):
+    parser.add_argument('omm_id', type=int)
+    parser.add_argument('desde', help='fecha de inicio (AAAA-MM-DD)')
+    parser.add_argument('hasta', help='fecha de fin (AAAA-MM-DD)')
+
+
+def _argumentos_indice(parser, indice=None):
+    _argumentos_periodo(parser)
+    parser.add_argument('--configuracion', type=int, help='id de la configuración del índice')
+    if indice is None:
+        parser.add_argument('--indice', help='nombre del índice (SPI, SPEI, etc.)')
+    parser.add_argument('--escala', type=int, help='escala en meses')
+    parser.add_argument('--distribucion')
+    parser.add_argument('--metodo-ajuste')
+    parser.add_argument('--referencia', type=int, nargs=2, metavar=('DESDE', 'HASTA'),
+                        help='años del período de referencia')
+    parser.set_defaults(ruta=_ruta_indice, indice=indice)
+
+
+def crear_parser():
+    parser = argparse.ArgumentParser(prog='crcsas', description='Descarga de datos de la API del CRC-SAS')
+    parser.add_argument('--base-url', default=os.environ.get('CRCSAS_BASE_URL'),
+                        help='URL base de la API (por defecto, CRCSAS_BASE_URL o la URL pública)')
+    parser.add_argument('--credencial', help='archivo YAML con usuario y clave (por defecto, credencial.yml)')
+    parser.add_argument('--cache', help='directorio de la cache persistente de respuestas')
+    parser.add_argument('--tiempos', action='store_true', help='mostrar un resumen de las consultas al finalizar')
+    comandos = parser.add_subparsers(dest='comando', required=True)
+
+    fetch = comandos.add_parser('fetch', help='descargar una tabla')
+    fetch.set_defaults(funcion=comando_fetch)
+    recursos = fetch.add_subparsers(dest='recurso', required=True)
+    salida = argparse.ArgumentParser(add_help=False)
+    salida.add_argument('--salida', help='archivo de salida (.csv, .parquet o .nc)')
+
+    estaciones = recursos.add_parser('estaciones', parents=[salida], help='estaciones (de un país, opcionalmente)')
+    estaciones.add_argument('iso_pais', nargs='?', help='código ISO de 2 letras')
+    estaciones.set_defaults(ruta=_ruta_estaciones)
+
+    vecinas = recursos.add_parser('vecinas', parents=[salida], help='estaciones vecinas a una estación')
+    vecinas.add_argument('omm_id', type=int)
+    vecinas.add_argument('--max-distancia', type=float, help='distancia máxima (en km)')
+    vecinas.set_defaults(ruta=_ruta_vecinas)
+
+    configuraciones = recursos.add_parser('configuraciones', parents=[salida],
+                                          help='configuraciones de índices de sequía')
+    configuraciones.set_defaults(ruta=_ruta_configuraciones)
+
+    registros = recursos.add_parser('registros', parents=[salida], help='registros diarios de una estación')
+    _argumentos_periodo(registros)
+    registros.add_argument('--variable', help='id de la variable (por ejemplo, prcp)')
+    registros.set_defaults(ruta=_ruta_registros)
+
+    _argumentos_indice(recursos.add_parser('indice', parents=[salida], help='valores de un índice de sequía'))
+    _argumentos_indice(recursos.add_parser('spi', parents=[salida], help='valores de SPI'), 'SPI')
+    _argumentos_indice(recursos.add_parser('spei', parents=[salida], help='valores de SPEI'), 'SPEI')
+
+    raster = comandos.add_parser('raster', help='descargar un producto espacial (NetCDF)')
+    raster.add_argument('producto', help='ruta del producto, por ejemplo chirps/spi/3 o esi/SMN/4WK')
+    raster.add_argument('desde', help='fecha de inicio (AAAA-MM-DD)')
+    raster.add_argument('hasta', help='fecha de fin (AAAA-MM-DD)')
+    raster.add_argument('--zona', required=True, help='archivo GeoJSON con la zona a consultar')
+    raster.add_argument('--salida', required=True, help='archivo NetCDF de salida')
+    raster.set_defaults(funcion=comando_raster)
+    return parser
+
+
+def main(argv=None):
+    argumentos = crear_parser().parse_args(argv)
+    import funciones_api
+    argumentos.base_url = (argumentos.base_url or funciones_api.base_url_default).rstrip('/')
+    credencial = funciones_api.cargar_credencial(argumentos.credencial)
+    if argumentos.cache:
+        funciones_api.activar_cache(argumentos.cache)
+    resumen = None
+    if argumentos.tiempos:
+        from instrumentacion import ResumenEjecucion, registrar_observador
+        resumen = registrar_observador(ResumenEjecucion())
+    try:
+        argumentos.funcion(argumentos, credencial)
+    finally:
+        if resumen is not None:
+            print(resumen.reporte(), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+
+import numpy as np
+import pandas
+
+from pentadas import pentadas_año_a_fecha_fin
+
+
+# Cubos de datos densos (xarray.Dataset) construidos a partir de las respuestas en formato largo de la API.
+# Cada registro se ubica en una celda (estación, fecha, configuración o variable) mediante códigos enteros
+# obtenidos con pandas.factorize, por lo que el cubo se arma en una sola pasada a partir de todas las respuestas.
+# Los valores se guardan como float32. Una vez construido el cubo, la selección por estación o fecha es directa
+# (cubo.sel(omm_id=...)), las operaciones entre configuraciones se alinean automáticamente por estación y fecha
+# (por ejemplo, cubo.valor_indice.sel(indice_configuracion_id=43) - cubo.valor_indice.sel(indice_configuracion_id=3))
+# y el cubo puede guardarse y leerse como NetCDF comprimido.
+
+
+# Construye un cubo a partir de un Data Frame (o una lista de Data Frames, por ejemplo una respuesta por estación).
+# coordenadas: diccionario dimensión -> valores de esa dimensión para cada registro.
+# variables: columnas del Data Frame que se guardan como variables del cubo.
+def _construir_cubo(datos, coordenadas, variables, tipo='float32'):
+    import xarray
+    codigos, valores_coordenadas = [], {}
+    for dimension, valores in coordenadas.items():
+        codigos_dimension, unicos = pandas.factorize(np.asarray(valores), sort=True)
+        codigos.append(codigos_dimension)
+        valores_coordenadas[dimension] = unicos
+    forma = tuple(len(v) for v in valores_coordenadas.values())
+    variables_cubo = {}
+    for variable in variables:
+        arreglo = np.full(forma, np.nan, dtype=tipo)
+        valores = pandas.to_numeric(datos[variable], errors='coerce')
+        arreglo[tuple(codigos)] = valores.to_numpy(dtype=tipo, na_value=np.nan)
+        variables_cubo[variable] = (tuple(coordenadas), arreglo)
+    return xarray.Dataset(variables_cubo, coords=valores_coordenadas)
+
+
+def _unir(datos):
+    return pandas.concat(datos, ignore_index=True) if isinstance(datos, (list, tuple)) else datos
+
+
+# Cubo (omm_id, fecha, indice_configuracion_id) a partir de respuestas de /indices_sequia_valores. La fecha es
+# la fecha de fin de la péntada final de cada período.
+def cubo_indices_sequia(valores, variables=('valor_indice', 'valor_dato', 'percentil_dato')):
+    valores = _unir(valores)
+    return _construir_cubo(valores, {
+        'omm_id': valores['omm_id'],
+        'fecha': pentadas_año_a_fecha_fin(valores['pentada_fin'], valores['ano']),
+        'indice_configuracion_id': valores['indice_configuracion_id'],
+    }, [v for v in variables if v in valores])
+
+
+# Cubo (omm_id, fecha, variable_id) a partir de respuestas de /registros_diarios.
+def cubo_registros_diarios(registros):
+    registros = _unir(registros)
+    return _construir_cubo(registros, {
+        'omm_id': registros['omm_id'],
+        'fecha': registros['fecha'].to_numpy(dtype='datetime64[D]'),
+        'variable_id': registros['variable_id'].astype(str),
+    }, ['valor'])
+
+
+# Agrega al cubo los datos de las estaciones (nombre, latitud, longitud, etc.) como coordenadas de omm_id.
+def agregar_estaciones(cubo, estaciones, columnas=('nombre', 'latitud', 'longitud', 'elevacion')):
+    estaciones = estaciones.drop_duplicates('omm_id').set_index('omm_id').reindex(cubo['omm_id'].values)
+    return cubo.assign_coords({c: ('omm_id', estaciones[c].to_numpy()) for c in columnas if c in estaciones})
+
+
+# Guarda un cubo como NetCDF comprimido.
+def guardar_cubo(cubo, archivo, nivel_compresion=4):
+    cubo.to_netcdf(archivo, encoding={v: {'zlib': True, 'complevel': nivel_compresion} for v in cubo.data_vars})
+
+
+def leer_cubo(archivo):
+    import xarray
+    return xarray.load_dataset(archivo)
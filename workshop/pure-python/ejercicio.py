@@ -4,17 +4,14 @@ import dateutil.parser
 import pandas
 import matplotlib.cm
 import matplotlib.pyplot as plt
-import yaml
 
-from pentadas import fecha_fin_pentada, pentada_año_a_fecha_inicio
-from funciones_api import consumir_servicio_JSON
-
-with open('credencial.yml', 'r') as f:
-    credencial = yaml.safe_load(f.read())
+from pentadas import pentadas_año_a_fecha_fin
+from funciones_api import cargar_credencial, consumir_servicio_JSON
+from consultas_lote import consumir_servicios_JSON_lote
+from cubo_datos import agregar_estaciones, cubo_indices_sequia
 
 base_url = 'https://api.crc-sas.org/ws-api'
-usuario_default = credencial.get('usuario')
-clave_default = credencial.get('clave')
+usuario_default, clave_default = cargar_credencial()
 
 if __name__ == "__main__":
     matplotlib.use('TkAgg')
@@ -36,8 +33,8 @@ if __name__ == "__main__":
     estaciones_vecinas = consumir_servicio_JSON(url=f"{url_vecinas}",
                                                 usuario=usuario_default, clave=clave_default)
     # Se agrega la estación Durazno al dataframe
-    estaciones = estaciones_vecinas[['omm_id', 'nombre']]\
-        .append({'omm_id': '86530', 'nombre': 'Durazno'}, ignore_index=True)
+    estaciones = pandas.concat([estaciones_vecinas[['omm_id', 'nombre']],
+                                pandas.DataFrame([{'omm_id': 86530, 'nombre': 'Durazno'}])], ignore_index=True)
 
     # Vista de estaciones vecinas en una tabla
     print(estaciones.to_markdown(tablefmt="github", showindex=False))
@@ -50,38 +47,37 @@ if __name__ == "__main__":
     # Vista de las configuraciones en una tabla
     print(configuraciones.to_markdown(tablefmt="github", showindex=False))
 
-    # Se buscan las series temporales para todas las estaciones (una a la vez)
-    series_temporales = pandas.DataFrame()
+    # Se buscan las series temporales para todas las estaciones (en paralelo)
     indice_configuracion_id = 3
     fecha_desde = dateutil.parser.parse("2017-01-01").isoformat()
     fecha_hasta = dateutil.parser.parse("2019-12-31").isoformat()
 
-    for estacion in estaciones.itertuples():
-        # Ahora se define la URL para realizar la búsqueda
-        url_valores_indice = f"{base_url}/indices_sequia_valores/{indice_configuracion_id}/" \
-                             f"{estacion.omm_id}/{fecha_desde}/{fecha_hasta}"
-        # Buscar serie temporal y agregar el nombre de la estacion (con ID)
-        serie_temporal_spi = consumir_servicio_JSON(url=url_valores_indice,
-                                                    usuario=usuario_default, clave=clave_default)
-        # Definir la fecha de fin del período a partir del año y la péntada de fin
-        serie_temporal_spi = serie_temporal_spi.assign(
-            fecha_fin_pentada=lambda df: df.apply(
-                lambda x: fecha_fin_pentada(pentada_año_a_fecha_inicio(x['pentada_fin'], x['ano'])), axis=1)
-        )
-        # Agregar nombre para el gráfico
-        serie_temporal_spi['nombre_completo'] = f"{estacion.nombre} ({estacion.omm_id})"
-
-        # Agregar filas a data frame de todas las series temporales
-        series_temporales = series_temporales.append(serie_temporal_spi, ignore_index=True)
+    # Se define un trabajo por estación: las etiquetas identifican a la estación en el resultado
+    trabajos = [({'nombre_completo': f"{estacion.nombre} ({estacion.omm_id})"},
+                 f"{base_url}/indices_sequia_valores/{indice_configuracion_id}/"
+                 f"{estacion.omm_id}/{fecha_desde}/{fecha_hasta}")
+                for estacion in estaciones.itertuples()]
+    series_temporales, errores = consumir_servicios_JSON_lote(trabajos, usuario=usuario_default, clave=clave_default)
+    if not errores.empty:
+        print(errores.to_markdown(tablefmt="github", showindex=False))
+    if series_temporales.empty:
+        raise RuntimeError(f"No se obtuvieron datos para ninguna estación. Primer error: {errores['error'].iloc[0]}"
+                           if not errores.empty else "No se obtuvieron datos para ninguna estación")
+
+    # Definir la fecha de fin del período a partir del año y la péntada de fin
+    series_temporales = series_temporales.assign(
+        fecha_fin_pentada=lambda df: pentadas_año_a_fecha_fin(df['pentada_fin'], df['ano'])
+    )
 
     # Vista de las series_temporales en una tabla
     print(series_temporales.to_markdown(tablefmt="github", showindex=False))
 
-    # Generar gráfico
-    series_temporales.set_index('fecha_fin_pentada', inplace=True)
-    series_temporales.groupby('nombre_completo')['valor_indice']\
-        .plot(legend=True, xlim=('2017-01-01', '2020-01-01'), marker="D")\
-        .map(lambda ax: ax.set(xlabel='Fecha de fin del periodo', ylabel='SPI-3'))
+    # Generar gráfico a partir del cubo (estación x fecha x configuración) de las series temporales
+    cubo = agregar_estaciones(cubo_indices_sequia(series_temporales), estaciones)
+    spi = cubo['valor_indice'].sel(indice_configuracion_id=indice_configuracion_id).to_pandas().T
+    spi.columns = [f"{nombre} ({omm_id})" for omm_id, nombre in zip(cubo['omm_id'].values, cubo['nombre'].values)]
+    spi.plot(legend=True, xlim=('2017-01-01', '2020-01-01'), marker="D",
+             xlabel='Fecha de fin del periodo', ylabel='SPI-3')
     plt.suptitle('Series temporales de SPI-3')
     plt.title('Durazno (UY) y estaciones dentro de un radio de 150 kms.')
     plt.show()
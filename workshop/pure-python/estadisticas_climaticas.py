@@ -0,0 +1,207 @@
+
+import numpy as np
+import pandas
+
+from pentadas import fechas_a_pentada_año, fechas_fin_pentada, fechas_inicio_pentada
+
+
+# Cálculo local de estadísticas móviles, mensuales y normales climatológicas (equivalente a los servicios
+# /estadisticas_moviles, /estadisticas_mensuales y /normales_climatologicas_mensuales) a partir de registros
+# diarios ya descargados (por ejemplo, con el sincronizador o desde el almacén local).
+# Los registros de todas las estaciones y variables se organizan en un arreglo (serie, día). Primero se
+# agregan por péntada con reduceat y luego cada ventana móvil se obtiene como diferencia de sumas acumuladas,
+# por lo que el costo es lineal en la cantidad de días independientemente del ancho de la ventana. La mediana
+# y el MAD no pueden acumularse y se calculan sobre los días de cada ventana, por bloques de ventanas.
+# Los estadísticos se calculan con los datos disponibles de cada ventana; NFaltantes y NDisponibles informan
+# cuántos días faltan y, opcionalmente, se puede descartar las ventanas con demasiados faltantes.
+
+
+estadisticos = ['Suma', 'Media', 'Mediana', 'DesviacionEstandar', 'MAD', 'NFaltantes', 'NDisponibles', 'Ocurrencia']
+
+# Precipitación mínima (en mm) para considerar que un día es lluvioso (estadístico Ocurrencia)
+umbral_ocurrencia = 0.1
+
+
+# Mediana a lo largo del último eje ignorando faltantes (más rápida que numpy.nanmedian: se ordena una sola vez
+# y los faltantes quedan al final de cada fila).
+def _mediana_filas(valores):
+    ordenados = np.sort(valores, axis=-1)
+    n = np.sum(~np.isnan(valores), axis=-1, keepdims=True)
+    inferior = np.take_along_axis(ordenados, np.maximum(n - 1, 0) // 2, axis=-1)
+    superior = np.take_along_axis(ordenados, n // 2 - (n == 0), axis=-1)
+    return np.where(n > 0, (inferior + superior) / 2, np.nan)[..., 0]
+
+
+class SeriesDiarias:
+
+    # registros: Data Frame con columnas omm_id, fecha, variable_id y valor (formato de /registros_diarios).
+    # fecha_desde, fecha_hasta: período a considerar. Al igual que en la API, solamente se consideran las
+    # péntadas completamente incluidas en el período. Si no se indican, se usa el período de los registros.
+    def __init__(self, registros, fecha_desde=None, fecha_hasta=None):
+        fechas = registros['fecha'].to_numpy(dtype='datetime64[D]')
+        if fecha_desde is not None:
+            fecha_desde = np.datetime64(pandas.Timestamp(fecha_desde).date(), 'D')
+            inicio = fechas_inicio_pentada([fecha_desde])[0]
+            inicio = inicio if inicio == fecha_desde else fechas_fin_pentada([fecha_desde])[0] + 1
+        else:
+            inicio = fechas_inicio_pentada([fechas.min()])[0]
+        if fecha_hasta is not None:
+            fecha_hasta = np.datetime64(pandas.Timestamp(fecha_hasta).date(), 'D')
+            fin = fechas_fin_pentada([fecha_hasta])[0]
+            fin = fin if fin == fecha_hasta else fechas_inicio_pentada([fecha_hasta])[0] - 1
+        else:
+            fin = fechas_fin_pentada([fechas.max()])[0]
+
+        # a. Arreglo (serie, día); los días sin registro se consideran faltantes
+        en_periodo = (fechas >= inicio) & (fechas <= fin)
+        registros = registros[en_periodo]
+        codigos_estacion, estaciones = pandas.factorize(registros['omm_id'], sort=True)
+        codigos_variable, variables = pandas.factorize(registros['variable_id'], sort=True)
+        codigos, series = pandas.factorize(codigos_estacion * len(variables) + codigos_variable, sort=True)
+        self.series = pandas.DataFrame({'omm_id': np.asarray(estaciones)[series // len(variables)],
+                                        'variable_id': np.asarray(variables).astype(str)[series % len(variables)]})
+        self.dias = np.arange(inicio, fin + 1)
+        self.valores = np.full((len(self.series), len(self.dias)), np.nan)
+        self.valores[codigos, (fechas[en_periodo] - inicio).astype(int)] = registros['valor'].to_numpy(dtype=float)
+
+        # b. Péntadas (índice continuo: año * 72 + péntada - 1) y primer día de cada una
+        años = self.dias.astype('datetime64[Y]').astype(int) + 1970
+        pentada = años * 72 + fechas_a_pentada_año(self.dias) - 1
+        self.inicio_pentadas = np.r_[0, np.flatnonzero(np.diff(pentada)) + 1] if len(pentada) else np.array([], int)
+        self.pentadas = pentada[self.inicio_pentadas]
+        self.dias_pentada = np.diff(np.r_[self.inicio_pentadas, len(self.dias)])
+
+        # c. Agregados por péntada. Los valores se centran en la media de cada serie para que las diferencias
+        #    de sumas acumuladas de cuadrados no pierdan precisión.
+        validos = ~np.isnan(self.valores)
+        with np.errstate(invalid='ignore'):
+            self._centro = np.nan_to_num(np.nanmean(np.where(validos, self.valores, np.nan), axis=1))
+            centrados = np.where(validos, self.valores - self._centro[:, None], 0.0)
+            lluviosos = self.valores > umbral_ocurrencia
+        reducir = lambda a: np.add.reduceat(a, self.inicio_pentadas, axis=1) if len(self.dias) else a[:, :0]
+        self._n = reducir(validos.astype(np.int64))
+        self._suma = reducir(centrados)
+        self._suma_cuadrados = reducir(centrados ** 2)
+        self._ocurrencia = reducir(lluviosos.astype(np.int64))
+
+    # Suma de cada ventana de ancho_ventana péntadas (una ventana por cada péntada final posible)
+    @staticmethod
+    def _ventanas(agregados, ancho_ventana):
+        acumulados = np.zeros((agregados.shape[0], agregados.shape[1] + 1))
+        np.cumsum(agregados, axis=1, out=acumulados[:, 1:])
+        return acumulados[:, ancho_ventana:] - acumulados[:, :-ancho_ventana]
+
+    # Mediana (o MAD) de cada serie y ventana, calculada sobre los días de cada ventana por bloques de ventanas
+    def _mediana_ventanas(self, ancho_ventana, mad, valores_por_bloque=2 ** 24):
+        desde = self.inicio_pentadas[:len(self.pentadas) - ancho_ventana + 1]
+        hasta = np.r_[self.inicio_pentadas, len(self.dias)][ancho_ventana:]
+        largo = int((hasta - desde).max()) if len(desde) else 0
+        resultado = np.full((len(self.series), len(desde)), np.nan)
+        bloque = max(1, valores_por_bloque // max(1, len(self.series) * largo))
+        for i in range(0, len(desde), bloque):
+            indices = desde[i:i + bloque, None] + np.arange(largo)[None, :]
+            fuera = indices >= hasta[i:i + bloque, None]
+            valores = self.valores[:, np.minimum(indices, len(self.dias) - 1)]
+            valores[:, fuera] = np.nan
+            mediana = _mediana_filas(valores)
+            if mad:
+                # MAD escalado (constante 1.4826, consistente con el desvío estándar para datos normales)
+                mediana = 1.4826 * _mediana_filas(np.abs(valores - mediana[:, :, None]))
+            resultado[:, i:i + bloque] = mediana
+        return resultado
+
+    # Calcula un estadístico para todas las ventanas de ancho_ventana péntadas. Devuelve el arreglo (serie, ventana)
+    # y el índice (en self.pentadas) de la péntada final de cada ventana.
+    def _estadistico_ventanas(self, estadistico, ancho_ventana, max_proporcion_faltantes=None):
+        if estadistico not in estadisticos:
+            raise ValueError(f"Estadístico desconocido: {estadistico}")
+        n = self._ventanas(self._n, ancho_ventana)
+        dias = self._ventanas(self.dias_pentada[None, :], ancho_ventana)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if estadistico in ('Suma', 'Media', 'DesviacionEstandar'):
+                suma = self._ventanas(self._suma, ancho_ventana)
+                if estadistico == 'Suma':
+                    valores = suma + n * self._centro[:, None]
+                elif estadistico == 'Media':
+                    valores = suma / n + self._centro[:, None]
+                else:
+                    suma_cuadrados = self._ventanas(self._suma_cuadrados, ancho_ventana)
+                    valores = np.sqrt(np.maximum(suma_cuadrados - suma ** 2 / n, 0) / (n - 1))
+                    valores[n < 2] = np.nan
+            elif estadistico in ('Mediana', 'MAD'):
+                valores = self._mediana_ventanas(ancho_ventana, mad=estadistico == 'MAD')
+            elif estadistico == 'NFaltantes':
+                valores = dias - n
+            elif estadistico == 'NDisponibles':
+                valores = n.astype(float)
+            else:
+                valores = self._ventanas(self._ocurrencia, ancho_ventana)
+                valores[self.series['variable_id'].to_numpy() != 'prcp'] = np.nan
+
+        if estadistico not in ('NFaltantes', 'NDisponibles'):
+            valores = np.where(n > 0, valores, np.nan)
+            if max_proporcion_faltantes is not None:
+                valores = np.where((dias - n) / dias > max_proporcion_faltantes, np.nan, valores)
+        return valores, np.arange(ancho_ventana - 1, len(self.pentadas))
+
+    # Fechas de inicio y fin de las ventanas que finalizan en las péntadas indicadas
+    def _fechas_ventanas(self, finales, ancho_ventana):
+        inicio = self.dias[self.inicio_pentadas[finales - ancho_ventana + 1]]
+        fin = self.dias[np.r_[self.inicio_pentadas[1:], len(self.dias)][finales] - 1]
+        return inicio, fin
+
+    # Estadísticas móviles con el formato de /estadisticas_moviles: omm_id, fecha_desde, fecha_hasta,
+    # variable_id y valor (para todas las estaciones y variables de los registros).
+    def estadisticas_moviles(self, estadistico, ancho_ventana, max_proporcion_faltantes=None):
+        valores, finales = self._estadistico_ventanas(estadistico, ancho_ventana, max_proporcion_faltantes)
+        fecha_desde, fecha_hasta = self._fechas_ventanas(finales, ancho_ventana)
+        n_series, n_ventanas = valores.shape
+        return pandas.DataFrame({
+            'omm_id': np.repeat(self.series['omm_id'].to_numpy(), n_ventanas),
+            'fecha_desde': np.tile(fecha_desde, n_series),
+            'fecha_hasta': np.tile(fecha_hasta, n_series),
+            'variable_id': np.repeat(self.series['variable_id'].to_numpy(), n_ventanas),
+            'valor': valores.ravel(),
+        })
+
+    # Estadísticas mensuales con el formato de /estadisticas_mensuales: omm_id, anho, mes, variable, estadistico
+    # y valor. Cada mes corresponde a la ventana de 6 péntadas que comienza en la primera péntada del mes.
+    def estadisticas_mensuales(self, estadistico, ano_desde=None, ano_hasta=None, max_proporcion_faltantes=None):
+        valores, finales = self._estadistico_ventanas(estadistico, 6, max_proporcion_faltantes)
+        meses = self.pentadas[finales]
+        seleccion = meses % 6 == 5
+        anho, mes = meses // 72, (meses % 72) // 6 + 1
+        if ano_desde is not None:
+            seleccion &= anho >= ano_desde
+        if ano_hasta is not None:
+            seleccion &= anho <= ano_hasta
+        valores, anho, mes = valores[:, seleccion], anho[seleccion], mes[seleccion]
+        n_series, n_meses = valores.shape
+        return pandas.DataFrame({
+            'omm_id': np.repeat(self.series['omm_id'].to_numpy(), n_meses),
+            'anho': np.tile(anho, n_series),
+            'mes': np.tile(mes, n_series),
+            'variable': np.repeat(self.series['variable_id'].to_numpy(), n_meses),
+            'estadistico': estadistico,
+            'valor': valores.ravel(),
+        })
+
+    # Normales climatológicas mensuales con el formato de /normales_climatologicas_mensuales: para la precipitación,
+    # el promedio de los totales mensuales; para las demás variables, el promedio de las medias mensuales. Se
+    # promedian los meses con datos del período de referencia y se informa la proporción de días con datos.
+    def normales_climatologicas_mensuales(self, ano_desde, ano_hasta):
+        suma = self.estadisticas_mensuales('Suma', ano_desde, ano_hasta)
+        media = self.estadisticas_mensuales('Media', ano_desde, ano_hasta)
+        disponibles = self.estadisticas_mensuales('NDisponibles', ano_desde, ano_hasta)['valor'].to_numpy()
+        mensuales = suma.assign(
+            valor=np.where(suma['variable'] == 'prcp', suma['valor'], media['valor']), disponibles=disponibles)
+        # Los años del período de referencia que no están en los registros se cuentan como faltantes
+        dias_referencia = pandas.Series(np.arange(
+            np.datetime64(f"{ano_desde}-01-01"), np.datetime64(f"{ano_hasta + 1}-01-01"))).dt.month.value_counts()
+        normales = mensuales.groupby(['omm_id', 'variable', 'mes'], sort=True)\
+            .agg(normal=('valor', 'mean'), disponibles=('disponibles', 'sum'))\
+            .reset_index()\
+            .rename(columns={'variable': 'variable_id'})
+        normales['proporcion_datos_disponibles'] = normales['disponibles'] / \
+            normales['mes'].map(dias_referencia).to_numpy()
+        return normales.drop(columns='disponibles')
@@ -0,0 +1,191 @@
+
+import json
+import os
+import pathlib
+import threading
+import matplotlib.path
+import numpy as np
+import pandas
+import scipy.sparse
+
+from grillas import clave_grilla, dimensiones_espaciales, seleccionar_variable, transformar_desde_lonlat
+
+
+# Cálculo local de estadísticas zonales sobre productos grillados (equivalente a los servicios
+# */serie_temporal/* cuando se envían polígonos), a partir de los datasets devueltos por
+# consumir_servicio_espacial_xarray o guardados en el almacén local.
+# Para cada par (grilla, archivo de zonas) se calcula una única vez una matriz dispersa de ponderaciones
+# (zona x píxel) con la fracción de cada píxel cubierta por cada zona. Luego las pilas temporales completas
+# se reducen de forma vectorizada: media y desvío mediante productos matriciales y los percentiles
+# zona por zona sobre todos los pasos de tiempo a la vez.
+
+
+# Estadísticos calculados, con los mismos nombres que devuelve la API
+estadisticos = ['0%', '25%', '50%', '75%', '100%', 'Media', 'Desvio', 'MAD']
+
+_cache_ponderaciones = {}
+_cache_ponderaciones_lock = threading.Lock()
+
+
+# Lee un archivo GeoJSON de polígonos. Devuelve un Data Frame con los atributos de cada zona y, para cada zona,
+# una lista de polígonos formados por arreglos de coordenadas (lon, lat): el anillo exterior y sus huecos.
+def leer_zonas(archivo_geojson_zona):
+    return zonas_geojson(json.loads(pathlib.Path(archivo_geojson_zona).read_text()))
+
+
+# Igual que leer_zonas, a partir del GeoJSON ya decodificado
+def zonas_geojson(geojson):
+    features = geojson['features'] if geojson.get('type') == 'FeatureCollection' else [geojson]
+    propiedades, zonas = [], []
+    for feature in features:
+        geometria = feature['geometry']
+        if geometria['type'] == 'Polygon':
+            poligonos = [geometria['coordinates']]
+        elif geometria['type'] == 'MultiPolygon':
+            poligonos = geometria['coordinates']
+        else:
+            raise ValueError(f"Tipo de geometría no soportado para estadísticas zonales: {geometria['type']}")
+        zonas.append([[np.asarray(anillo, dtype=float)[:, :2] for anillo in poligono] for poligono in poligonos])
+        propiedades.append(feature.get('properties') or {})
+    propiedades = pandas.DataFrame(propiedades)
+    if propiedades.empty:
+        propiedades = pandas.DataFrame({'zona': np.arange(len(zonas))})
+    return propiedades, zonas
+
+
+# Calcula la matriz de ponderaciones (zona x píxel) de un conjunto de zonas sobre una grilla. Cada píxel se
+# divide en supermuestreo x supermuestreo subpíxeles y la ponderación es la fracción de subpíxeles cuyo centro
+# está dentro de la zona (con supermuestreo=1 se seleccionan los píxeles cuyo centro está dentro de la zona).
+# Los píxeles se numeran en el orden (y, x) de la grilla.
+def _calcular_ponderaciones(datos, zonas, supermuestreo):
+    dim_x, dim_y = dimensiones_espaciales(datos)
+    x, y = datos[dim_x].values.astype(float), datos[dim_y].values.astype(float)
+    dx = np.abs(np.median(np.diff(x))) if len(x) > 1 else 0.0
+    dy = np.abs(np.median(np.diff(y))) if len(y) > 1 else 0.0
+    desplazamientos = (np.arange(supermuestreo) + 0.5) / supermuestreo - 0.5
+
+    filas, columnas, valores = [], [], []
+    for z, poligonos in enumerate(zonas):
+        # a. Los vértices se transforman al sistema de referencia de la grilla
+        poligonos = [[np.column_stack(transformar_desde_lonlat(datos, anillo[:, 0], anillo[:, 1]))
+                      for anillo in poligono] for poligono in poligonos]
+        vertices = np.concatenate([anillo for poligono in poligonos for anillo in poligono])
+        (xmin, ymin), (xmax, ymax) = vertices.min(axis=0), vertices.max(axis=0)
+
+        # b. Solamente se evalúan los píxeles dentro del rectángulo que contiene a la zona
+        ix = np.flatnonzero((x >= xmin - dx / 2) & (x <= xmax + dx / 2))
+        iy = np.flatnonzero((y >= ymin - dy / 2) & (y <= ymax + dy / 2))
+        if not len(ix) or not len(iy):
+            continue
+        px = x[ix][None, :, None, None] + desplazamientos[None, None, None, :] * dx
+        py = y[iy][:, None, None, None] + desplazamientos[None, None, :, None] * dy
+        px, py = np.broadcast_arrays(px, py)
+        puntos = np.column_stack([px.ravel(), py.ravel()])
+
+        # c. Un punto está en la zona si está dentro del anillo exterior de algún polígono y fuera de sus huecos
+        dentro = np.zeros(len(puntos), dtype=bool)
+        for exterior, *huecos in poligonos:
+            en_poligono = matplotlib.path.Path(exterior).contains_points(puntos)
+            for hueco in huecos:
+                en_poligono &= ~matplotlib.path.Path(hueco).contains_points(puntos)
+            dentro |= en_poligono
+        fraccion = dentro.reshape(len(iy), len(ix), -1).mean(axis=-1)
+        jj, ii = np.nonzero(fraccion)
+        filas.append(np.full(len(jj), z))
+        columnas.append(iy[jj] * len(x) + ix[ii])
+        valores.append(fraccion[jj, ii])
+
+    concatenar = lambda partes, tipo: np.concatenate(partes) if partes else np.array([], dtype=tipo)
+    return scipy.sparse.csr_matrix(
+        (concatenar(valores, float), (concatenar(filas, int), concatenar(columnas, int))),
+        shape=(len(zonas), len(y) * len(x)))
+
+
+# Devuelve los atributos de las zonas y su matriz de ponderaciones sobre la grilla de datos. El resultado se
+# guarda en memoria por grilla, archivo de zonas (y su fecha de modificación) y supermuestreo.
+def ponderaciones_zonas(datos, archivo_geojson_zona, supermuestreo=1):
+    archivo = pathlib.Path(archivo_geojson_zona).resolve()
+    clave = (clave_grilla(datos), str(archivo), os.stat(archivo).st_mtime_ns, supermuestreo)
+    with _cache_ponderaciones_lock:
+        resultado = _cache_ponderaciones.get(clave)
+    if resultado is None:
+        propiedades, zonas = leer_zonas(archivo)
+        resultado = (propiedades, _calcular_ponderaciones(datos, zonas, supermuestreo))
+        with _cache_ponderaciones_lock:
+            _cache_ponderaciones[clave] = resultado
+    return resultado
+
+
+# Percentiles (con interpolación lineal, como numpy.percentile) de cada fila de un arreglo ya ordenado, en el
+# cual los n primeros valores de cada fila son válidos y los faltantes quedan al final.
+def _percentiles_ordenados(ordenados, n, percentiles):
+    posiciones = np.asarray(percentiles)[None, :] / 100 * (np.maximum(n, 1) - 1)[:, None]
+    inferior = np.floor(posiciones).astype(int)
+    superior = np.minimum(inferior + 1, np.maximum(n, 1)[:, None] - 1)
+    a = np.take_along_axis(ordenados, inferior, axis=1)
+    b = np.take_along_axis(ordenados, superior, axis=1)
+    return np.where(n[:, None] > 0, a + (b - a) * (posiciones - inferior), np.nan)
+
+
+# Calcula los percentiles 0, 25, 50, 75 y 100 y el MAD escalado (constante 1.4826, consistente con el desvío
+# estándar para datos normales) de cada fila (paso de tiempo) de los valores de los píxeles de una zona.
+def _percentiles_mad(valores):
+    ordenados = np.sort(valores, axis=1)
+    n = np.sum(~np.isnan(valores), axis=1)
+    cuantiles = _percentiles_ordenados(ordenados, n, [0, 25, 50, 75, 100])
+    desvios = np.sort(np.abs(valores - cuantiles[:, [2]]), axis=1)
+    return cuantiles, 1.4826 * _percentiles_ordenados(desvios, n, [50])[:, 0]
+
+
+# Calcula las estadísticas zonales de un producto grillado para todas las zonas de un archivo GeoJSON.
+# datos: xarray.Dataset o DataArray con dimensiones espaciales y, opcionalmente, dimensión time.
+# supermuestreo: subdivisiones por lado de cada píxel para ponderar los píxeles parcialmente cubiertos.
+# bloque_tiempo: cantidad de pasos de tiempo que se cargan en memoria a la vez.
+# Devuelve un Data Frame con los atributos de cada zona y las columnas estadistico, fecha y valor (el mismo
+# formato que los servicios */serie_temporal/*). La media y el desvío se ponderan por la fracción cubierta de
+# cada píxel; los percentiles y el MAD se calculan sobre los píxeles que intersectan a la zona.
+def estadisticas_zonales(datos, archivo_geojson_zona, variable=None, supermuestreo=1, bloque_tiempo=64):
+    datos = seleccionar_variable(datos, variable)
+    if 'time' not in datos.dims:
+        datos = datos.expand_dims('time')
+    dim_x, dim_y = dimensiones_espaciales(datos)
+    datos = datos.transpose('time', dim_y, dim_x)
+    propiedades, ponderaciones = ponderaciones_zonas(datos, archivo_geojson_zona, supermuestreo)
+
+    # a. Se recorta la grilla a la ventana que contiene a todas las zonas y se renumeran los píxeles
+    nx = datos.sizes[dim_x]
+    ponderaciones = ponderaciones.tocoo()
+    iy, ix = ponderaciones.col // nx, ponderaciones.col % nx
+    y0, y1 = (iy.min(), iy.max() + 1) if len(iy) else (0, 0)
+    x0, x1 = (ix.min(), ix.max() + 1) if len(ix) else (0, 0)
+    datos = datos.isel({dim_y: slice(y0, y1), dim_x: slice(x0, x1)})
+    ponderaciones = scipy.sparse.csr_matrix(
+        (ponderaciones.data, (ponderaciones.row, (iy - y0) * (x1 - x0) + (ix - x0))),
+        shape=(ponderaciones.shape[0], (y1 - y0) * (x1 - x0)))
+    pixeles = np.split(ponderaciones.indices, ponderaciones.indptr[1:-1])
+
+    # b. Reducción de la pila temporal por bloques
+    n_tiempos = datos.sizes['time']
+    resultado = np.full((len(pixeles), n_tiempos, len(estadisticos)), np.nan)
+    for inicio in range(0, n_tiempos, bloque_tiempo):
+        fin = min(inicio + bloque_tiempo, n_tiempos)
+        valores = np.asarray(datos.isel(time=slice(inicio, fin)).values, dtype=np.float64).reshape(fin - inicio, -1)
+        validos = ~np.isnan(valores)
+        valores_0 = np.where(validos, valores, 0.0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pesos = ponderaciones @ validos.T
+            media = (ponderaciones @ valores_0.T) / pesos
+            varianza = ((ponderaciones @ (valores_0 ** 2).T) - pesos * media ** 2) / (pesos - 1)
+        resultado[:, inicio:fin, 5] = np.where(pesos > 0, media, np.nan)
+        resultado[:, inicio:fin, 6] = np.sqrt(np.where(pesos > 1, np.maximum(varianza, 0), np.nan))
+        for z, indices in enumerate(pixeles):
+            if len(indices):
+                resultado[z, inicio:fin, :5], resultado[z, inicio:fin, 7] = _percentiles_mad(valores[:, indices])
+
+    # c. Resultado en formato largo: zona, fecha, estadístico
+    n_zonas, n_estadisticos = len(pixeles), len(estadisticos)
+    tabla = propiedades.iloc[np.repeat(np.arange(n_zonas), n_tiempos * n_estadisticos)].reset_index(drop=True)
+    return tabla.assign(
+        estadistico=np.tile(estadisticos, n_zonas * n_tiempos),
+        fecha=np.tile(np.repeat(datos['time'].values, n_estadisticos), n_zonas),
+        valor=resultado.ravel())
@@ -0,0 +1,83 @@
+
+import numpy as np
+import pandas
+
+from pentadas import pentadas_año_a_fecha_fin, pentadas_año_a_fecha_inicio
+
+
+# Detección local de eventos secos y húmedos (equivalente al servicio /eventos) a partir de series de índices
+# de sequía devueltas por /indices_sequia_valores (o calculadas localmente).
+# Un evento es una racha de péntadas consecutivas con valores del índice menores o iguales al umbral (eventos
+# secos) o mayores o iguales al umbral (eventos húmedos) que dura al menos la duración mínima indicada. Los
+# valores faltantes y las péntadas ausentes interrumpen las rachas.
+# Las rachas se identifican mediante codificación por longitud de racha (run-length encoding) vectorizada
+# sobre todas las series y todos los umbrales a la vez, y sus estadísticos se calculan con reduceat.
+
+
+# Detecta eventos en muchas series a la vez.
+# valores: Data Frame con columnas omm_id, ano, pentada_fin y valor_indice (y, opcionalmente,
+#          indice_configuracion_id, en cuyo caso cada configuración se trata como una serie distinta).
+# tipo_evento: 'seco' o 'humedo'.
+# umbrales, duraciones_minimas: un valor o una lista de valores; se evalúan todas las combinaciones.
+# Devuelve un Data Frame con las columnas del servicio /eventos más umbral_indice y duracion_minima.
+def detectar_eventos(valores, tipo_evento='seco', umbrales=-1.0, duraciones_minimas=1, columna_valor='valor_indice'):
+    if tipo_evento not in ('seco', 'humedo'):
+        raise ValueError(f"Tipo de evento desconocido: {tipo_evento}")
+    columnas_serie = [c for c in ('indice_configuracion_id', 'omm_id') if c in valores]
+    umbrales = np.atleast_1d(np.asarray(umbrales, dtype=float))
+    duraciones_minimas = np.atleast_1d(np.asarray(duraciones_minimas, dtype=int))
+
+    # a. Series ordenadas por serie y péntada (índice de péntada continuo: año * 72 + péntada - 1)
+    valores = valores.sort_values(columnas_serie + ['ano', 'pentada_fin'], kind='stable')
+    serie = valores.groupby(columnas_serie, sort=False).ngroup().to_numpy()
+    pentada = valores['ano'].to_numpy(dtype=np.int64) * 72 + valores['pentada_fin'].to_numpy(dtype=np.int64) - 1
+    indice = valores[columna_valor].to_numpy(dtype=np.float64)
+    n = len(indice)
+
+    # b. Condición de evento para cada umbral (umbral x péntada) y comienzo de cada racha: la condición se cumple
+    #    y no se cumplía en la péntada anterior de la misma serie
+    with np.errstate(invalid='ignore'):
+        condicion = indice[None, :] <= umbrales[:, None] if tipo_evento == 'seco' else \
+            indice[None, :] >= umbrales[:, None]
+    continua = np.r_[False, (serie[1:] == serie[:-1]) & (pentada[1:] == pentada[:-1] + 1)]
+    comienzo = condicion & ~(np.concatenate([np.zeros((len(umbrales), 1), dtype=bool), condicion[:, :-1]], axis=1)
+                             & continua[None, :])
+
+    # c. Estadísticos de cada racha: las rachas son segmentos contiguos de las posiciones que cumplen la condición
+    posiciones = np.flatnonzero(condicion.ravel())
+    inicios = np.flatnonzero(comienzo.ravel()[posiciones])
+    en_racha = indice[posiciones % n] if n else np.array([])
+    if not len(inicios):
+        rachas = pandas.DataFrame(columns=['umbral', 'primera', 'ultima', 'intensidad', 'magnitud', 'duracion',
+                                           'minimo', 'maximo'])
+    else:
+        duracion = np.diff(np.r_[inicios, len(posiciones)])
+        magnitud = np.add.reduceat(en_racha, inicios)
+        rachas = pandas.DataFrame({
+            'umbral': posiciones[inicios] // n,
+            'primera': posiciones[inicios] % n,
+            'ultima': posiciones[inicios + duracion - 1] % n,
+            'intensidad': magnitud / duracion,
+            'magnitud': magnitud,
+            'duracion': duracion,
+            'minimo': np.minimum.reduceat(en_racha, inicios),
+            'maximo': np.maximum.reduceat(en_racha, inicios),
+        })
+
+    # d. Eventos para cada duración mínima, numerados por serie, umbral y duración mínima
+    eventos = pandas.concat([rachas[rachas['duracion'] >= d].assign(duracion_minima=d) for d in duraciones_minimas],
+                            ignore_index=True)
+    primera, ultima = eventos['primera'].to_numpy(dtype=int), eventos['ultima'].to_numpy(dtype=int)
+    resultado = valores[columnas_serie].iloc[primera].reset_index(drop=True).assign(
+        umbral_indice=umbrales[eventos['umbral'].to_numpy(dtype=int)],
+        duracion_minima=eventos['duracion_minima'].to_numpy(dtype=int))
+    resultado['numero_evento'] = resultado.groupby(columnas_serie + ['umbral_indice', 'duracion_minima'],
+                                                   sort=False).cumcount() + 1
+    resultado['fecha_inicio'] = pentadas_año_a_fecha_inicio(valores['pentada_fin'].to_numpy()[primera],
+                                                            valores['ano'].to_numpy()[primera])
+    resultado['fecha_fin'] = pentadas_año_a_fecha_fin(valores['pentada_fin'].to_numpy()[ultima],
+                                                      valores['ano'].to_numpy()[ultima])
+    for columna in ('intensidad', 'magnitud', 'duracion', 'minimo', 'maximo'):
+        resultado[columna] = eventos[columna].to_numpy(dtype=int if columna == 'duracion' else float)
+    return resultado.sort_values(columnas_serie + ['umbral_indice', 'duracion_minima', 'numero_evento'],
+                                 kind='stable', ignore_index=True)
@@ -1,26 +1,152 @@
 
-import pandas
+import functools
+import hashlib
+import io
+import os
 import requests
+import requests.adapters
 import requests.auth
-import pathlib
-import json
-import dateutil.parser
-import netCDF4
-import numpy as np
+import shutil
+import tempfile
+import threading
+
+from urllib3.util.retry import Retry
+
+from instrumentacion import medir
+
+# Los paquetes pesados (pandas, numpy, netCDF4, xarray) se importan dentro de las funciones que los utilizan,
+# para que los procesos cortos (por ejemplo, los comandos de crcsas.py) no paguen su tiempo de carga si no los usan.
+
+
+# URL base común a todos los servicios de la API del CRC-SAS
+base_url_default = 'https://api.crc-sas.org/ws-api'
+
+
+# Credenciales de acceso a la API (usuario, clave). Se toman de las variables de entorno CRCSAS_USUARIO y
+# CRCSAS_CLAVE o, si no están definidas, del archivo credencial.yml (o del indicado en CRCSAS_CREDENCIAL).
+# El archivo se lee una única vez por proceso.
+@functools.lru_cache(maxsize=None)
+def cargar_credencial(archivo=None):
+    usuario, clave = os.environ.get('CRCSAS_USUARIO'), os.environ.get('CRCSAS_CLAVE')
+    if usuario and clave:
+        return usuario, clave
+    import yaml
+    with open(archivo or os.environ.get('CRCSAS_CREDENCIAL', 'credencial.yml'), 'r') as f:
+        credencial = yaml.safe_load(f.read())
+    return credencial.get('usuario'), credencial.get('clave')
+
+
+# Cliente reutilizable para acceder a la API del CRC-SAS.
+# Mantiene una única sesión HTTP (requests.Session) con un pool de conexiones persistentes (keep-alive),
+# de manera que las sucesivas consultas reutilizan la misma conexión TCP+TLS en lugar de abrir una nueva
+# por cada llamada. La sesión también conserva las credenciales (autenticación básica), negocia compresión
+# gzip con el servidor, aplica timeouts y reintenta las consultas fallidas con espera exponencial (backoff).
+# Opcionalmente, las respuestas pueden guardarse en una cache persistente (ver cache_respuestas.CacheRespuestas).
+class ClienteAPI:
+
+    def __init__(self, usuario, clave, base_url=base_url_default, tamano_pool=10,
+                 timeout=(10, 300), reintentos=3, factor_espera=0.5, cache=None):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.cache = cache
+        # Hash de las credenciales: forma parte de la clave de las respuestas guardadas en la cache
+        self.credencial = hashlib.sha256(f"{usuario}\n{clave}".encode('utf-8')).hexdigest()
+        self.sesion = requests.Session()
+        self.sesion.auth = requests.auth.HTTPBasicAuth(usuario, clave)
+        self.sesion.headers.update({'Accept-Encoding': 'gzip, deflate'})
+
+        # Se reintentan errores de conexión, respuestas 429 (demasiadas consultas) y errores 5xx del servidor.
+        # Se incluye POST porque las consultas espaciales de la API no modifican datos en el servidor.
+        politica_reintentos = Retry(total=reintentos, backoff_factor=factor_espera,
+                                    status_forcelist=(429, 500, 502, 503, 504),
+                                    allowed_methods=frozenset(['GET', 'POST']),
+                                    raise_on_status=False)
+        adaptador = requests.adapters.HTTPAdapter(pool_connections=tamano_pool, pool_maxsize=tamano_pool,
+                                                  max_retries=politica_reintentos)
+        self.sesion.mount('https://', adaptador)
+        self.sesion.mount('http://', adaptador)
+
+    # Construye la URL completa. Se aceptan tanto URLs absolutas como rutas relativas a la URL base.
+    def url(self, ruta):
+        return ruta if ruta.startswith(('http://', 'https://')) else f"{self.base_url}/{ruta.lstrip('/')}"
+
+    def get(self, ruta, **kwargs):
+        return self._consultar('GET', self.url(ruta), None, **kwargs)
+
+    def post(self, ruta, data, **kwargs):
+        return self._consultar('POST', self.url(ruta), data, **kwargs)
+
+    # Las descargas en modo stream no pasan por la cache, ya que su contenido no se lee por completo.
+    def _consultar(self, metodo, url, data, **kwargs):
+        usar_cache = self.cache is not None and not kwargs.get('stream', False)
+        if usar_cache:
+            respuesta = self.cache.obtener(metodo, url, data, self.credencial)
+            if respuesta is not None:
+                return respuesta
+        respuesta = self.sesion.request(metodo, url=url, data=data,
+                                        timeout=kwargs.pop('timeout', self.timeout), **kwargs)
+        if usar_cache:
+            self.cache.guardar(metodo, url, data, respuesta, self.credencial)
+        return respuesta
+
+    def cerrar(self):
+        self.sesion.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.cerrar()
+
+
+# Clientes compartidos por las funciones consumir_servicio_*, uno por cada par de credenciales.
+# Se crean la primera vez que se usan y luego se reutilizan (junto con sus conexiones abiertas).
+_clientes = {}
+_clientes_lock = threading.Lock()
+_cache = None
+
+# La biblioteca netCDF-C (HDF5) no admite accesos simultáneos desde distintos hilos, por lo que la lectura
+# (y escritura) de archivos NetCDF con netCDF4 se serializa mediante este lock, compartido por todo el proceso.
+netcdf_lock = threading.Lock()
+
+
+# Devuelve el cliente compartido asociado a un usuario y clave (creándolo si aún no existe).
+def obtener_cliente(usuario, clave):
+    with _clientes_lock:
+        cliente = _clientes.get((usuario, clave))
+        if cliente is None:
+            cliente = _clientes[(usuario, clave)] = ClienteAPI(usuario, clave, cache=_cache)
+        return cliente
+
+
+# Activa una cache persistente de respuestas para todas las funciones consumir_servicio_*.
+# Los parámetros adicionales (tamaño máximo, reglas de tiempo de vida, etc.) se pasan a CacheRespuestas.
+def activar_cache(directorio, **kwargs):
+    global _cache
+    from cache_respuestas import CacheRespuestas
+    with _clientes_lock:
+        _cache = CacheRespuestas(directorio, **kwargs)
+        for cliente in _clientes.values():
+            cliente.cache = _cache
+    return _cache
 
 
 # Definición de funciones globales, en lenguaje Python.
 # Función para acceder a un servicio web definido por una URL utilizando el método GET.
 # Devuelve la respuesta como un pandas.DataFrame.
 def consumir_servicio_GET(url, usuario, clave):
-    respuesta = requests.get(url=url, auth=requests.auth.HTTPBasicAuth(usuario, clave))
+    with medir('consumir_servicio_GET', url) as medicion:
+        respuesta = obtener_cliente(usuario, clave).get(url)
+        medicion.respuesta(respuesta)
     return respuesta
 
 
 # Función para acceder a un servicio web definido por una URL utilizando el método POST.
 # Devuelve la respuesta como un pandas.DataFrame.
 def consumir_servicio_POST(url, usuario, clave, data):
-    respuesta = requests.post(url=url, data=data, auth=requests.auth.HTTPBasicAuth(usuario, clave))
+    with medir('consumir_servicio_POST', url, 'POST') as medicion:
+        respuesta = obtener_cliente(usuario, clave).post(url, data=data)
+        medicion.respuesta(respuesta)
     return respuesta
 
 
@@ -29,29 +155,136 @@ def consumir_servicio_POST(url, usuario, clave, data):
 # Asumiendo que la respuesta es un string JSON, se hace la conversión
 # de este string a un Data Frame.
 def consumir_servicio_JSON(url, usuario, clave):
-    respuesta = consumir_servicio_GET(url, usuario, clave)
-    return pandas.json_normalize(respuesta.json())
+    import pandas
+    with medir('consumir_servicio_JSON', url) as medicion:
+        respuesta = obtener_cliente(usuario, clave).get(url)
+        medicion.respuesta(respuesta)
+        datos = pandas.json_normalize(respuesta.json())
+        medicion.decodificacion(filas=len(datos))
+    return datos
+
+
+# Función para acceder a un servicio web definido por una URL utilizando
+# un usuario y clave.
+# A diferencia de consumir_servicio_JSON, la respuesta se decodifica a medida que se descarga y las
+# columnas se convierten a los tipos definidos para cada servicio (ver json_tipado.esquemas_default).
+# Se puede indicar un esquema propio como un diccionario {columna: tipo}.
+def consumir_servicio_JSON_tipado(url, usuario, clave, esquema=None):
+    from json_tipado import esquema_para_url, leer_json_tipado
+    cliente = obtener_cliente(usuario, clave)
+    esquema = esquema or esquema_para_url(url)
+    with medir('consumir_servicio_JSON_tipado', url) as medicion:
+        if cliente.cache is not None:
+            # Con la cache activa se descarga la respuesta completa para poder guardarla
+            respuesta = cliente.get(url)
+            medicion.respuesta(respuesta)
+            respuesta.raise_for_status()
+            datos = leer_json_tipado(io.BytesIO(respuesta.content), esquema)
+        else:
+            # La descarga y la decodificación se realizan en simultáneo, por lo que se miden como una sola etapa
+            with cliente.get(url, stream=True) as respuesta:
+                medicion.respuesta(respuesta, descargada=False)
+                respuesta.raise_for_status()
+                respuesta.raw.decode_content = True
+                datos = leer_json_tipado(respuesta.raw, esquema)
+                medicion.descarga(respuesta)
+        medicion.decodificacion(filas=len(datos))
+    return datos
 
 
 # Función para acceder a un servicio web definido por una URL utilizando un usuario y clave.
 # Se envía un archivo GeoJSON para realizar la consulta en un área determinada.
 # La respuesta se devuelve con un objeto de tipo raster.
-def consumir_servicio_espacial(url, usuario, clave, archivo_geojson_zona, raster_var_tag):
+# El archivo GeoJSON se lee una única vez (ver registro_zonas). Con resolucion (en grados, o 'auto' para utilizar
+# la resolución conocida del producto) se envían los polígonos simplificados de acuerdo a la grilla del producto.
+def consumir_servicio_espacial(url, usuario, clave, archivo_geojson_zona, raster_var_tag, resolucion=None):
+    import dateutil.parser
+    import netCDF4
+    import numpy as np
+    from registro_zonas import payload_zona
+
     # a. Obtener datos y guardarlos en un archivo temporal (en memoria)
-    zona_geojson = pathlib.Path(archivo_geojson_zona).read_text()
-    respuesta = consumir_servicio_POST(url, usuario, clave, json.dumps({'zona.geojson': zona_geojson}))
+    cuerpo = payload_zona(archivo_geojson_zona, resolucion, url)
+    with medir('consumir_servicio_espacial', url, 'POST') as medicion:
+        respuesta = obtener_cliente(usuario, clave).post(url, data=cuerpo)
+        medicion.respuesta(respuesta)
 
-    # b. En lugar de abrir y leer un archivo, se leen los bytes recibidos
-    archivo_nc = netCDF4.Dataset("in-mem-file", mode="r", memory=respuesta.content)
+        with netcdf_lock:
+            # b. En lugar de abrir y leer un archivo, se leen los bytes recibidos
+            archivo_nc = netCDF4.Dataset("in-mem-file", mode="r", memory=respuesta.content)
 
-    # c. Obtener CRS y fechas del NetCDF
-    nc_prj4string = archivo_nc.crs
-    nc_start_date = np.array([dateutil.parser.isoparse(archivo_nc.start_date)])
-    nc_variable = archivo_nc.variables.get('time')
-    nc_fechas = netCDF4.num2date(nc_variable[:].flatten(), nc_variable.units) if nc_variable else nc_start_date
-    nc_rasters = archivo_nc.variables.get(raster_var_tag)[:]  # rasters como variables netcdf
+            # c. Obtener CRS y fechas del NetCDF
+            nc_prj4string = archivo_nc.crs
+            nc_start_date = np.array([dateutil.parser.isoparse(archivo_nc.start_date)])
+            nc_variable = archivo_nc.variables.get('time')
+            nc_fechas = netCDF4.num2date(nc_variable[:].flatten(), nc_variable.units) if nc_variable \
+                else nc_start_date
+            nc_rasters = archivo_nc.variables.get(raster_var_tag)[:]  # rasters como variables netcdf
 
-    # d. Borrar archivo temporal, liberar memoria
-    archivo_nc.close()
+            # d. Borrar archivo temporal, liberar memoria
+            archivo_nc.close()
+        medicion.decodificacion(filas=len(nc_fechas), celdas=nc_rasters.size)
 
     return nc_fechas, nc_rasters  # los rasters se devuelven como variables netcdf
+
+
+# Función para acceder a un servicio web definido por una URL utilizando un usuario y clave.
+# Se envía un archivo GeoJSON para realizar la consulta en un área determinada.
+# La respuesta se devuelve con un objeto de tipo xarray.
+# A diferencia de consumir_servicio_espacial, la respuesta no se mantiene en memoria: se descarga (en modo
+# stream) a un archivo temporal y se abre de forma perezosa, con variables divididas en bloques (dask).
+# Solamente se leen del disco los pasos de tiempo y las ventanas que efectivamente se seleccionan, y la
+# variable time se decodifica directamente como datetime64. El archivo temporal se elimina al cerrar el dataset.
+# La zona y el parámetro resolucion se tratan como en consumir_servicio_espacial.
+def consumir_servicio_espacial_xarray(url, usuario, clave, archivo_geojson_zona, chunks=None, directorio_temporal=None,
+                                      resolucion=None):
+    import xarray
+    from registro_zonas import payload_zona
+
+    # a. Obtener datos y guardarlos en un archivo temporal (en disco). Si la descarga o la apertura fallan, el
+    #    archivo temporal se elimina antes de propagar el error.
+    cuerpo = payload_zona(archivo_geojson_zona, resolucion, url)
+    archivo = tempfile.NamedTemporaryFile(suffix='.nc', dir=directorio_temporal, delete=False)
+    try:
+        with medir('consumir_servicio_espacial_xarray', url, 'POST') as medicion:
+            with archivo, obtener_cliente(usuario, clave).post(url, data=cuerpo, stream=True) as respuesta:
+                medicion.respuesta(respuesta, descargada=False)
+                respuesta.raise_for_status()
+                respuesta.raw.decode_content = True
+                shutil.copyfileobj(respuesta.raw, archivo, length=1024 * 1024)
+                medicion.descarga(respuesta, bytes=archivo.tell())
+
+            # b. Abrir el archivo de forma perezosa (por defecto, un bloque por paso de tiempo).
+            #    Como la lectura es perezosa, la decodificación medida solamente incluye los metadatos.
+            almacen = xarray.backends.NetCDF4DataStore.open(archivo.name)
+            try:
+                archivo_xr = xarray.open_dataset(almacen, chunks=chunks or {'time': 1})
+            except BaseException:
+                almacen.close()
+                raise
+            medicion.decodificacion(celdas=sum(v.size for v in archivo_xr.data_vars.values()))
+    except BaseException:
+        os.remove(archivo.name)
+        raise
+
+    # c. Al cerrar el dataset también se elimina el archivo temporal
+    def cerrar_y_eliminar():
+        almacen.close()
+        if os.path.exists(archivo.name):
+            os.remove(archivo.name)
+    archivo_xr.set_close(cerrar_y_eliminar)
+
+    return archivo_xr  # se devuelve un objeto xarray (perezoso)
+
+
+# Decodifica una respuesta NetCDF (en memoria) como un dataset de xarray, con los datos ya cargados.
+# La lectura se serializa con netcdf_lock, por lo que puede utilizarse desde varios hilos.
+def leer_netcdf(contenido):
+    import netCDF4
+    import xarray
+    with netcdf_lock:
+        archivo_nc = netCDF4.Dataset('in-mem-file', mode='r', memory=contenido)
+        try:
+            return xarray.open_dataset(xarray.backends.NetCDF4DataStore(archivo_nc)).load()
+        finally:
+            archivo_nc.close()
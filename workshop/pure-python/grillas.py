@@ -0,0 +1,68 @@
+
+import hashlib
+import numpy as np
+
+
+# Funciones auxiliares para trabajar con las grillas de los productos espaciales devueltos por la API.
+# Según el producto, las dimensiones espaciales se denominan longitude/latitude (EPSG:4326) o
+# easting/northing (Gauss-Krüger, EPSG:22195).
+nombres_x = ('longitude', 'lon', 'easting', 'x')
+nombres_y = ('latitude', 'lat', 'northing', 'y')
+
+# Sistema de referencia de las grillas con coordenadas proyectadas (cuando el dataset no lo indica)
+crs_proyectado_default = 'EPSG:22195'
+
+
+# Devuelve los nombres de las dimensiones espaciales (x, y) de un dataset o data array de xarray.
+def dimensiones_espaciales(datos):
+    dim_x = next((d for d in nombres_x if d in datos.dims), None)
+    dim_y = next((d for d in nombres_y if d in datos.dims), None)
+    if dim_x is None or dim_y is None:
+        raise ValueError(f"No se encontraron dimensiones espaciales en {tuple(datos.dims)}")
+    return dim_x, dim_y
+
+
+# Devuelve un data array de un dataset: la variable indicada o la única variable con dimensiones espaciales.
+# El data array conserva los atributos del dataset (por ejemplo, el crs de las grillas proyectadas), salvo los
+# que la variable redefine.
+def seleccionar_variable(datos, variable):
+    if not hasattr(datos, 'data_vars'):
+        return datos
+    if variable is None:
+        dim_x, dim_y = dimensiones_espaciales(datos)
+        variables = [v for v in datos.data_vars if {dim_x, dim_y} <= set(datos[v].dims)]
+        if len(variables) != 1:
+            raise ValueError(f"Debe indicarse la variable a utilizar entre {variables}")
+        variable = variables[0]
+    return datos[variable].assign_attrs({**datos.attrs, **datos[variable].attrs})
+
+
+# Devuelve una clave que identifica a una grilla (nombres y valores de sus coordenadas espaciales),
+# utilizada para reutilizar cálculos que solo dependen de la grilla (máscaras de zonas, índices de puntos, etc.).
+def clave_grilla(datos):
+    dim_x, dim_y = dimensiones_espaciales(datos)
+    digesto = hashlib.sha1()
+    for dim in (dim_x, dim_y):
+        digesto.update(dim.encode())
+        digesto.update(np.ascontiguousarray(datos[dim].values, dtype=np.float64).tobytes())
+    return digesto.hexdigest()
+
+
+# Devuelve el sistema de referencia de una grilla: EPSG:4326 para grillas en longitud/latitud y, para grillas
+# proyectadas, el indicado en los atributos del dataset (atributo crs del NetCDF) o Gauss-Krüger por defecto.
+def crs_grilla(datos):
+    dim_x, _ = dimensiones_espaciales(datos)
+    if dim_x in ('longitude', 'lon'):
+        return 'EPSG:4326'
+    return datos.attrs.get('crs') or crs_proyectado_default
+
+
+# Convierte coordenadas de longitud y latitud (EPSG:4326) al sistema de referencia de una grilla.
+def transformar_desde_lonlat(datos, longitudes, latitudes):
+    longitudes, latitudes = np.asarray(longitudes, dtype=float), np.asarray(latitudes, dtype=float)
+    crs = crs_grilla(datos)
+    if crs == 'EPSG:4326':
+        return longitudes, latitudes
+    import pyproj
+    transformador = pyproj.Transformer.from_crs('EPSG:4326', crs, always_xy=True)
+    return transformador.transform(longitudes, latitudes)
@@ -0,0 +1,138 @@
+
+import concurrent.futures
+import numpy as np
+import pandas
+import scipy.special
+import scipy.stats
+
+
+# Cálculo local de índices de sequía estandarizados (SPI, SPEI) para muchas estaciones a la vez.
+# Los datos de entrada (precipitación acumulada para la escala del índice o, en el caso del SPEI, precipitación
+# menos evapotranspiración potencial) se organizan en un arreglo de dimensiones (estación, año, péntada).
+# Para cada par (estación, péntada) se ajusta una distribución con los años del período de referencia y
+# luego se transforman todos los valores a la distribución normal estándar. Los ajustes se hacen en forma
+# vectorizada sobre todas las celdas (estación, péntada) de un bloque de estaciones, y los bloques pueden
+# repartirse entre varios procesos.
+
+
+# Organiza los datos en formato largo (omm_id, ano, pentada_fin, valor) en un arreglo (estación, año, péntada).
+def _a_arreglo(datos, columna_valor):
+    estaciones, codigos_estacion = np.unique(datos['omm_id'].to_numpy(), return_inverse=True)
+    ano_minimo, ano_maximo = int(datos['ano'].min()), int(datos['ano'].max())
+    arreglo = np.full((len(estaciones), ano_maximo - ano_minimo + 1, 72), np.nan)
+    arreglo[codigos_estacion, datos['ano'].to_numpy(dtype=int) - ano_minimo,
+            datos['pentada_fin'].to_numpy(dtype=int) - 1] = datos[columna_valor].to_numpy(dtype=float)
+    return estaciones, np.arange(ano_minimo, ano_maximo + 1), arreglo
+
+
+# Ajuste de la distribución gamma por máxima verosimilitud (método de Newton sobre el parámetro de forma,
+# partiendo de la aproximación de Thom). Los valores nulos se excluyen del ajuste y se consideran a través
+# de la probabilidad de precipitación nula. Todos los argumentos son arreglos (celda, año).
+def _cdf_gamma(referencia, valores):
+    positivos = np.where(referencia > 0, referencia, np.nan)
+    n_validos = np.sum(~np.isnan(referencia), axis=-1)
+    n_ceros = np.sum(referencia == 0, axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        media = np.nanmean(positivos, axis=-1)
+        a = np.log(media) - np.nanmean(np.log(positivos), axis=-1)
+        forma = (1 + np.sqrt(1 + 4 * a / 3)) / (4 * a)
+        for _ in range(20):
+            forma = forma - (np.log(forma) - scipy.special.digamma(forma) - a) / \
+                (1 / forma - scipy.special.polygamma(1, forma))
+        escala = media / forma
+        prob_cero = n_ceros / n_validos
+        cdf = prob_cero[:, None] + (1 - prob_cero[:, None]) * \
+            scipy.special.gammainc(forma[:, None], np.maximum(valores, 0) / escala[:, None])
+        # Corrección de Stagge et al. (2015) para los valores nulos: se usa el centro de masa de la probabilidad
+        cdf = np.where(valores == 0, ((n_ceros + 1) / (2 * (n_validos + 1)))[:, None], cdf)
+    return cdf
+
+
+# Ajuste de la distribución log-logística de tres parámetros por momentos L (método utilizado para el SPEI,
+# según Vicente-Serrano et al., 2010), calculado a partir de momentos ponderados por probabilidad.
+def _cdf_log_logistica(referencia, valores):
+    ordenados = np.sort(referencia, axis=-1)  # los faltantes quedan al final
+    n = np.sum(~np.isnan(referencia), axis=-1)[:, None]
+    i = np.arange(1, referencia.shape[-1] + 1)[None, :]
+    f = (i - 0.35) / n
+    with np.errstate(divide='ignore', invalid='ignore'):
+        w0, w1, w2 = [np.nanmean(np.where(i <= n, (1 - f) ** s * ordenados, np.nan), axis=-1) for s in range(3)]
+        beta = (2 * w1 - w0) / (6 * w1 - w0 - 6 * w2)
+        gammas = scipy.special.gamma(1 + 1 / beta) * scipy.special.gamma(1 - 1 / beta)
+        alfa = (w0 - 2 * w1) * beta / gammas
+        gamma = w0 - alfa * gammas
+        cdf = 1 / (1 + (alfa[:, None] / (valores - gamma[:, None])) ** beta[:, None])
+    return np.where(valores - gamma[:, None] <= 0, 0.0, cdf)
+
+
+# Ajuste no paramétrico: probabilidad empírica con la posición de graficación de Gringorten.
+def _cdf_no_parametrica(referencia, valores):
+    n = np.sum(~np.isnan(referencia), axis=-1)[:, None]
+    rango = np.sum(referencia[:, None, :] <= valores[:, :, None], axis=-1)
+    return (rango - 0.44) / (n + 0.12)
+
+
+distribuciones = {
+    'gamma': _cdf_gamma,
+    'log-logistica': _cdf_log_logistica,
+    'no-parametrica': _cdf_no_parametrica,
+}
+
+
+# Calcula los índices para un bloque de estaciones. arreglo tiene dimensiones (estación, año, péntada) y
+# en_referencia es una máscara booleana de los años del período de referencia.
+def _calcular_bloque(arreglo, en_referencia, distribucion, min_datos):
+    estaciones, anos, pentadas = arreglo.shape
+    # Se reordena a (celda, año), donde cada celda es un par (estación, péntada)
+    valores = arreglo.transpose(0, 2, 1).reshape(-1, anos)
+    referencia = valores[:, en_referencia]
+    cdf = distribuciones[distribucion](referencia, valores)
+    insuficientes = np.sum(~np.isnan(referencia), axis=-1) < min_datos
+    cdf[insuficientes] = np.nan
+    cdf = np.where(np.isnan(valores), np.nan, cdf)
+    return cdf.reshape(estaciones, pentadas, anos).transpose(0, 2, 1)
+
+
+# Calcula un índice estandarizado (SPI, SPEI) a partir de datos acumulados de muchas estaciones.
+# datos: Data Frame con columnas omm_id, ano, pentada_fin y la columna de valores (por defecto valor_dato,
+#        que es el dato de entrada que devuelve el servicio /indices_sequia_valores).
+# referencia: años de inicio y fin del período de referencia.
+# distribucion: 'gamma' (SPI), 'log-logistica' (SPEI) o 'no-parametrica'.
+# procesos: cantidad de procesos entre los cuales se reparten las estaciones (None = un solo proceso).
+# Devuelve un Data Frame con las columnas omm_id, ano, pentada_fin, valor_dato, valor_indice y percentil_dato.
+def calcular_indice(datos, referencia=(1971, 2010), distribucion='gamma', columna_valor='valor_dato',
+                    min_datos=10, limite=3.0, procesos=None, estaciones_por_bloque=50):
+    estaciones, anos, arreglo = _a_arreglo(datos, columna_valor)
+    en_referencia = (anos >= referencia[0]) & (anos <= referencia[1])
+
+    bloques = [arreglo[i:i + estaciones_por_bloque] for i in range(0, len(estaciones), estaciones_por_bloque)]
+    argumentos = (bloques, [en_referencia] * len(bloques), [distribucion] * len(bloques), [min_datos] * len(bloques))
+    if procesos and len(bloques) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=procesos) as ejecutor:
+            cdf = np.concatenate(list(ejecutor.map(_calcular_bloque, *argumentos)))
+    else:
+        cdf = np.concatenate(list(map(_calcular_bloque, *argumentos)))
+
+    indice = scipy.stats.norm.ppf(np.clip(cdf, 1e-12, 1 - 1e-12))
+    if limite is not None:
+        indice = np.clip(indice, -limite, limite)
+
+    e, a, p = np.nonzero(~np.isnan(arreglo))
+    return pandas.DataFrame({
+        'omm_id': estaciones[e], 'ano': anos[a], 'pentada_fin': p + 1, 'valor_dato': arreglo[e, a, p],
+        'valor_indice': indice[e, a, p], 'percentil_dato': 100 * cdf[e, a, p],
+    })
+
+
+# Compara los valores calculados localmente con los devueltos por la API (/indices_sequia_valores) para la
+# misma configuración. Devuelve, por estación, la cantidad de valores comparados, la máxima diferencia absoluta
+# y la raíz del error cuadrático medio.
+def comparar_con_api(calculado, api):
+    unidos = calculado.merge(api, on=['omm_id', 'ano', 'pentada_fin'], suffixes=('', '_api'))
+    unidos = unidos.dropna(subset=['valor_indice', 'valor_indice_api'])
+    diferencia = (unidos['valor_indice'] - unidos['valor_indice_api']).abs()
+    return unidos.assign(diferencia=diferencia, diferencia_cuadrado=diferencia ** 2)\
+        .groupby('omm_id')\
+        .agg(n=('diferencia', 'size'), max_diferencia=('diferencia', 'max'), rmse=('diferencia_cuadrado', 'mean'))\
+        .assign(rmse=lambda df: np.sqrt(df['rmse']))\
+        .reset_index()
@@ -0,0 +1,257 @@
+
+import logging
+import threading
+import time
+
+
+# Instrumentación de las funciones consumir_servicio_*.
+# Cada llamada genera una medición (un diccionario) con los tiempos de cada etapa (hasta el primer byte de la
+# respuesta, descarga y decodificación), los bytes recibidos, la cantidad de filas o celdas obtenidas y si la
+# respuesta provino de la cache. Las mediciones se entregan a los observadores registrados, que son simplemente
+# funciones (u objetos invocables) que reciben la medición: registro en un log, contadores, spans, resúmenes, etc.
+# Mientras no haya observadores registrados, medir() devuelve un objeto que no hace nada, por lo que el costo de
+# la instrumentación desactivada se reduce a unas pocas llamadas a métodos vacíos por consulta.
+#
+# Uso:
+#   resumen = ResumenEjecucion()
+#   registrar_observador(resumen)
+#   ... consultas ...
+#   print(resumen.reporte())
+
+
+# Campos de cada medición. Los tiempos se expresan en segundos y los bytes, luego de descomprimir la respuesta.
+# bytes_transferidos es la cantidad de bytes recibidos por la red (antes de descomprimir). El tiempo hasta el
+# primer byte incluye la resolución DNS y el establecimiento de la conexión, cuando no se reutiliza una conexión
+# abierta (requests no expone esas etapas por separado).
+campos = ['funcion', 'metodo', 'url', 'inicio', 'estado', 'desde_cache', 'bytes_transferidos', 'bytes',
+          'tiempo_primer_byte', 'tiempo_descarga', 'tiempo_decodificacion', 'tiempo_total', 'filas', 'celdas',
+          'error']
+
+_observadores = []
+_observadores_lock = threading.Lock()
+_log = logging.getLogger(__name__)
+
+
+def registrar_observador(observador):
+    with _observadores_lock:
+        _observadores.append(observador)
+    return observador
+
+
+def quitar_observador(observador):
+    with _observadores_lock:
+        if observador in _observadores:
+            _observadores.remove(observador)
+
+
+# Un observador que falla no debe interrumpir la consulta (ni a los demás observadores)
+def _notificar(medicion):
+    for observador in list(_observadores):
+        try:
+            observador(medicion)
+        except Exception:
+            _log.exception('Error en el observador %r', observador)
+
+
+# Bytes leídos de la red para una respuesta (None si la respuesta no proviene de la red, por ejemplo de la cache)
+def _bytes_transferidos(respuesta):
+    raw = getattr(respuesta, 'raw', None)
+    try:
+        return raw.tell() if raw is not None else None
+    except Exception:
+        return None
+
+
+class Medicion:
+
+    def __init__(self, funcion, url, metodo):
+        self.datos = dict.fromkeys(campos)
+        self.datos.update(funcion=funcion, metodo=metodo, url=url, inicio=time.time(), desde_cache=False)
+        self._inicio = self._marca = time.perf_counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, error, traza):
+        self.datos['tiempo_total'] = time.perf_counter() - self._inicio
+        if error is not None:
+            self.datos['error'] = repr(error)
+        _notificar(self.datos)
+        return False
+
+    # Registra la respuesta HTTP. Si ya fue descargada por completo (es decir, no se leerá en modo stream),
+    # el tiempo transcurrido luego de recibir las cabeceras se considera tiempo de descarga.
+    def respuesta(self, respuesta, descargada=True):
+        ahora = time.perf_counter()
+        desde_cache = getattr(respuesta, 'desde_cache', False)
+        primer_byte = None if desde_cache else respuesta.elapsed.total_seconds()
+        self.datos.update(estado=respuesta.status_code, desde_cache=desde_cache, tiempo_primer_byte=primer_byte)
+        if descargada:
+            self.datos.update(bytes=len(respuesta.content), bytes_transferidos=_bytes_transferidos(respuesta),
+                              tiempo_descarga=max(ahora - self._inicio - (primer_byte or 0), 0))
+        self._marca = ahora
+
+    # Registra el fin de la descarga de una respuesta leída en modo stream
+    def descarga(self, respuesta, bytes=None):
+        ahora = time.perf_counter()
+        self.datos.update(tiempo_descarga=ahora - self._marca, bytes=bytes,
+                          bytes_transferidos=_bytes_transferidos(respuesta))
+        self._marca = ahora
+
+    # Registra el fin de la decodificación (JSON o NetCDF) y el tamaño del resultado
+    def decodificacion(self, filas=None, celdas=None):
+        ahora = time.perf_counter()
+        self.datos.update(tiempo_decodificacion=ahora - self._marca, filas=filas, celdas=celdas)
+        self._marca = ahora
+
+
+class _MedicionNula:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, error, traza):
+        return False
+
+    def respuesta(self, respuesta, descargada=True):
+        pass
+
+    def descarga(self, respuesta, bytes=None):
+        pass
+
+    def decodificacion(self, filas=None, celdas=None):
+        pass
+
+
+_medicion_nula = _MedicionNula()
+
+
+# Inicia la medición de una llamada (a utilizar como context manager)
+def medir(funcion, url, metodo='GET'):
+    return Medicion(funcion, url, metodo) if _observadores else _medicion_nula
+
+
+# Observador que escribe una línea de log por consulta
+class ObservadorLogging:
+
+    def __init__(self, logger=None, nivel=logging.INFO):
+        self.logger = logger or _log
+        self.nivel = nivel
+
+    def __call__(self, medicion):
+        if not self.logger.isEnabledFor(self.nivel):
+            return
+        self.logger.log(logging.WARNING if medicion['error'] else self.nivel,
+                        '%s %s %s estado=%s cache=%s bytes=%s ttfb=%.3fs descarga=%.3fs decodificacion=%.3fs '
+                        'total=%.3fs filas=%s celdas=%s%s', medicion['funcion'], medicion['metodo'],
+                        medicion['url'], medicion['estado'], medicion['desde_cache'], medicion['bytes'],
+                        medicion['tiempo_primer_byte'] or 0, medicion['tiempo_descarga'] or 0,
+                        medicion['tiempo_decodificacion'] or 0, medicion['tiempo_total'],
+                        medicion['filas'], medicion['celdas'],
+                        f" error={medicion['error']}" if medicion['error'] else '')
+
+
+# Contadores acumulados por función, al estilo de Prometheus. texto_prometheus() devuelve los contadores en el
+# formato de exposición de texto de Prometheus (por ejemplo, para el textfile collector de node_exporter).
+class ContadoresMetricas:
+
+    contadores = {
+        'crcsas_consultas_total': lambda m: 1,
+        'crcsas_errores_total': lambda m: 1 if m['error'] else 0,
+        'crcsas_aciertos_cache_total': lambda m: 1 if m['desde_cache'] else 0,
+        'crcsas_bytes_total': lambda m: m['bytes'] or 0,
+        'crcsas_bytes_transferidos_total': lambda m: m['bytes_transferidos'] or 0,
+        'crcsas_filas_total': lambda m: m['filas'] or 0,
+        'crcsas_segundos_primer_byte_total': lambda m: m['tiempo_primer_byte'] or 0,
+        'crcsas_segundos_descarga_total': lambda m: m['tiempo_descarga'] or 0,
+        'crcsas_segundos_decodificacion_total': lambda m: m['tiempo_decodificacion'] or 0,
+        'crcsas_segundos_total': lambda m: m['tiempo_total'] or 0,
+    }
+
+    def __init__(self):
+        self.valores = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, medicion):
+        with self._lock:
+            for nombre, valor in self.contadores.items():
+                clave = (nombre, medicion['funcion'])
+                self.valores[clave] = self.valores.get(clave, 0) + valor(medicion)
+
+    def texto_prometheus(self):
+        with self._lock:
+            valores = sorted(self.valores.items())
+        lineas = []
+        for nombre in self.contadores:
+            lineas.append(f"# TYPE {nombre} counter")
+            lineas += [f'{n}{{funcion="{funcion}"}} {valor}' for (n, funcion), valor in valores if n == nombre]
+        return '\n'.join(lineas) + '\n'
+
+
+# Genera un span de OpenTelemetry por consulta, con los campos de la medición como atributos.
+# Los spans se crean al finalizar la consulta, con la hora de inicio registrada en la medición.
+class ObservadorOpenTelemetry:
+
+    def __init__(self, tracer=None):
+        from opentelemetry import trace
+        self.tracer = tracer or trace.get_tracer(__name__)
+        self.estado_error = trace.Status(trace.StatusCode.ERROR)
+
+    def __call__(self, medicion):
+        inicio = int(medicion['inicio'] * 1e9)
+        atributos = {f"crcsas.{c}": v for c, v in medicion.items()
+                     if v is not None and c not in ('funcion', 'inicio')}
+        span = self.tracer.start_span(medicion['funcion'], start_time=inicio, attributes=atributos)
+        if medicion['error']:
+            span.set_status(self.estado_error)
+        span.end(end_time=inicio + int(medicion['tiempo_total'] * 1e9))
+
+
+# Guarda todas las mediciones de una ejecución y genera un resumen por función
+class ResumenEjecucion:
+
+    def __init__(self):
+        self.mediciones = []
+        self._lock = threading.Lock()
+
+    def __call__(self, medicion):
+        with self._lock:
+            self.mediciones.append(dict(medicion))
+
+    def tabla(self):
+        import pandas
+        with self._lock:
+            return pandas.DataFrame(self.mediciones, columns=campos)
+
+    def resumen(self):
+        import pandas
+        tabla = self.tabla()
+        tiempos = ['tiempo_primer_byte', 'tiempo_descarga', 'tiempo_decodificacion', 'tiempo_total']
+        tabla[tiempos + ['bytes', 'bytes_transferidos', 'filas', 'celdas']] = \
+            tabla[tiempos + ['bytes', 'bytes_transferidos', 'filas', 'celdas']].astype(float)
+        grupos = tabla.groupby('funcion', sort=True)
+        resumen = pandas.DataFrame({
+            'consultas': grupos.size(),
+            'errores': grupos['error'].count(),
+            'aciertos_cache': grupos['desde_cache'].sum().astype(int),
+            'mb': grupos['bytes'].sum() / 2 ** 20,
+            'mb_transferidos': grupos['bytes_transferidos'].sum() / 2 ** 20,
+            'filas': grupos['filas'].sum(),
+            'celdas': grupos['celdas'].sum(),
+        })
+        for tiempo in tiempos:
+            resumen[f"{tiempo}_s"] = grupos[tiempo].sum()
+        resumen['p50_total_ms'] = grupos['tiempo_total'].median() * 1000
+        resumen['p90_total_ms'] = grupos['tiempo_total'].quantile(0.9) * 1000
+        return resumen.reset_index()
+
+    def reporte(self):
+        resumen = self.resumen()
+        if resumen.empty:
+            return 'Sin consultas registradas'
+        tiempos = resumen[['tiempo_primer_byte_s', 'tiempo_descarga_s', 'tiempo_decodificacion_s']].sum()
+        total = resumen['tiempo_total_s'].sum()
+        lineas = [resumen.to_markdown(tablefmt="github", index=False, floatfmt='.3f'), '',
+                  f"Tiempo total en consultas: {total:.3f} s (primer byte {tiempos.iloc[0]:.3f} s, "
+                  f"descarga {tiempos.iloc[1]:.3f} s, decodificación {tiempos.iloc[2]:.3f} s)"]
+        return '\n'.join(lineas)
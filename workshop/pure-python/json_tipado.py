@@ -0,0 +1,176 @@
+
+import array
+import re
+import ijson
+import numpy as np
+import pandas
+
+
+# Decodificación incremental (streaming) de respuestas JSON en columnas tipadas.
+# En lugar de cargar toda la respuesta como una lista de diccionarios de Python y luego convertirla con
+# pandas.json_normalize, los registros se leen uno a uno desde el stream HTTP y sus valores se agregan a
+# buffers por columna (arrays compactos de números o códigos de categorías). Al finalizar, cada buffer se
+# convierte al tipo indicado en el esquema del servicio, de manera que el pico de memoria se mantiene cerca
+# del tamaño del Data Frame resultante.
+
+
+# Tipos admitidos en los esquemas: cualquier tipo numérico de numpy, 'fecha' (datetime64) y 'categoria'.
+# Las columnas que no figuran en el esquema se decodifican como objetos de Python.
+esquemas_default = [
+    (r'/registros_diarios/', {
+        'omm_id': 'int32', 'fecha': 'fecha', 'variable_id': 'categoria', 'estado': 'categoria', 'valor': 'float32'}),
+    (r'/indices_sequia_valores/', {
+        'indice_configuracion_id': 'int32', 'omm_id': 'int32', 'pentada_fin': 'int8', 'ano': 'int16',
+        'metodo_imputacion_id': 'int8', 'valor_dato': 'float32', 'valor_indice': 'float32',
+        'percentil_dato': 'float32'}),
+    (r'/estadisticas_moviles/', {
+        'omm_id': 'int32', 'fecha_desde': 'fecha', 'fecha_hasta': 'fecha', 'variable_id': 'categoria',
+        'valor': 'float32'}),
+    (r'/estadisticas_mensuales/', {
+        'omm_id': 'int32', 'anho': 'int16', 'mes': 'int8', 'variable': 'categoria', 'estadistico': 'categoria',
+        'valor': 'float32'}),
+    (r'/eventos/', {
+        'omm_id': 'int32', 'numero_evento': 'int32', 'fecha_inicio': 'fecha', 'fecha_fin': 'fecha',
+        'intensidad': 'float32', 'magnitud': 'float32', 'duracion': 'int32', 'minimo': 'float32',
+        'maximo': 'float32'}),
+    (r'/estaciones', {
+        'omm_id': 'int32', 'nombre': 'categoria', 'elevacion': 'float32', 'nivel_adm1': 'categoria',
+        'nivel_adm2': 'categoria', 'tipo': 'categoria', 'distancia': 'float32', 'diferencia_elevacion': 'float32'}),
+]
+
+
+# Devuelve el esquema asociado a una URL (o un esquema vacío si ningún servicio coincide).
+def esquema_para_url(url, esquemas=None):
+    for patron, esquema in (esquemas or esquemas_default):
+        if re.search(patron, url):
+            return esquema
+    return {}
+
+
+# Cantidad de registros que se acumulan como objetos de Python antes de convertirlos a arrays compactos.
+tamano_bloque = 65536
+
+
+# Buffer base: los valores se acumulan en una lista y cada tamano_bloque registros se convierten en bloque
+# a un array compacto (de manera vectorizada), por lo que la lista de objetos nunca supera ese tamaño.
+class _Buffer:
+
+    def __init__(self):
+        self.pendientes = []
+        self.agregar = self.pendientes.append
+        self.bloques = []
+
+    def rellenar(self, cantidad):
+        self.pendientes.extend([None] * cantidad)
+
+    def volcar(self):
+        if self.pendientes:
+            self.bloques.append(self._convertir(self.pendientes))
+            self.pendientes.clear()
+
+
+# Buffer de una columna categórica (o de fechas): los valores se codifican con un diccionario global,
+# por lo que los valores repetidos (fechas, ids de variables, etc.) se guardan una sola vez.
+class _BufferCategorias(_Buffer):
+
+    def __init__(self, tipo):
+        super().__init__()
+        self.tipo = tipo
+        self.categorias = {}
+
+    def _convertir(self, valores):
+        codigos, unicos = pandas.factorize(np.array(valores, dtype=object))
+        mapeo = np.array([self.categorias.setdefault(u, len(self.categorias)) for u in unicos] + [-1],
+                         dtype=np.int32)
+        return mapeo[codigos]  # el código -1 (faltante) toma el último elemento del mapeo
+
+    def resultado(self):
+        self.volcar()
+        codigos = np.concatenate(self.bloques) if self.bloques else np.array([], dtype=np.int32)
+        categorias = list(self.categorias)
+        if self.tipo == 'categoria':
+            return pandas.Categorical.from_codes(codigos, categories=pandas.Index(categorias))
+        fechas = pandas.to_datetime(pandas.Series(categorias, dtype=object), format='ISO8601')
+        resultado = np.full(len(codigos), np.datetime64('NaT'), dtype='datetime64[ns]')
+        resultado[codigos >= 0] = fechas.to_numpy(dtype='datetime64[ns]')[codigos[codigos >= 0]]
+        return resultado
+
+
+# Buffer de una columna numérica: los faltantes se convierten en NaN. Al finalizar se convierten al tipo
+# del esquema (usando tipos enteros nulables si hay faltantes).
+class _BufferNumerico(_Buffer):
+
+    def __init__(self, tipo):
+        super().__init__()
+        self.tipo = np.dtype(tipo)
+
+    def _convertir(self, valores):
+        valores = np.array(valores, dtype=np.float64)
+        return valores.astype(self.tipo) if self.tipo.kind == 'f' else valores
+
+    def resultado(self):
+        self.volcar()
+        valores = np.concatenate(self.bloques) if self.bloques else np.array([], dtype=self.tipo)
+        if self.tipo.kind in 'iu' and np.isnan(valores).any():
+            return pandas.array(valores, dtype=self.tipo.name.capitalize())
+        return valores.astype(self.tipo)
+
+
+# Buffer de una columna sin tipo definido en el esquema.
+class _BufferObjetos(_Buffer):
+
+    def _convertir(self, valores):
+        return list(valores)
+
+    def resultado(self):
+        self.volcar()
+        valores = [valor for bloque in self.bloques for valor in bloque]
+        return pandas.array(valores) if valores else np.array([], dtype=object)
+
+
+def _crear_buffer(tipo):
+    if tipo in ('categoria', 'fecha'):
+        return _BufferCategorias(tipo)
+    if tipo is None:
+        return _BufferObjetos()
+    return _BufferNumerico(tipo)
+
+
+# Aplana los objetos anidados de un registro con la misma convención que pandas.json_normalize.
+def _aplanar(registro, prefijo=''):
+    plano = {}
+    for clave, valor in registro.items():
+        if isinstance(valor, dict):
+            plano.update(_aplanar(valor, f"{prefijo}{clave}."))
+        else:
+            plano[f"{prefijo}{clave}"] = valor
+    return plano
+
+
+# Lee un arreglo JSON de registros desde un objeto tipo archivo (por ejemplo, el stream de una respuesta HTTP)
+# y devuelve un Data Frame con las columnas tipadas según el esquema indicado.
+def leer_json_tipado(archivo, esquema=None):
+    esquema = esquema or {}
+    buffers = {}
+    cantidad = 0
+    for registro in ijson.items(archivo, 'item', use_float=True):
+        if any(isinstance(valor, dict) for valor in registro.values()):
+            registro = _aplanar(registro)
+        for columna, valor in registro.items():
+            buffer = buffers.get(columna)
+            if buffer is None:
+                # Columna nueva: se completan con faltantes los registros leídos previamente
+                buffer = buffers[columna] = _crear_buffer(esquema.get(columna))
+                buffer.rellenar(cantidad)
+            buffer.agregar(valor)
+        cantidad += 1
+        if len(registro) < len(buffers):
+            # Columnas ausentes en este registro
+            for columna, buffer in buffers.items():
+                if columna not in registro:
+                    buffer.agregar(None)
+        if cantidad % tamano_bloque == 0:
+            for buffer in buffers.values():
+                buffer.volcar()
+
+    return pandas.DataFrame({columna: buffer.resultado() for columna, buffer in buffers.items()})
@@ -0,0 +1,293 @@
+
+import concurrent.futures
+import hashlib
+import os
+import pathlib
+import threading
+import matplotlib
+import matplotlib.figure
+import matplotlib.image
+import matplotlib.patches
+import numpy as np
+
+from estadisticas_zonales import leer_zonas
+from grillas import crs_grilla, dimensiones_espaciales, seleccionar_variable
+
+
+# Generación de mapas en lote (por ejemplo, el boletín semanal con los mapas de SPI, CHIRPS o NDVI de cada péntada
+# y región), sin interfaz gráfica. Las capas base estáticas (límites, continentes, costas y países de Basemap, o
+# los contornos de las zonas) se dibujan una única vez por extensión y tamaño de mapa y se guardan como imagen
+# (PNG) en un directorio de cache. Cada cuadro se dibuja luego sobre esa imagen de fondo, en un pool de procesos:
+# cada proceso lee la imagen una única vez y escribe directamente el archivo del cuadro (PNG o SVG, según la
+# extensión), de manera que los cuadros no se acumulan en memoria.
+#
+# Un cuadro es un diccionario con las claves:
+#   archivo: nombre del archivo de salida (relativo al directorio de salida)
+#   raster, extension_raster: grilla 2D (filas de norte a sur) y su extensión (xmin, xmax, ymin, ymax)
+#   longitudes, latitudes: en lugar de extension_raster, coordenadas de los vértices de los píxeles (grillas
+#                          proyectadas, ver cuadros_raster)
+#   vmin, vmax, cmap, etiqueta: escala de colores del raster y título de la barra de colores
+#   estaciones: Data Frame (o diccionario) con columnas longitud, latitud y, opcionalmente, color
+#   titulo: título del mapa
+#   extension: extensión del mapa, si es distinta de la extensión del lote
+#
+# Uso:
+#   cuadros = cuadros_raster(datos, 'spi', vmin=-3, vmax=3, cmap='RdBu')
+#   for archivo, error in renderizar_mapas(cuadros, 'boletin', extension=(-59, -53, -35.5, -29.5), procesos=4):
+#       ...
+
+# Extensión (xmin, xmax, ymin, ymax) de los mapas de los problemas 1 y 4
+extension_default = (-75, -52, -57, -20)
+
+# Posición de los ejes del mapa y de la barra de colores en la figura (fracciones del ancho y del alto)
+posicion_mapa = (0.02, 0.04, 0.78, 0.88)
+posicion_barra = (0.84, 0.2, 0.03, 0.6)
+
+# Imágenes de fondo ya leídas en este proceso, por archivo
+_fondos = {}
+_fondos_lock = threading.Lock()
+
+
+# Capa base de los problemas 1 y 4: límite del mapa, continentes, costas y países de Basemap (EPSG:4326)
+def dibujar_basemap(ax, extension):
+    from mpl_toolkits.basemap import Basemap
+    xmin, xmax, ymin, ymax = extension
+    m = Basemap(epsg=4326, llcrnrlon=xmin, urcrnrlon=xmax, llcrnrlat=ymin, urcrnrlat=ymax, ax=ax)
+    m.drawmapboundary(fill_color='#A6CAE0', linewidth=0)
+    m.fillcontinents(color='grey', alpha=0.7, lake_color='grey')
+    m.drawcoastlines(linewidth=0.1, color="white")
+    m.drawcountries(linestyle='--')
+
+
+# Capa base con los contornos de las zonas de un archivo GeoJSON (por ejemplo, las regiones del boletín)
+class DibujoZonas:
+
+    def __init__(self, archivo_geojson_zona, color='black', linewidth=0.8, relleno=None):
+        self.archivo_geojson_zona = str(archivo_geojson_zona)
+        self.color = color
+        self.linewidth = linewidth
+        self.relleno = relleno
+
+    def __repr__(self):
+        return f"DibujoZonas({self.archivo_geojson_zona!r}, {self.color!r}, {self.linewidth!r}, {self.relleno!r})"
+
+    def __call__(self, ax, extension):
+        for poligonos in leer_zonas(self.archivo_geojson_zona)[1]:
+            for poligono in poligonos:
+                ax.add_patch(matplotlib.patches.Polygon(
+                    poligono[0], closed=True, fill=self.relleno is not None, facecolor=self.relleno,
+                    edgecolor=self.color, linewidth=self.linewidth))
+
+
+# Nombre estable de una capa base (o de una lista de capas), utilizado en la clave de la cache de fondos
+def _nombre_capa(capa_base):
+    if isinstance(capa_base, (list, tuple)):
+        return '+'.join(_nombre_capa(capa) for capa in capa_base)
+    if hasattr(capa_base, '__qualname__'):
+        return f"{capa_base.__module__}.{capa_base.__qualname__}"
+    return repr(capa_base)
+
+
+# Tamaño (en píxeles) de la imagen de fondo: el mayor rectángulo con la proporción de la extensión (en grados,
+# como en Basemap con EPSG:4326) que entra en los ejes del mapa.
+def _tamano_fondo(extension, tamano, dpi):
+    xmin, xmax, ymin, ymax = extension
+    ancho, alto = tamano[0] * posicion_mapa[2] * dpi, tamano[1] * posicion_mapa[3] * dpi
+    proporcion = (ymax - ymin) / (xmax - xmin)
+    if alto < ancho * proporcion:
+        ancho = alto / proporcion
+    return max(int(round(ancho)), 1), max(int(round(ancho * proporcion)), 1)
+
+
+# Dibuja la capa base para una extensión y la guarda como imagen en el directorio de cache, si aún no existe.
+# Devuelve el archivo de la imagen.
+def preparar_fondo(capa_base, extension, tamano, dpi, directorio_cache):
+    ancho, alto = _tamano_fondo(extension, tamano, dpi)
+    clave = hashlib.sha1(f"{_nombre_capa(capa_base)}|{tuple(extension)}|{ancho}x{alto}".encode()).hexdigest()
+    archivo = pathlib.Path(directorio_cache) / f"{clave}.png"
+    if archivo.exists():
+        return archivo
+
+    figura = matplotlib.figure.Figure(figsize=(ancho / dpi, alto / dpi), dpi=dpi)
+    ax = figura.add_axes((0, 0, 1, 1))
+    for capa in capa_base if isinstance(capa_base, (list, tuple)) else [capa_base]:
+        capa(ax, extension)
+    ax.set_xlim(extension[0], extension[1])
+    ax.set_ylim(extension[2], extension[3])
+    ax.set_aspect('auto')
+    ax.set_axis_off()
+
+    # La imagen se escribe en un archivo temporal y luego se renombra (otro proceso puede estar leyéndola)
+    archivo.parent.mkdir(parents=True, exist_ok=True)
+    temporal = archivo.with_suffix(f".{os.getpid()}.tmp")
+    figura.savefig(temporal, format='png', dpi=dpi)
+    os.replace(temporal, archivo)
+    return archivo
+
+
+def _leer_fondo(archivo):
+    with _fondos_lock:
+        if archivo not in _fondos:
+            _fondos[archivo] = matplotlib.image.imread(archivo)
+        return _fondos[archivo]
+
+
+# Dibuja un cuadro sobre la imagen de fondo y lo escribe en el archivo indicado (PNG, SVG o cualquier formato
+# admitido por matplotlib, según la extensión). Se utiliza una Figure sin pyplot: no se abre ninguna ventana ni
+# quedan figuras registradas en el proceso.
+def renderizar_cuadro(cuadro, archivo, fondo, extension, tamano=(6, 8), dpi=100):
+    figura = matplotlib.figure.Figure(figsize=tamano, dpi=dpi)
+    ax = figura.add_axes(posicion_mapa)
+    ax.imshow(_leer_fondo(fondo), extent=extension, aspect='equal', zorder=0)
+
+    imagen = None
+    if cuadro.get('raster') is not None:
+        opciones = {'vmin': cuadro.get('vmin'), 'vmax': cuadro.get('vmax'), 'cmap': cuadro.get('cmap'), 'zorder': 3}
+        if cuadro.get('longitudes') is not None:
+            imagen = ax.pcolormesh(cuadro['longitudes'], cuadro['latitudes'], cuadro['raster'], **opciones)
+        else:
+            imagen = ax.imshow(cuadro['raster'], extent=cuadro['extension_raster'], interpolation='nearest',
+                               **opciones)
+    estaciones = cuadro.get('estaciones')
+    if estaciones is not None and len(estaciones['longitud']):
+        colores = estaciones['color'] if 'color' in estaciones else 'red'
+        ax.scatter(estaciones['longitud'], estaciones['latitud'], c=colores, s=49, alpha=0.6,
+                   edgecolors='black', linewidths=1, zorder=4)
+
+    ax.set_xlim(extension[0], extension[1])
+    ax.set_ylim(extension[2], extension[3])
+    ax.set_axis_off()
+    if cuadro.get('titulo'):
+        ax.set_title(cuadro['titulo'])
+    if imagen is not None:
+        barra = figura.colorbar(imagen, cax=figura.add_axes(posicion_barra))
+        if cuadro.get('etiqueta'):
+            barra.set_label(cuadro['etiqueta'])
+    figura.savefig(archivo, dpi=dpi)
+    return archivo
+
+
+def _inicializar_proceso():
+    matplotlib.use('Agg')
+
+
+def _renderizar_trabajo(cuadro, archivo, fondo, extension, tamano, dpi):
+    archivo.parent.mkdir(parents=True, exist_ok=True)
+    return renderizar_cuadro(cuadro, archivo, fondo, extension, tamano, dpi)
+
+
+# Dibuja un lote de cuadros (ver la descripción al comienzo del módulo) y escribe cada uno en el directorio de
+# salida. Las imágenes de fondo se preparan en este proceso (una por extensión) antes de enviar los cuadros al
+# pool. Con procesos=0 los cuadros se dibujan en este proceso. Los cuadros se consumen a medida que se envían
+# (como máximo 2 por proceso en espera), por lo que pueden generarse de forma perezosa (ver cuadros_raster).
+# Es un generador: devuelve pares (archivo, error) a medida que se completa cada cuadro, con error=None si el
+# cuadro se escribió correctamente. Un error en un cuadro (incluso al preparar su imagen de fondo) no interrumpe
+# la generación de los demás; si el cuadro no indica un archivo, se devuelve archivo=None.
+def renderizar_mapas(cuadros, directorio, capa_base=dibujar_basemap, extension=extension_default, tamano=(6, 8),
+                     dpi=100, procesos=None, directorio_cache=None):
+    directorio = pathlib.Path(directorio)
+    directorio_cache = directorio_cache or directorio / '.fondos'
+    fondos = {}
+
+    def trabajo(cuadro):
+        extension_cuadro = tuple(cuadro.get('extension') or extension)
+        if extension_cuadro not in fondos:
+            # Si la capa base no puede dibujarse (por ejemplo, sin Basemap), el error se guarda y se informa en
+            # cada cuadro con esa extensión, sin volver a intentarlo
+            try:
+                fondos[extension_cuadro] = preparar_fondo(capa_base, extension_cuadro, tamano, dpi, directorio_cache)
+            except Exception as e:
+                fondos[extension_cuadro] = e
+        if isinstance(fondos[extension_cuadro], Exception):
+            raise fondos[extension_cuadro]
+        return cuadro, directorio / cuadro['archivo'], fondos[extension_cuadro], extension_cuadro, tamano, dpi
+
+    # Archivo de salida de un cuadro, para informar sus errores (None si el cuadro no indica un archivo válido)
+    def archivo_cuadro(cuadro):
+        try:
+            return directorio / cuadro['archivo']
+        except (KeyError, TypeError):
+            return None
+
+    # Los cuadros se dibujan en este proceso sin cambiar el backend de matplotlib (se dibuja sobre una Figure,
+    # que puede guardarse con cualquier backend), de manera que no se afectan las figuras de pyplot abiertas.
+    if procesos == 0:
+        for cuadro in cuadros:
+            try:
+                resultado = _renderizar_trabajo(*trabajo(cuadro)), None
+            except Exception as e:
+                resultado = archivo_cuadro(cuadro), e
+            yield resultado
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=procesos, initializer=_inicializar_proceso) as ejecutor:
+        maximo_en_espera = 2 * (procesos or os.cpu_count() or 1)
+        futuros = {}
+        cuadros = iter(cuadros)
+        while True:
+            for cuadro in cuadros:
+                try:
+                    argumentos = trabajo(cuadro)
+                except Exception as e:
+                    yield archivo_cuadro(cuadro), e
+                    continue
+                futuros[ejecutor.submit(_renderizar_trabajo, *argumentos)] = argumentos[1]
+                if len(futuros) >= maximo_en_espera:
+                    break
+            if not futuros:
+                break
+            completados, _ = concurrent.futures.wait(futuros, return_when=concurrent.futures.FIRST_COMPLETED)
+            for futuro in completados:
+                yield futuros.pop(futuro), futuro.exception()
+
+
+# Bordes de los píxeles a partir de sus centros (coordenadas equiespaciadas o no)
+def _bordes(centros):
+    centros = np.asarray(centros, dtype=float)
+    if len(centros) == 1:
+        return np.array([centros[0] - 0.5, centros[0] + 0.5])
+    medios = (centros[1:] + centros[:-1]) / 2
+    return np.concatenate([[2 * centros[0] - medios[0]], medios, [2 * centros[-1] - medios[-1]]])
+
+
+# Genera (de forma perezosa) un cuadro por cada paso de tiempo de un dataset o data array de xarray, por ejemplo
+# el devuelto por consumir_servicio_espacial_xarray o por un mosaico. Las grillas en longitud/latitud se dibujan
+# como imagen; las grillas proyectadas (por ejemplo, NDVI en Gauss-Krüger) se dibujan con los vértices de los
+# píxeles convertidos a longitud/latitud. El nombre del archivo y el título se arman con los formatos indicados,
+# que pueden utilizar la variable, la fecha y el índice de cada paso de tiempo (con titulo='', sin título). Por
+# defecto se utiliza la fecha o, si los datos no tienen coordenada de tiempo, el índice.
+def cuadros_raster(datos, variable=None, archivo=None, titulo=None, **opciones):
+    import pandas
+    datos = seleccionar_variable(datos, variable)
+    dim_x, dim_y = dimensiones_espaciales(datos)
+    if 'time' not in datos.dims:
+        datos = datos.expand_dims('time')
+    datos = datos.transpose('time', dim_y, dim_x)
+    y = datos[dim_y].values
+    invertir = len(y) > 1 and y[0] < y[-1]  # las filas se dibujan de norte a sur
+    bordes_x, bordes_y = _bordes(datos[dim_x].values), _bordes(y)
+
+    geometria = {}
+    if crs_grilla(datos) == 'EPSG:4326':
+        geometria['extension_raster'] = (bordes_x.min(), bordes_x.max(), bordes_y.min(), bordes_y.max())
+    else:
+        import pyproj
+        transformador = pyproj.Transformer.from_crs(crs_grilla(datos), 'EPSG:4326', always_xy=True)
+        geometria['longitudes'], geometria['latitudes'] = transformador.transform(*np.meshgrid(bordes_x, bordes_y))
+        invertir = False
+
+    nombre = datos.name or variable or 'raster'
+    if 'time' in datos.coords:
+        tiempos = datos['time'].values
+        archivo = archivo or '{variable}_{fecha:%Y%m%d}.png'
+        titulo = '{variable} {fecha:%Y-%m-%d}' if titulo is None else titulo
+    else:
+        tiempos = [None] * datos.sizes['time']
+        archivo = archivo or '{variable}_{indice:03d}.png'
+        titulo = '{variable}' if titulo is None else titulo
+    for i, tiempo in enumerate(tiempos):
+        fecha = pandas.Timestamp(tiempo) if tiempo is not None else None
+        raster = np.asarray(datos[i].values, dtype=float)
+        yield {'archivo': archivo.format(variable=nombre, fecha=fecha, indice=i),
+               'titulo': titulo.format(variable=nombre, fecha=fecha, indice=i) if titulo else None,
+               'raster': raster[::-1] if invertir else raster, **geometria, **opciones}
@@ -0,0 +1,188 @@
+
+import concurrent.futures
+import json
+import math
+import threading
+import time
+import matplotlib.path
+import matplotlib.transforms
+import numpy as np
+import pandas
+
+from estadisticas_zonales import ponderaciones_zonas
+from funciones_api import leer_netcdf, obtener_cliente
+from grillas import dimensiones_espaciales, seleccionar_variable
+from instrumentacion import medir
+from registro_zonas import registro_default
+
+
+# Descarga de productos espaciales para zonas extensas, dividida en tiles.
+# En lugar de enviar la zona completa en una única consulta (cuya respuesta puede ser muy grande y superar el
+# timeout), el rectángulo que contiene a la zona se divide en tiles alineados a una cuadrícula fija de longitud y
+# latitud (múltiplos de tamano_tile grados), se descartan los tiles que no tocan la zona y los restantes se
+# consultan en paralelo, cada uno con su propio rectángulo como zona. Como la cuadrícula es fija, un mismo tile
+# genera siempre la misma consulta (y puede reutilizarse desde la cache de respuestas en otras zonas).
+# Las respuestas se unen por coordenadas: los píxeles de los bordes que devuelven dos tiles vecinos se guardan una
+# única vez, por lo que el mosaico no tiene píxeles duplicados ni costuras. Finalmente se enmascaran los píxeles
+# cuyo centro está fuera de la zona.
+#
+# Uso:
+#   descarga = DescargaMosaico(url, usuario, clave, 'Uruguay.geojson', variable='spi')
+#   errores = descarga.descargar(max_concurrencia=4)
+#   ... si hay errores, descarga.descargar() vuelve a intentar solamente los tiles que fallaron ...
+#   datos = descarga.mosaico()
+
+
+# Rectángulo (xmin, ymin, xmax, ymax) de un tile de la cuadrícula
+def limites_tile(columna, fila, tamano_tile):
+    return columna * tamano_tile, fila * tamano_tile, (columna + 1) * tamano_tile, (fila + 1) * tamano_tile
+
+
+# Zona (FeatureCollection con un rectángulo) enviada en la consulta de un tile
+def geojson_rectangulo(xmin, ymin, xmax, ymax):
+    anillo = [[xmin, ymin], [xmax, ymin], [xmax, ymax], [xmin, ymax], [xmin, ymin]]
+    return json.dumps({'type': 'FeatureCollection', 'features': [
+        {'type': 'Feature', 'properties': {}, 'geometry': {'type': 'Polygon', 'coordinates': [anillo]}}]})
+
+
+# Tiles (columna, fila) de la cuadrícula que tocan alguno de los polígonos de las zonas
+def tiles_zonas(zonas, tamano_tile):
+    caminos = [matplotlib.path.Path(poligono[0]) for poligonos in zonas for poligono in poligonos]
+    vertices = np.concatenate([camino.vertices for camino in caminos])
+    (xmin, ymin), (xmax, ymax) = vertices.min(axis=0), vertices.max(axis=0)
+    tiles = []
+    for fila in range(math.floor(ymin / tamano_tile), math.ceil(ymax / tamano_tile)):
+        for columna in range(math.floor(xmin / tamano_tile), math.ceil(xmax / tamano_tile)):
+            rectangulo = matplotlib.transforms.Bbox.from_extents(*limites_tile(columna, fila, tamano_tile))
+            if any(camino.intersects_bbox(rectangulo, filled=True) for camino in caminos):
+                tiles.append((columna, fila))
+    return tiles
+
+
+# Decodifica la respuesta NetCDF de un tile (en memoria) como un data array de xarray. Las descargas de los tiles
+# se hacen en paralelo, pero la decodificación se serializa (ver funciones_api.netcdf_lock).
+def _leer_tile(contenido, variable):
+    return seleccionar_variable(leer_netcdf(contenido), variable)
+
+
+# Une los data arrays de los tiles sobre la unión de sus coordenadas espaciales. Las coordenadas se comparan
+# redondeadas (decimales) y, en los píxeles repetidos, se conserva el primer valor válido.
+def unir_tiles(tiles, decimales=6):
+    import xarray
+    dim_x, dim_y = dimensiones_espaciales(tiles[0])
+    otras_dims = [d for d in tiles[0].dims if d not in (dim_x, dim_y)]
+    for tile in tiles[1:]:
+        for dim in otras_dims:
+            if not np.array_equal(tile[dim].values, tiles[0][dim].values):
+                raise ValueError(f"Los tiles tienen distintos valores de la dimensión {dim}")
+
+    x = np.unique(np.concatenate([np.round(t[dim_x].values, decimales) for t in tiles]))
+    y = np.unique(np.concatenate([np.round(t[dim_y].values, decimales) for t in tiles]))
+    valores_y = tiles[0][dim_y].values
+    if len(valores_y) > 1 and valores_y[0] > valores_y[-1]:
+        y = y[::-1]  # se respeta el orden (norte a sur) de la grilla original
+
+    forma = [len(tiles[0][d]) for d in otras_dims] + [len(y), len(x)]
+    tipo = np.result_type(np.float32, *[t.dtype for t in tiles])
+    mosaico = np.full(forma, np.nan, dtype=tipo)
+    orden_y = np.argsort(y)
+    for tile in tiles:
+        tile = tile.transpose(*otras_dims, dim_y, dim_x)
+        ix = np.searchsorted(x, np.round(tile[dim_x].values, decimales))
+        iy = orden_y[np.searchsorted(y[orden_y], np.round(tile[dim_y].values, decimales))]
+        indices = (Ellipsis, iy[:, None], ix[None, :])
+        actual = mosaico[indices]
+        mosaico[indices] = np.where(np.isnan(actual), tile.values, actual)
+
+    coordenadas = {d: tiles[0][d] for d in otras_dims}
+    coordenadas.update({dim_y: y, dim_x: x})
+    return xarray.DataArray(mosaico, dims=otras_dims + [dim_y, dim_x], coords=coordenadas,
+                            name=tiles[0].name, attrs=tiles[0].attrs)
+
+
+class DescargaMosaico:
+
+    def __init__(self, url, usuario, clave, archivo_geojson_zona, variable=None, tamano_tile=2.0,
+                 reintentos=2, espera=1.0):
+        self.url = url
+        self.cliente = obtener_cliente(usuario, clave)
+        self.archivo_geojson_zona = archivo_geojson_zona
+        self.variable = variable
+        self.tamano_tile = tamano_tile
+        self.reintentos = reintentos
+        self.espera = espera
+        self.tiles = tiles_zonas(registro_default.zona(archivo_geojson_zona).zonas, tamano_tile)
+        self.resultados = {}
+        self.errores = {}
+        self._lock = threading.Lock()
+
+    # Tiles que aún no se descargaron (o cuya descarga falló)
+    def pendientes(self):
+        return [tile for tile in self.tiles if tile not in self.resultados]
+
+    # Descarga un tile. Además de los reintentos del cliente (errores de conexión, 429 y 5xx), se reintentan
+    # los timeouts y las respuestas que no pueden decodificarse, con espera exponencial.
+    def descargar_tile(self, tile):
+        zona = json.dumps({'zona.geojson': geojson_rectangulo(*limites_tile(*tile, self.tamano_tile))})
+        for intento in range(self.reintentos + 1):
+            try:
+                with medir('consumir_servicio_espacial_mosaico', self.url, 'POST') as medicion:
+                    respuesta = self.cliente.post(self.url, data=zona)
+                    medicion.respuesta(respuesta)
+                    respuesta.raise_for_status()
+                    datos = _leer_tile(respuesta.content, self.variable)
+                    medicion.decodificacion(filas=datos.shape[0] if datos.ndim > 2 else 1, celdas=datos.size)
+                break
+            except Exception:
+                if intento == self.reintentos:
+                    raise
+                time.sleep(self.espera * 2 ** intento)
+        with self._lock:
+            self.resultados[tile] = datos
+            self.errores.pop(tile, None)
+        return datos
+
+    # Descarga en paralelo los tiles pendientes. Un error en un tile no interrumpe la descarga de los demás:
+    # devuelve un Data Frame con los tiles que fallaron, que pueden volver a intentarse llamando nuevamente a
+    # descargar() o, uno por uno, con descargar_tile().
+    def descargar(self, max_concurrencia=4):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrencia) as ejecutor:
+            futuros = {ejecutor.submit(self.descargar_tile, tile): tile for tile in self.pendientes()}
+            for futuro in concurrent.futures.as_completed(futuros):
+                if futuro.exception() is not None:
+                    with self._lock:
+                        self.errores[futuros[futuro]] = futuro.exception()
+        errores = [{'columna': columna, 'fila': fila, 'limites': limites_tile(columna, fila, self.tamano_tile),
+                    'error': repr(error)} for (columna, fila), error in sorted(self.errores.items())]
+        return pandas.DataFrame(errores, columns=['columna', 'fila', 'limites', 'error'])
+
+    # Une los tiles descargados en un único dataset. Con recortar=True, los píxeles cuyo centro está fuera
+    # de la zona se completan con NaN (como en la respuesta de una consulta con la zona completa).
+    def mosaico(self, recortar=True):
+        import xarray
+        pendientes = self.pendientes()
+        if pendientes:
+            raise RuntimeError(f"Quedan {len(pendientes)} tiles sin descargar: {pendientes}")
+        if not self.tiles:
+            raise ValueError(f"La zona {self.archivo_geojson_zona} no contiene polígonos")
+        datos = unir_tiles([self.resultados[tile] for tile in self.tiles])
+        if recortar:
+            dim_x, dim_y = dimensiones_espaciales(datos)
+            _, ponderaciones = ponderaciones_zonas(datos, self.archivo_geojson_zona)
+            dentro = np.asarray(ponderaciones.sum(axis=0)).ravel() > 0
+            datos = datos.where(xarray.DataArray(dentro.reshape(datos[dim_y].size, datos[dim_x].size),
+                                                 dims=(dim_y, dim_x)))
+        return datos.to_dataset()
+
+
+# Función para acceder a un servicio web espacial dividiendo la zona en tiles que se descargan en paralelo.
+# Devuelve un dataset de xarray (en memoria) con el mosaico de los tiles. Si algún tile no puede descargarse
+# luego de los reintentos, se genera un error (ver DescargaMosaico para reintentar solamente esos tiles).
+def consumir_servicio_espacial_mosaico(url, usuario, clave, archivo_geojson_zona, variable=None, tamano_tile=2.0,
+                                       max_concurrencia=4, recortar=True):
+    descarga = DescargaMosaico(url, usuario, clave, archivo_geojson_zona, variable=variable, tamano_tile=tamano_tile)
+    errores = descarga.descargar(max_concurrencia)
+    if not errores.empty:
+        raise RuntimeError(f"Fallaron {len(errores)} de {len(descarga.tiles)} tiles:\n"
+                           f"{errores.to_string(index=False)}")
+    return descarga.mosaico(recortar)
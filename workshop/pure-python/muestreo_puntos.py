@@ -0,0 +1,139 @@
+
+import hashlib
+import json
+import pathlib
+import threading
+import numpy as np
+import pandas
+
+from grillas import clave_grilla, dimensiones_espaciales, seleccionar_variable, transformar_desde_lonlat
+
+
+# Muestreo local de productos grillados en muchos puntos (equivalente a los servicios */serie_temporal/*
+# cuando se envían puntos), a partir de los datasets devueltos por consumir_servicio_espacial_xarray o
+# guardados en el almacén local.
+# Las coordenadas de los puntos se convierten una única vez por grilla a índices de píxel (y ponderaciones,
+# en el caso de la interpolación bilineal). Luego la matriz completa tiempo x puntos se obtiene con una única
+# indexación vectorizada sobre la pila de rasters.
+
+_cache_indices = {}
+_cache_indices_lock = threading.Lock()
+
+
+# Lee un archivo GeoJSON de puntos. Devuelve un Data Frame con los atributos de cada punto y sus coordenadas.
+def leer_puntos(archivo_geojson):
+    geojson = json.loads(pathlib.Path(archivo_geojson).read_text())
+    features = geojson['features'] if geojson.get('type') == 'FeatureCollection' else [geojson]
+    if any(f['geometry']['type'] != 'Point' for f in features):
+        raise ValueError("El archivo GeoJSON debe contener solamente puntos")
+    puntos = pandas.DataFrame([f.get('properties') or {} for f in features], index=range(len(features)))
+    coordenadas = np.array([f['geometry']['coordinates'][:2] for f in features], dtype=float).reshape(-1, 2)
+    return puntos.assign(longitud=coordenadas[:, 0], latitud=coordenadas[:, 1])
+
+
+# Posición fraccionaria de cada coordenada sobre un eje regular de la grilla (0 = centro del primer píxel).
+def _posiciones(eje, coordenadas):
+    paso = eje[1] - eje[0] if len(eje) > 1 else 1.0
+    return (coordenadas - eje[0]) / paso
+
+
+# Calcula, para cada punto, los índices de los píxeles (numerados en el orden (y, x) de la grilla) y las
+# ponderaciones con las que se combinan: un píxel con ponderación 1 (metodo='cercano') o los cuatro píxeles
+# vecinos (metodo='bilineal'). Los puntos fuera de la grilla tienen índice -1.
+def _calcular_indices(datos, longitudes, latitudes, metodo):
+    dim_x, dim_y = dimensiones_espaciales(datos)
+    x, y = datos[dim_x].values.astype(float), datos[dim_y].values.astype(float)
+    px, py = transformar_desde_lonlat(datos, longitudes, latitudes)
+    fx, fy = _posiciones(x, np.asarray(px)), _posiciones(y, np.asarray(py))
+    dentro = (fx >= -0.5) & (fx <= len(x) - 0.5) & (fy >= -0.5) & (fy <= len(y) - 0.5)
+
+    if metodo == 'cercano':
+        ix = np.clip(np.rint(fx), 0, len(x) - 1).astype(int)
+        iy = np.clip(np.rint(fy), 0, len(y) - 1).astype(int)
+        indices, pesos = (iy * len(x) + ix)[:, None], np.ones((len(fx), 1))
+    elif metodo == 'bilineal':
+        # Entre el borde de la grilla y el centro del último píxel se usa el valor de ese píxel
+        ix0 = np.clip(np.floor(fx), 0, max(len(x) - 2, 0)).astype(int)
+        iy0 = np.clip(np.floor(fy), 0, max(len(y) - 2, 0)).astype(int)
+        tx = np.clip(fx - ix0, 0, 1) if len(x) > 1 else np.zeros(len(fx))
+        ty = np.clip(fy - iy0, 0, 1) if len(y) > 1 else np.zeros(len(fy))
+        ix1, iy1 = np.minimum(ix0 + 1, len(x) - 1), np.minimum(iy0 + 1, len(y) - 1)
+        indices = np.column_stack([iy0 * len(x) + ix0, iy0 * len(x) + ix1, iy1 * len(x) + ix0, iy1 * len(x) + ix1])
+        pesos = np.column_stack([(1 - tx) * (1 - ty), tx * (1 - ty), (1 - tx) * ty, tx * ty])
+    else:
+        raise ValueError(f"Método de muestreo desconocido: {metodo}")
+    indices[~dentro] = -1
+    return indices, pesos
+
+
+# Devuelve los índices y ponderaciones de un conjunto de puntos sobre una grilla. El resultado se guarda en
+# memoria por grilla, coordenadas de los puntos y método.
+def indices_puntos(datos, longitudes, latitudes, metodo='cercano'):
+    longitudes = np.ascontiguousarray(longitudes, dtype=np.float64)
+    latitudes = np.ascontiguousarray(latitudes, dtype=np.float64)
+    clave_puntos = hashlib.sha1(longitudes.tobytes() + latitudes.tobytes()).hexdigest()
+    clave = (clave_grilla(datos), clave_puntos, metodo)
+    with _cache_indices_lock:
+        resultado = _cache_indices.get(clave)
+    if resultado is None:
+        resultado = _calcular_indices(datos, longitudes, latitudes, metodo)
+        with _cache_indices_lock:
+            _cache_indices[clave] = resultado
+    return resultado
+
+
+# Extrae la matriz tiempo x puntos de un producto grillado.
+# datos: xarray.Dataset (con una única variable espacial o indicando variable) o DataArray.
+# longitudes, latitudes: coordenadas de los puntos (EPSG:4326).
+# metodo: 'cercano' (píxel más cercano) o 'bilineal'. En la interpolación bilineal los píxeles faltantes
+#         se excluyen y las ponderaciones de los restantes se renormalizan.
+# Devuelve un xarray.DataArray con dimensiones (time, punto).
+def matriz_puntos(datos, longitudes, latitudes, variable=None, metodo='cercano', bloque_tiempo=256):
+    import xarray
+    datos = seleccionar_variable(datos, variable)
+    if 'time' not in datos.dims:
+        datos = datos.expand_dims('time')
+    dim_x, dim_y = dimensiones_espaciales(datos)
+    datos = datos.transpose('time', dim_y, dim_x)
+    indices, pesos = indices_puntos(datos, longitudes, latitudes, metodo)
+
+    # a. Solamente se lee la ventana de la grilla que contiene a todos los puntos
+    nx = datos.sizes[dim_x]
+    validos = indices[:, 0] >= 0
+    iy, ix = indices[validos] // nx, indices[validos] % nx
+    y0, y1 = (iy.min(), iy.max() + 1) if validos.any() else (0, 0)
+    x0, x1 = (ix.min(), ix.max() + 1) if validos.any() else (0, 0)
+    datos_ventana = datos.isel({dim_y: slice(y0, y1), dim_x: slice(x0, x1)})
+    indices_ventana = np.where(indices >= 0, (indices // nx - y0) * (x1 - x0) + (indices % nx - x0), 0)
+
+    # b. Indexación vectorizada de todos los puntos para cada bloque de tiempo
+    n_tiempos = datos.sizes['time']
+    resultado = np.full((n_tiempos, len(indices)), np.nan)
+    for inicio in range(0, n_tiempos, bloque_tiempo):
+        fin = min(inicio + bloque_tiempo, n_tiempos)
+        valores = np.asarray(datos_ventana.isel(time=slice(inicio, fin)).values, dtype=np.float64)
+        valores = valores.reshape(fin - inicio, -1)[:, indices_ventana]  # (tiempo, punto, píxel)
+        con_datos = ~np.isnan(valores)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            suma_pesos = np.sum(con_datos * pesos, axis=-1)
+            resultado[inicio:fin] = np.sum(np.where(con_datos, valores, 0) * pesos, axis=-1) / suma_pesos
+    resultado[:, ~validos] = np.nan
+
+    return xarray.DataArray(resultado, dims=('time', 'punto'), coords={'time': datos['time'].values},
+                            name=datos.name)
+
+
+# Muestrea un producto grillado en un conjunto de puntos: un Data Frame con columnas de coordenadas (por ejemplo,
+# el resultado del servicio /estaciones) o un archivo GeoJSON de puntos.
+# Devuelve un Data Frame con los atributos de cada punto y las columnas fecha y valor (el mismo formato que
+# los servicios */serie_temporal/*).
+def muestrear_puntos(datos, puntos, variable=None, metodo='cercano', columnas_coordenadas=('longitud', 'latitud'),
+                     bloque_tiempo=256):
+    if not isinstance(puntos, pandas.DataFrame):
+        puntos = leer_puntos(puntos)
+    columna_lon, columna_lat = columnas_coordenadas
+    matriz = matriz_puntos(datos, puntos[columna_lon], puntos[columna_lat], variable=variable, metodo=metodo,
+                           bloque_tiempo=bloque_tiempo)
+    n_tiempos, n_puntos = matriz.shape
+    tabla = puntos.iloc[np.repeat(np.arange(n_puntos), n_tiempos)].reset_index(drop=True)
+    return tabla.assign(fecha=np.tile(matriz['time'].values, n_puntos), valor=matriz.values.T.ravel())
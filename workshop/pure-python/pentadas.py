@@ -1,6 +1,8 @@
 
 import datetime
 import calendar
+import numpy as np
+import pandas
 
 
 # Funciones para el manejo de péntadas
@@ -65,3 +67,107 @@ def fecha_fin_pentada(fecha: datetime):
 #   dia.fin     <- ifelse(pentada.mes < 6, 5 + 5 * (pentada.mes - 1), lubridate::days_in_month(fecha))
 #   return (as.Date(sprintf("%d-%d-%d", lubridate::year(fecha), lubridate::month(fecha), dia.fin)))
 # }
+
+
+# Versiones vectorizadas de las funciones anteriores.
+# Reciben arrays (numpy, listas o pandas.Series) de fechas o de péntadas y años, y devuelven arrays
+# numpy de tipo datetime64[D] (o de enteros, en el caso de las péntadas). Los cálculos se hacen con
+# aritmética de fechas de numpy, por lo que los años bisiestos se manejan sin casos especiales.
+
+# Tablas precalculadas para las 72 péntadas del año: mes (0-11) y día de inicio (0-25, contados desde el día 1)
+_MES_PENTADA = np.repeat(np.arange(12), 6)
+_DIA_INICIO_PENTADA = np.tile(np.arange(0, 30, 5), 12)
+
+
+# Convierte un array de fechas a datetime64[D] y calcula el mes (1-12) y el día del mes (1-31)
+def _descomponer_fechas(fechas):
+    fechas = np.asarray(fechas, dtype='datetime64[D]')
+    inicio_mes = fechas.astype('datetime64[M]')
+    mes = inicio_mes.astype(int) % 12 + 1
+    dia = (fechas - inicio_mes).astype(int) + 1
+    return fechas, inicio_mes, mes, dia
+
+
+# Determina a qué pentada del año corresponde cada fecha (1-72)
+def fechas_a_pentada_año(fechas):
+    _, _, mes, dia = _descomponer_fechas(fechas)
+    pentada_mes = np.minimum((dia - 1) // 5, 5) + 1
+    return pentada_mes + 6 * (mes - 1)
+
+
+# Determina a qué pentada del mes corresponde cada fecha (1-6)
+def fechas_a_pentada_mes(fechas):
+    _, _, _, dia = _descomponer_fechas(fechas)
+    return np.minimum((dia - 1) // 5, 5) + 1
+
+
+# Devuelve las fechas de inicio de las péntadas de los años indicados
+def pentadas_año_a_fecha_inicio(pentadas_año, años):
+    indice = np.asarray(pentadas_año, dtype=int) - 1
+    años = np.asarray(años, dtype=int)
+    inicio_mes = ((años - 1970) * 12 + _MES_PENTADA[indice]).astype('datetime64[M]')
+    return inicio_mes.astype('datetime64[D]') + _DIA_INICIO_PENTADA[indice]
+
+
+# Devuelve las fechas de fin de las péntadas de los años indicados
+def pentadas_año_a_fecha_fin(pentadas_año, años):
+    indice = np.asarray(pentadas_año, dtype=int) - 1
+    años = np.asarray(años, dtype=int)
+    inicio_mes = ((años - 1970) * 12 + _MES_PENTADA[indice]).astype('datetime64[M]')
+    fin_mes = (inicio_mes + 1).astype('datetime64[D]') - 1
+    return np.where(indice % 6 < 5, inicio_mes.astype('datetime64[D]') + _DIA_INICIO_PENTADA[indice] + 4, fin_mes)
+
+
+# Obtener las fechas de inicio de péntada de un array de fechas
+def fechas_inicio_pentada(fechas):
+    _, inicio_mes, _, dia = _descomponer_fechas(fechas)
+    return inicio_mes.astype('datetime64[D]') + 5 * np.minimum((dia - 1) // 5, 5)
+
+
+# Obtener las fechas de fin de péntada de un array de fechas
+def fechas_fin_pentada(fechas):
+    _, inicio_mes, _, dia = _descomponer_fechas(fechas)
+    pentada_mes = np.minimum((dia - 1) // 5, 5) + 1
+    fin_mes = (inicio_mes + 1).astype('datetime64[D]') - 1
+    return np.where(pentada_mes < 6, inicio_mes.astype('datetime64[D]') + 5 * pentada_mes - 1, fin_mes)
+
+
+# Accesor de pandas para utilizar las funciones vectorizadas directamente sobre Series y DataFrames.
+# Ejemplos:
+#   serie_fechas.pentadas.pentada_año()
+#   df.pentadas.fecha_fin('pentada_fin', 'ano')
+@pandas.api.extensions.register_series_accessor('pentadas')
+class _AccesorPentadasSeries:
+
+    def __init__(self, serie):
+        self._serie = serie
+
+    def _serie_resultado(self, valores):
+        return pandas.Series(valores, index=self._serie.index, name=self._serie.name)
+
+    def pentada_año(self):
+        return self._serie_resultado(fechas_a_pentada_año(self._serie))
+
+    def pentada_mes(self):
+        return self._serie_resultado(fechas_a_pentada_mes(self._serie))
+
+    def fecha_inicio(self):
+        return self._serie_resultado(fechas_inicio_pentada(self._serie))
+
+    def fecha_fin(self):
+        return self._serie_resultado(fechas_fin_pentada(self._serie))
+
+
+@pandas.api.extensions.register_dataframe_accessor('pentadas')
+class _AccesorPentadasDataFrame:
+
+    def __init__(self, df):
+        self._df = df
+
+    def fecha_inicio(self, columna_pentada='pentada_fin', columna_año='ano'):
+        return pandas.Series(pentadas_año_a_fecha_inicio(self._df[columna_pentada], self._df[columna_año]),
+                             index=self._df.index)
+
+    def fecha_fin(self, columna_pentada='pentada_fin', columna_año='ano'):
+        return pandas.Series(pentadas_año_a_fecha_fin(self._df[columna_pentada], self._df[columna_año]),
+                             index=self._df.index)
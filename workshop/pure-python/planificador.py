@@ -0,0 +1,320 @@
+
+import concurrent.futures
+import contextlib
+import heapq
+import itertools
+import json
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+import requests
+
+from cache_respuestas import CacheRespuestas
+from funciones_api import ClienteAPI, base_url_default
+from instrumentacion import medir
+
+
+# Planificador de descargas masivas (por ejemplo, todas las estaciones x todas las configuraciones de SPI x 40 años).
+# Las consultas se registran en un manifiesto persistente (SQLite) con su estado (pendiente, en_curso, completada o
+# fallida), por lo que una ejecución interrumpida se retoma exactamente donde se detuvo: las consultas completadas
+# no se repiten y las que habían quedado en curso vuelven a estar pendientes. Cada respuesta se guarda en un archivo
+# antes de marcar la consulta como completada.
+# Las consultas idénticas (mismo método, URL, cuerpo y credenciales) se registran una única vez, aunque pertenezcan
+# a distintos trabajos: se descargan una sola vez y su resultado se asigna a todos los trabajos (etiquetas) que la
+# solicitaron.
+# Las consultas pendientes se ejecutan por prioridad (mayor primero) y la concurrencia se ajusta durante la
+# ejecución con un esquema AIMD (ver ControlAIMD), a partir de la latencia observada y de las respuestas 429 y 5xx.
+#
+# Uso:
+#   planificador = PlanificadorDescargas('backfill/', usuario, clave)
+#   planificador.agregar_lote(trabajos)  # [(etiquetas, url)], como en consultas_lote
+#   planificador.ejecutar()
+#   datos, errores = planificador.resultados_JSON()
+
+
+# Estados de una consulta en el manifiesto
+PENDIENTE, EN_CURSO, COMPLETADA, FALLIDA = 'pendiente', 'en_curso', 'completada', 'fallida'
+
+# Respuestas que indican que el servidor está saturado: se reduce la concurrencia y se reintenta la consulta
+estados_congestion = (429, 500, 502, 503, 504)
+
+
+# Control de concurrencia AIMD (additive increase, multiplicative decrease), como el control de congestión de TCP.
+# Cada consulta exitosa aumenta el límite en incremento / límite (es decir, aproximadamente en incremento por cada
+# "ventana" de consultas exitosas) y cada señal de congestión (respuesta 429 o 5xx, timeout o, si se indica
+# latencia_maxima, una latencia media mayor a ese valor) lo multiplica por factor. Las señales de congestión que
+# llegan dentro de un mismo intervalo de latencia se consideran un único evento.
+class ControlAIMD:
+
+    def __init__(self, inicial=4, minimo=1, maximo=32, incremento=1.0, factor=0.5, latencia_maxima=None):
+        self.limite = float(inicial)
+        self.minimo = minimo
+        self.maximo = maximo
+        self.incremento = incremento
+        self.factor = factor
+        self.latencia_maxima = latencia_maxima
+        self.latencia = None  # media móvil exponencial de la latencia (en segundos)
+        self.historial = [(time.time(), self.limite)]
+        self._ultima_reduccion = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def concurrencia(self):
+        return int(self.limite)
+
+    def exito(self, latencia):
+        with self._lock:
+            self.latencia = latencia if self.latencia is None else 0.8 * self.latencia + 0.2 * latencia
+            if self.latencia_maxima and self.latencia > self.latencia_maxima:
+                self._reducir()
+            else:
+                self._actualizar(min(self.maximo, self.limite + self.incremento / self.limite))
+
+    def congestion(self):
+        with self._lock:
+            self._reducir()
+
+    def _reducir(self):
+        ahora = time.monotonic()
+        if ahora - self._ultima_reduccion < (self.latencia or 1.0):
+            return
+        self._ultima_reduccion = ahora
+        self._actualizar(max(self.minimo, self.limite * self.factor))
+
+    def _actualizar(self, limite):
+        if int(limite) != int(self.limite):
+            self.historial.append((time.time(), limite))
+        self.limite = limite
+
+
+# Las consultas se identifican con la misma clave que en la cache de respuestas, que incluye el hash de las
+# credenciales (credencial): las consultas de distintos usuarios no se combinan en una única descarga.
+class ManifiestoDescargas:
+
+    def __init__(self, archivo, credencial=None):
+        self.archivo = pathlib.Path(archivo)
+        self.credencial = credencial
+        self.archivo.parent.mkdir(parents=True, exist_ok=True)
+        with self._conectar() as conexion:
+            conexion.execute('PRAGMA journal_mode=WAL')
+            conexion.execute('CREATE TABLE IF NOT EXISTS consultas ('
+                             ' clave TEXT PRIMARY KEY, metodo TEXT, url TEXT, cuerpo BLOB, prioridad INTEGER,'
+                             ' estado TEXT, intentos INTEGER, error TEXT, archivo TEXT, actualizada REAL)')
+            conexion.execute('CREATE TABLE IF NOT EXISTS trabajos ('
+                             ' clave TEXT, etiquetas TEXT, UNIQUE (clave, etiquetas))')
+            conexion.execute('CREATE INDEX IF NOT EXISTS consultas_estado ON consultas (estado, prioridad)')
+
+    # Misma estrategia que CacheRespuestas: una conexión por operación, con timeout para esperar bloqueos
+    @contextlib.contextmanager
+    def _conectar(self):
+        conexion = sqlite3.connect(self.archivo, timeout=60, isolation_level=None)
+        try:
+            yield conexion
+        finally:
+            conexion.close()
+
+    # Registra trabajos (etiquetas, metodo, url, cuerpo, prioridad). Si la consulta ya existe, solamente se
+    # agregan las etiquetas y se conserva la mayor prioridad. Devuelve la cantidad de consultas nuevas.
+    def agregar(self, trabajos):
+        ahora = time.time()
+        with self._conectar() as conexion:
+            conexion.execute('BEGIN IMMEDIATE')
+            antes, = conexion.execute('SELECT COUNT(*) FROM consultas').fetchone()
+            for etiquetas, metodo, url, cuerpo, prioridad in trabajos:
+                clave = CacheRespuestas.clave(metodo, url, cuerpo, self.credencial)
+                conexion.execute('INSERT INTO consultas VALUES (?, ?, ?, ?, ?, ?, 0, NULL, NULL, ?) '
+                                 'ON CONFLICT (clave) DO UPDATE SET prioridad = MAX(prioridad, excluded.prioridad)',
+                                 (clave, metodo, url, cuerpo, prioridad, PENDIENTE, ahora))
+                conexion.execute('INSERT OR IGNORE INTO trabajos VALUES (?, ?)',
+                                 (clave, json.dumps(etiquetas, sort_keys=True)))
+            despues, = conexion.execute('SELECT COUNT(*) FROM consultas').fetchone()
+            conexion.execute('COMMIT')
+        return despues - antes
+
+    # Las consultas que quedaron en curso (ejecución interrumpida) vuelven a estar pendientes. Con
+    # reintentar_fallidas=True también se vuelven a intentar las que fallaron en ejecuciones anteriores.
+    def reiniciar(self, reintentar_fallidas=False):
+        with self._conectar() as conexion:
+            conexion.execute('UPDATE consultas SET estado = ? WHERE estado = ?', (PENDIENTE, EN_CURSO))
+            if reintentar_fallidas:
+                conexion.execute('UPDATE consultas SET estado = ?, intentos = 0 WHERE estado = ?',
+                                 (PENDIENTE, FALLIDA))
+
+    def pendientes(self):
+        with self._conectar() as conexion:
+            return conexion.execute('SELECT clave, metodo, url, cuerpo, prioridad, intentos FROM consultas '
+                                    'WHERE estado = ? ORDER BY prioridad DESC, rowid', (PENDIENTE,)).fetchall()
+
+    def actualizar(self, clave, estado, intentos=None, error=None, archivo=None):
+        with self._conectar() as conexion:
+            conexion.execute('UPDATE consultas SET estado = ?, intentos = COALESCE(?, intentos), error = ?, '
+                             'archivo = COALESCE(?, archivo), actualizada = ? WHERE clave = ?',
+                             (estado, intentos, error, archivo, time.time(), clave))
+
+    # Cantidad de consultas en cada estado
+    def resumen(self):
+        with self._conectar() as conexion:
+            return dict(conexion.execute('SELECT estado, COUNT(*) FROM consultas GROUP BY estado').fetchall())
+
+    # Trabajos registrados: etiquetas, url, estado, error y archivo con la respuesta
+    def trabajos(self):
+        with self._conectar() as conexion:
+            filas = conexion.execute('SELECT t.etiquetas, c.url, c.estado, c.error, c.archivo FROM trabajos t '
+                                     'JOIN consultas c USING (clave) ORDER BY t.rowid').fetchall()
+        return [(json.loads(etiquetas), url, estado, error, archivo)
+                for etiquetas, url, estado, error, archivo in filas]
+
+
+class PlanificadorDescargas:
+
+    def __init__(self, directorio, usuario, clave, base_url=base_url_default, control=None, max_intentos=5,
+                 espera=1.0, timeout=(10, 300)):
+        self.directorio = pathlib.Path(directorio)
+        self.directorio_respuestas = self.directorio / 'respuestas'
+        self.directorio_respuestas.mkdir(parents=True, exist_ok=True)
+        self.control = control or ControlAIMD()
+        self.max_intentos = max_intentos
+        self.espera = espera
+        # Cliente propio sin reintentos automáticos: las respuestas 429 y 5xx deben llegar al planificador
+        # para ajustar la concurrencia, y los reintentos se programan desde la cola de consultas.
+        self.cliente = ClienteAPI(usuario, clave, base_url=base_url, tamano_pool=self.control.maximo,
+                                  timeout=timeout, reintentos=0)
+        self.manifiesto = ManifiestoDescargas(self.directorio / 'manifiesto.sqlite', self.cliente.credencial)
+        self._condicion = threading.Condition()
+        self._activas = 0
+        self._pausa_hasta = 0.0
+        self._detener = False
+
+    def agregar(self, url, etiquetas=None, prioridad=0, metodo='GET', cuerpo=None):
+        return self.manifiesto.agregar([(etiquetas or {}, metodo, self.cliente.url(url), cuerpo, prioridad)])
+
+    # Registra un lote de trabajos (etiquetas, url), con el mismo formato que consultas_lote. Los trabajos también
+    # pueden ser ternas (etiquetas, url, cuerpo), que se consultan con POST (por ejemplo, las consultas espaciales
+    # generadas por registro_zonas.trabajos_espaciales).
+    def agregar_lote(self, trabajos, prioridad=0):
+        consultas = []
+        for etiquetas, url, *cuerpo in trabajos:
+            cuerpo = cuerpo[0] if cuerpo else None
+            consultas.append((etiquetas, 'GET' if cuerpo is None else 'POST', self.cliente.url(url), cuerpo, prioridad))
+        return self.manifiesto.agregar(consultas)
+
+    # Detiene la ejecución luego de que finalicen las consultas en curso (por ejemplo, desde otro hilo)
+    def detener(self):
+        with self._condicion:
+            self._detener = True
+            self._condicion.notify_all()
+
+    # Ejecuta todas las consultas pendientes. Devuelve la cantidad de consultas en cada estado al finalizar.
+    def ejecutar(self, reintentar_fallidas=False):
+        self.manifiesto.reiniciar(reintentar_fallidas)
+        orden = itertools.count()
+        cola = [(-prioridad, next(orden), (clave, metodo, url, cuerpo, intentos))
+                for clave, metodo, url, cuerpo, prioridad, intentos in self.manifiesto.pendientes()]
+        heapq.heapify(cola)
+        demoradas = []  # reintentos programados: (no_antes_de, prioridad, orden, consulta)
+        self._detener = False
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.control.maximo) as ejecutor:
+            while True:
+                with self._condicion:
+                    ahora = time.monotonic()
+                    while demoradas and demoradas[0][0] <= ahora:
+                        _, *consulta = heapq.heappop(demoradas)
+                        heapq.heappush(cola, tuple(consulta))
+                    if self._detener or not (cola or demoradas or self._activas):
+                        if not self._activas:
+                            break
+                        self._condicion.wait()
+                        continue
+                    if not cola or self._activas >= self.control.concurrencia or ahora < self._pausa_hasta:
+                        esperas = [demoradas[0][0] - ahora] if demoradas else []
+                        esperas += [self._pausa_hasta - ahora] if ahora < self._pausa_hasta else []
+                        self._condicion.wait(timeout=max(min(esperas), 0.01) if esperas else None)
+                        continue
+                    prioridad, _, consulta = heapq.heappop(cola)
+                    self._activas += 1
+                self.manifiesto.actualizar(consulta[0], EN_CURSO)
+                ejecutor.submit(self._ejecutar_consulta, consulta, prioridad, demoradas, orden)
+        return self.manifiesto.resumen()
+
+    def _ejecutar_consulta(self, consulta, prioridad, demoradas, orden):
+        clave, metodo, url, cuerpo, intentos = consulta
+        intentos += 1
+        reintentar = False
+        try:
+            reintentar, error = self._consultar(clave, metodo, url, cuerpo, intentos)
+            if error is not None:
+                reintentar = reintentar and intentos < self.max_intentos
+                self.manifiesto.actualizar(clave, PENDIENTE if reintentar else FALLIDA, intentos, error)
+        finally:
+            with self._condicion:
+                if reintentar:
+                    no_antes_de = time.monotonic() + self.espera * 2 ** (intentos - 1)
+                    heapq.heappush(demoradas, (no_antes_de, prioridad, next(orden),
+                                               (clave, metodo, url, cuerpo, intentos)))
+                self._activas -= 1
+                self._condicion.notify_all()
+
+    # Ejecuta una consulta y guarda su respuesta. Devuelve (reintentar, error), con error=None si fue exitosa.
+    def _consultar(self, clave, metodo, url, cuerpo, intentos):
+        try:
+            with medir('planificador', url, metodo) as medicion:
+                inicio = time.perf_counter()
+                respuesta = self.cliente.get(url) if metodo == 'GET' else self.cliente.post(url, cuerpo)
+                medicion.respuesta(respuesta)
+            latencia = time.perf_counter() - inicio
+        except (requests.ConnectionError, requests.Timeout) as e:
+            self.control.congestion()
+            return True, repr(e)
+        except Exception as e:
+            return False, repr(e)
+
+        if respuesta.status_code in estados_congestion:
+            self.control.congestion()
+            if respuesta.status_code == 429:
+                self._pausar(respuesta.headers.get('Retry-After'))
+            return True, f"HTTP {respuesta.status_code}"
+        if respuesta.status_code != 200:
+            return False, f"HTTP {respuesta.status_code}: {respuesta.text[:200]}"
+        self.control.exito(latencia)
+        archivo = self._guardar_respuesta(clave, respuesta)
+        self.manifiesto.actualizar(clave, COMPLETADA, intentos, None, str(archivo))
+        return False, None
+
+    # Pausa el envío de consultas durante el tiempo indicado por el servidor (cabecera Retry-After, en segundos)
+    def _pausar(self, retry_after):
+        try:
+            segundos = float(retry_after)
+        except (TypeError, ValueError):
+            segundos = self.espera
+        with self._condicion:
+            self._pausa_hasta = max(self._pausa_hasta, time.monotonic() + segundos)
+
+    # Guarda el contenido de la respuesta (de forma atómica) en un archivo identificado por la clave de la consulta
+    def _guardar_respuesta(self, clave, respuesta):
+        tipo = respuesta.headers.get('Content-Type', '')
+        extension = '.json' if 'json' in tipo else '.nc' if 'netcdf' in tipo else '.bin'
+        archivo = self.directorio_respuestas / clave[:2] / f"{clave}{extension}"
+        archivo.parent.mkdir(exist_ok=True)
+        temporal = archivo.with_suffix('.tmp')
+        temporal.write_bytes(respuesta.content)
+        os.replace(temporal, archivo)
+        return archivo
+
+    # Une las respuestas JSON de los trabajos completados en un único Data Frame (con las etiquetas de cada trabajo
+    # como columnas) y devuelve también los trabajos no completados, como consultas_lote.
+    def resultados_JSON(self):
+        import pandas
+        datos, errores = [], []
+        for etiquetas, url, estado, error, archivo in self.manifiesto.trabajos():
+            if estado == COMPLETADA:
+                resultado = pandas.json_normalize(json.loads(pathlib.Path(archivo).read_bytes()))
+                if not resultado.empty:
+                    datos.append(resultado.assign(**etiquetas))
+            else:
+                errores.append({**etiquetas, 'url': url, 'estado': estado, 'error': error})
+        datos = pandas.concat(datos, ignore_index=True) if datos else pandas.DataFrame()
+        errores = pandas.DataFrame(errores) if errores else pandas.DataFrame(columns=['url', 'estado', 'error'])
+        return datos, errores
@@ -2,18 +2,14 @@
 # Carga de paquetes Python necesarios para hacer los requests a la API y graficar resultados
 import matplotlib.cm
 import matplotlib.pyplot as plt
-import yaml
 import numpy as np
 
 from mpl_toolkits.basemap import Basemap
-from funciones_api import consumir_servicio_JSON
-
-with open('credencial.yml', 'r') as f:
-    credencial = yaml.safe_load(f.read())
+from funciones_api import cargar_credencial, consumir_servicio_JSON
+from catalogo_estaciones import CatalogoEstaciones
 
 base_url = 'https://api.crc-sas.org/ws-api'
-usuario_default = credencial.get('usuario')
-clave_default = credencial.get('clave')
+usuario_default, clave_default = cargar_credencial()
 
 if __name__ == "__main__":
     matplotlib.use('TkAgg')
@@ -31,18 +27,15 @@ if __name__ == "__main__":
                                         usuario=usuario_default, clave=clave_default)
 
     # 2. Búsqueda de estaciones vecinas a Pehuajó (omm_id = 87544).
-    #    Se buscan estaciones dentro de un radio de 300km.
+    #    Se buscan estaciones dentro de un radio de 300km. La búsqueda se hace localmente, sobre un catálogo
+    #    de todas las estaciones (las vecinas pueden pertenecer a otros países).
     omm_central_id = 87544
     maxima_distancia_km = 300
-    url_vecinas = f"{base_url}/estaciones_vecinas/{omm_central_id}?max_distancia={maxima_distancia_km}"
-    estaciones_vecinas = consumir_servicio_JSON(url=url_vecinas,
-                                                usuario=usuario_default, clave=clave_default)
+    catalogo = CatalogoEstaciones.desde_api(usuario=usuario_default, clave=clave_default, base_url=base_url)
 
     # 3. Indico si la estación es Central (Pehuajó), Vecina u Otra
     estaciones = estaciones.assign(
-        tipo=lambda df: df.apply(
-            lambda x: 'Central' if x['omm_id'] == omm_central_id else 'Vecina' if x['omm_id'] in estaciones_vecinas[
-                'omm_id'].values else 'Otra', axis=1)
+        tipo=catalogo.clasificar(omm_central_id, omm_ids=estaciones['omm_id'], max_distancia=maxima_distancia_km)
     )
 
     # Se imprime el dataframe con las estaciones
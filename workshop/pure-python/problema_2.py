@@ -4,19 +4,14 @@ import matplotlib.cm
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
 import dateutil.parser
-import yaml
 import pandas as pd
 import numpy as np
 import statsmodels.api as sm
 
-from funciones_api import consumir_servicio_JSON
-
-with open('credencial.yml', 'r') as f:
-    credencial = yaml.safe_load(f.read())
+from funciones_api import cargar_credencial, consumir_servicio_JSON
 
 base_url = 'https://api.crc-sas.org/ws-api'
-usuario_default = credencial.get('usuario')
-clave_default = credencial.get('clave')
+usuario_default, clave_default = cargar_credencial()
 
 if __name__ == "__main__":
     matplotlib.use('TkAgg')
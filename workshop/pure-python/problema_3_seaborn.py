@@ -4,18 +4,13 @@ import dateutil.parser
 import matplotlib.cm
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
-import yaml
 import seaborn
 
-from pentadas import fecha_fin_pentada, pentada_año_a_fecha_inicio
-from funciones_api import consumir_servicio_JSON
-
-with open('credencial.yml', 'r') as f:
-    credencial = yaml.safe_load(f.read())
+from pentadas import pentadas_año_a_fecha_fin
+from funciones_api import cargar_credencial, consumir_servicio_JSON
 
 base_url = 'https://api.crc-sas.org/ws-api'
-usuario_default = credencial.get('usuario')
-clave_default = credencial.get('clave')
+usuario_default, clave_default = cargar_credencial()
 
 if __name__ == "__main__":
     matplotlib.use('TkAgg')
@@ -49,8 +44,7 @@ if __name__ == "__main__":
 
     # Definir la fecha de fin del período a partir del año y la péntada de fin
     serie_temporal_spi = serie_temporal_spi.assign(
-        fecha_fin_pentada=lambda df: df.apply(
-            lambda x: fecha_fin_pentada(pentada_año_a_fecha_inicio(x['pentada_fin'], x['ano'])), axis=1)
+        fecha_fin_pentada=lambda df: pentadas_año_a_fecha_fin(df['pentada_fin'], df['ano'])
     )
 
     # Graficar
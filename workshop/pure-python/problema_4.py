@@ -3,17 +3,12 @@
 import dateutil.parser
 import matplotlib.cm
 import matplotlib.pyplot as plt
-import yaml
 
 from mpl_toolkits.basemap import Basemap
-from funciones_api import consumir_servicio_espacial
-
-with open('credencial.yml', 'r') as f:
-    credencial = yaml.safe_load(f.read())
+from funciones_api import cargar_credencial, consumir_servicio_espacial
 
 base_url = 'https://api.crc-sas.org/ws-api'
-usuario_default = credencial.get('usuario')
-clave_default = credencial.get('clave')
+usuario_default, clave_default = cargar_credencial()
 
 if __name__ == "__main__":
     matplotlib.use('TkAgg')
@@ -0,0 +1,231 @@
+
+import datetime
+import functools
+import json
+import math
+import os
+import pathlib
+import threading
+import numpy as np
+
+from estadisticas_zonales import zonas_geojson
+
+
+# Registro de zonas para consultas espaciales. Cada archivo GeoJSON se lee y decodifica una única vez por proceso
+# (mientras no se modifique). Para cada zona se calculan sus límites y, a pedido, una versión simplificada de sus
+# polígonos (Douglas-Peucker) con una tolerancia proporcional a la resolución de la grilla del producto consultado:
+# los vértices que se eliminan están a menos de una fracción de píxel del contorno original, por lo que la
+# selección de píxeles prácticamente no cambia, pero el cuerpo de la consulta es mucho más chico. Las coordenadas
+# se redondean a una precisión acorde a la tolerancia y el cuerpo de la consulta ({'zona.geojson': ...}) se guarda
+# ya serializado (bytes), de manera que las consultas de muchas zonas x productos x períodos no repiten la
+# lectura, la simplificación ni la serialización. Como el cuerpo es siempre el mismo para una zona y resolución,
+# las respuestas pueden reutilizarse desde la cache de respuestas o el manifiesto del planificador.
+#
+# Uso:
+#   cuerpo = payload_zona('Uruguay.geojson', resolucion=0.05)
+#   trabajos = trabajos_espaciales(['PY.geojson', 'Uruguay.geojson'], ['chirps/spi/3', 'esi/SMN/4WK'],
+#                                  [('2019-01-01', '2019-03-31'), ('2020-01-01', '2020-03-31')])
+#   resultados, errores = consumir_servicios_espaciales_lote(trabajos, usuario, clave)
+
+
+# Resolución aproximada (en grados) de la grilla de cada producto, utilizada para elegir la tolerancia de la
+# simplificación cuando se indica resolucion='auto'. Para las grillas proyectadas se convierte el paso en metros
+# a grados (1 grado ~ 111 km). Los productos que no figuran se envían sin simplificar.
+resoluciones_productos = {
+    'chirps': 0.05,
+    'esi': 0.05,
+    'grace': 0.125,
+    'indices_vegetacion': 0.01,
+    'indices_vegetation': 0.01,
+    'smap': 0.08,
+}
+
+# Tolerancia de la simplificación, como fracción de la resolución de la grilla
+factor_tolerancia_default = 0.25
+
+
+# Resolución de la grilla del producto de una URL o ruta (por ejemplo, chirps/spi/3/...), o None si no se conoce
+def resolucion_producto(url):
+    segmentos = url.split('/')
+    return next((resoluciones_productos[s] for s in segmentos if s in resoluciones_productos), None)
+
+
+# Simplificación de Douglas-Peucker de una línea. Devuelve una máscara con los vértices que se conservan.
+# En los anillos (primer vértice igual al último) la primera división se hace en el vértice más lejano al inicio.
+def _douglas_peucker(puntos, tolerancia):
+    conservar = np.zeros(len(puntos), dtype=bool)
+    conservar[[0, -1]] = True
+    pendientes = [(0, len(puntos) - 1)]
+    while pendientes:
+        inicio, fin = pendientes.pop()
+        if fin - inicio < 2:
+            continue
+        a, b = puntos[inicio], puntos[fin]
+        intermedios = puntos[inicio + 1:fin] - a
+        dx, dy = b - a
+        largo = math.hypot(dx, dy)
+        if largo == 0:
+            distancias = np.hypot(intermedios[:, 0], intermedios[:, 1])
+        else:
+            distancias = np.abs(dx * intermedios[:, 1] - dy * intermedios[:, 0]) / largo
+        i = int(np.argmax(distancias))
+        if distancias[i] > tolerancia:
+            medio = inicio + 1 + i
+            conservar[medio] = True
+            pendientes += [(inicio, medio), (medio, fin)]
+    return conservar
+
+
+# Simplifica un anillo (lista de coordenadas). Si el anillo simplificado queda con menos de 4 vértices (zonas
+# más chicas que la tolerancia), se conserva el anillo original.
+def simplificar_anillo(anillo, tolerancia, decimales=None):
+    puntos = np.asarray(anillo, dtype=float)[:, :2]
+    if tolerancia and len(puntos) > 4:
+        simplificado = puntos[_douglas_peucker(puntos, tolerancia)]
+        if len(simplificado) >= 4:
+            puntos = simplificado
+    if decimales is not None:
+        puntos = np.round(puntos, decimales)
+        puntos = puntos[np.r_[True, np.any(puntos[1:] != puntos[:-1], axis=1)]]  # vértices repetidos
+    return puntos.tolist()
+
+
+# Límites (xmin, ymin, xmax, ymax) de una lista de polígonos (None si está vacía)
+def _limites(poligonos):
+    if not poligonos:
+        return None
+    vertices = np.concatenate([poligono[0] for poligono in poligonos])
+    return (*vertices.min(axis=0).tolist(), *vertices.max(axis=0).tolist())
+
+
+class Zona:
+
+    def __init__(self, archivo_geojson_zona):
+        self.archivo = pathlib.Path(archivo_geojson_zona)
+        self.geojson = json.loads(self.archivo.read_text())
+        self._payloads = {}
+        self._lock = threading.Lock()
+
+    # Atributos y polígonos de las zonas (ver estadisticas_zonales.leer_zonas). Se calculan solamente cuando se
+    # necesitan (límites o simplificación), ya que sin simplificar el GeoJSON se envía tal cual, aunque contenga
+    # geometrías que no son polígonos (por ejemplo, puntos).
+    @functools.cached_property
+    def _propiedades_zonas(self):
+        return zonas_geojson(self.geojson)
+
+    @property
+    def propiedades(self):
+        return self._propiedades_zonas[0]
+
+    @property
+    def zonas(self):
+        return self._propiedades_zonas[1]
+
+    # Límites (xmin, ymin, xmax, ymax) de cada zona
+    @functools.cached_property
+    def limites_zonas(self):
+        return [_limites(poligonos) for poligonos in self.zonas]
+
+    # Límites (xmin, ymin, xmax, ymax) de todo el archivo
+    @functools.cached_property
+    def limites(self):
+        return _limites([poligono for poligonos in self.zonas for poligono in poligonos])
+
+    @functools.cached_property
+    def vertices(self):
+        return sum(len(anillo) for poligonos in self.zonas for poligono in poligonos for anillo in poligono)
+
+    # GeoJSON con los polígonos simplificados con la tolerancia indicada (en grados) y las coordenadas redondeadas
+    # a una décima de la tolerancia. Las geometrías que no son polígonos se conservan sin cambios. Con
+    # tolerancia=None se devuelve el GeoJSON original.
+    def geojson_simplificado(self, tolerancia=None):
+        if not tolerancia:
+            return self.geojson
+        decimales = max(0, math.ceil(-math.log10(tolerancia))) + 1
+        features = self.geojson['features'] if self.geojson.get('type') == 'FeatureCollection' else [self.geojson]
+        simplificadas = []
+        for feature in features:
+            geometria = feature.get('geometry') or {}
+            if geometria.get('type') not in ('Polygon', 'MultiPolygon'):
+                simplificadas.append(feature)
+                continue
+            poligonos = [geometria['coordinates']] if geometria['type'] == 'Polygon' else geometria['coordinates']
+            poligonos = [[simplificar_anillo(anillo, tolerancia, decimales) for anillo in poligono]
+                         for poligono in poligonos]
+            coordenadas = poligonos[0] if geometria['type'] == 'Polygon' else poligonos
+            simplificadas.append({**feature, 'geometry': {'type': geometria['type'], 'coordinates': coordenadas}})
+        return {'type': 'FeatureCollection', 'features': simplificadas}
+
+    # Cuerpo de la consulta espacial ({'zona.geojson': ...}) serializado, para la tolerancia indicada
+    def payload(self, tolerancia=None):
+        with self._lock:
+            cuerpo = self._payloads.get(tolerancia)
+        if cuerpo is None:
+            geojson = json.dumps(self.geojson_simplificado(tolerancia), separators=(',', ':'))
+            cuerpo = json.dumps({'zona.geojson': geojson}).encode('utf-8')
+            with self._lock:
+                self._payloads[tolerancia] = cuerpo
+        return cuerpo
+
+
+class RegistroZonas:
+
+    def __init__(self, factor_tolerancia=factor_tolerancia_default):
+        self.factor_tolerancia = factor_tolerancia
+        self._zonas = {}
+        self._lock = threading.Lock()
+
+    # Zona de un archivo GeoJSON. Se lee una única vez por archivo (y fecha de modificación).
+    def zona(self, archivo_geojson_zona):
+        archivo = pathlib.Path(archivo_geojson_zona).resolve()
+        clave = (str(archivo), os.stat(archivo).st_mtime_ns)
+        with self._lock:
+            zona = self._zonas.get(clave)
+        if zona is None:
+            zona = Zona(archivo)
+            with self._lock:
+                self._zonas[clave] = zona
+        return zona
+
+    # Tolerancia de la simplificación para una resolución de grilla (en grados). Con resolucion='auto' se utiliza
+    # la resolución del producto de la URL; con resolucion=None (o un producto desconocido), no se simplifica.
+    def tolerancia(self, resolucion=None, url=None):
+        if resolucion == 'auto':
+            resolucion = resolucion_producto(url or '')
+        return resolucion * self.factor_tolerancia if resolucion else None
+
+    def payload(self, archivo_geojson_zona, resolucion=None, url=None):
+        return self.zona(archivo_geojson_zona).payload(self.tolerancia(resolucion, url))
+
+
+# Registro compartido por las funciones consumir_servicio_espacial*
+registro_default = RegistroZonas()
+
+
+def payload_zona(archivo_geojson_zona, resolucion=None, url=None):
+    return registro_default.payload(archivo_geojson_zona, resolucion, url)
+
+
+def _fecha(fecha):
+    if isinstance(fecha, (datetime.date, datetime.datetime)):
+        return fecha.strftime('%Y-%m-%dT%H:%M:%S')
+    return datetime.datetime.fromisoformat(str(fecha)).strftime('%Y-%m-%dT%H:%M:%S')
+
+
+# Genera los trabajos (etiquetas, url, cuerpo) de las consultas espaciales de todas las combinaciones de zonas,
+# productos (rutas como chirps/spi/3) y períodos (desde, hasta). Las zonas pueden indicarse como una lista de
+# archivos (se identifican por el nombre del archivo) o como un diccionario {nombre: archivo}. El cuerpo de cada
+# zona y resolución se calcula una única vez y se comparte entre todos sus trabajos.
+def trabajos_espaciales(zonas, productos, periodos, base_url=None, resolucion='auto', registro=None):
+    from funciones_api import base_url_default
+    base_url = (base_url or base_url_default).rstrip('/')
+    registro = registro or registro_default
+    if not isinstance(zonas, dict):
+        zonas = {pathlib.Path(archivo).stem: archivo for archivo in zonas}
+    for nombre, archivo in zonas.items():
+        for producto in productos:
+            producto = producto.strip('/')
+            cuerpo = registro.payload(archivo, resolucion, producto)
+            for desde, hasta in periodos:
+                etiquetas = {'zona': nombre, 'producto': producto, 'desde': str(desde), 'hasta': str(hasta)}
+                yield etiquetas, f"{base_url}/{producto}/{_fecha(desde)}/{_fecha(hasta)}", cuerpo
@@ -0,0 +1,207 @@
+
+import concurrent.futures
+import contextlib
+import datetime
+import json
+import os
+import pathlib
+import threading
+import numpy as np
+import pandas
+
+from funciones_api import consumir_servicio_JSON_tipado
+from pentadas import fechas_a_pentada_año, pentada_año_a_fecha_inicio, pentadas_año_a_fecha_fin
+
+
+# Sincronización incremental de series temporales de estaciones.
+# Para cada serie (servicio, omm_id, configuración) se registra la última fecha almacenada localmente,
+# de manera que en cada actualización solamente se solicitan a la API los datos posteriores a esa fecha.
+# Los períodos faltantes muy largos se dividen en bloques acotados (la API limita la cantidad de días
+# por consulta) y los resultados se unen en orden con los datos previamente almacenados.
+
+
+# Convierte una fecha al formato utilizado en las rutas de la API
+def _fecha_url(fecha):
+    return datetime.datetime.combine(fecha, datetime.time()).isoformat()
+
+
+# Devuelve la fecha de inicio de la ventana de ancho_ventana péntadas que finaliza en la péntada de la fecha dada
+def _inicio_ventana(fecha, ancho_ventana):
+    indice = fecha.year * 72 + fechas_a_pentada_año([fecha])[0] - 1 - (ancho_ventana - 1)
+    return pentada_año_a_fecha_inicio(indice % 72 + 1, indice // 72).date()
+
+
+# Definición de un servicio sincronizable: cómo se arma la URL, cómo se obtiene la fecha de cada
+# registro y qué columnas identifican a un registro (para descartar duplicados al unir bloques).
+class ServicioSincronizable:
+
+    def __init__(self, ruta, fechas, columnas_clave, ajustar_desde=None, solapamiento_dias=0):
+        self.ruta = ruta
+        self.fechas = fechas
+        self.columnas_clave = columnas_clave
+        self.ajustar_desde = ajustar_desde or (lambda fecha_desde, configuracion: fecha_desde)
+        self.solapamiento_dias = solapamiento_dias
+
+
+# Servicios soportados. La configuración es el id de configuración del índice (indices_sequia_valores),
+# el id de variable o None (registros_diarios), o el par (estadistico, ancho_ventana) (estadisticas_moviles).
+servicios = {
+    'registros_diarios': ServicioSincronizable(
+        ruta=lambda omm_id, variable_id, desde, hasta:
+            f"registros_diarios/{omm_id}/{variable_id + '/' if variable_id else ''}{desde}/{hasta}",
+        fechas=lambda df: df['fecha'].to_numpy(dtype='datetime64[D]'),
+        columnas_clave=['omm_id', 'fecha', 'variable_id']),
+    'indices_sequia_valores': ServicioSincronizable(
+        ruta=lambda omm_id, indice_configuracion_id, desde, hasta:
+            f"indices_sequia_valores/{indice_configuracion_id}/{omm_id}/{desde}/{hasta}",
+        fechas=lambda df: pentadas_año_a_fecha_fin(df['pentada_fin'], df['ano']),
+        columnas_clave=['indice_configuracion_id', 'omm_id', 'ano', 'pentada_fin']),
+    # Este servicio solo devuelve ventanas completamente incluidas en el período consultado,
+    # por lo que la fecha desde se retrocede hasta el inicio de la primera ventana buscada.
+    'estadisticas_moviles': ServicioSincronizable(
+        ruta=lambda omm_id, configuracion, desde, hasta:
+            f"estadisticas_moviles/{omm_id}/{configuracion[0]}/{configuracion[1]}/{desde}/{hasta}",
+        fechas=lambda df: df['fecha_hasta'].to_numpy(dtype='datetime64[D]'),
+        columnas_clave=['omm_id', 'fecha_desde', 'fecha_hasta', 'variable_id'],
+        ajustar_desde=lambda fecha_desde, configuracion: _inicio_ventana(fecha_desde, configuracion[1]),
+        solapamiento_dias=lambda configuracion: 6 * configuracion[1]),
+}
+
+
+# Almacén local por defecto: un archivo pickle por serie.
+class AlmacenPickle:
+
+    def __init__(self, directorio):
+        self.directorio = pathlib.Path(directorio)
+
+    def _archivo(self, servicio, omm_id, configuracion):
+        sufijo = '_'.join(str(c) for c in np.atleast_1d(configuracion)) if configuracion is not None else 'todas'
+        return self.directorio / servicio / f"{omm_id}_{sufijo}.pkl"
+
+    def leer(self, servicio, omm_id, configuracion):
+        archivo = self._archivo(servicio, omm_id, configuracion)
+        return pandas.read_pickle(archivo) if archivo.exists() else None
+
+    def guardar(self, servicio, omm_id, configuracion, datos):
+        archivo = self._archivo(servicio, omm_id, configuracion)
+        archivo.parent.mkdir(parents=True, exist_ok=True)
+        temporal = archivo.with_suffix('.tmp')
+        datos.to_pickle(temporal)
+        os.replace(temporal, archivo)
+
+
+# Locks de los archivos de estado, por archivo: el lock de hilos serializa a los sincronizadores de un mismo
+# proceso y el bloqueo del archivo .lock (cuando el sistema lo permite) a los de distintos procesos.
+_locks_estado = {}
+_locks_estado_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def _bloquear_estado(archivo_estado):
+    with _locks_estado_lock:
+        lock = _locks_estado.setdefault(str(pathlib.Path(archivo_estado).resolve()), threading.Lock())
+    with lock, open(archivo_estado.with_suffix('.lock'), 'a+b') as archivo_lock:
+        try:
+            import fcntl
+        except ImportError:  # Windows
+            fcntl = None
+        if fcntl is not None:
+            fcntl.flock(archivo_lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(archivo_lock, fcntl.LOCK_UN)
+
+
+class SincronizadorSeries:
+
+    def __init__(self, directorio, usuario, clave, fecha_inicio=datetime.date(1961, 1, 1),
+                 max_dias_consulta=3650, almacen=None):
+        self.directorio = pathlib.Path(directorio)
+        self.directorio.mkdir(parents=True, exist_ok=True)
+        self.usuario = usuario
+        self.clave = clave
+        self.fecha_inicio = fecha_inicio
+        self.max_dias_consulta = max_dias_consulta
+        self.almacen = almacen or AlmacenPickle(self.directorio)
+        self._archivo_estado = self.directorio / 'estado.json'
+        self.estado = json.loads(self._archivo_estado.read_text()) if self._archivo_estado.exists() else {}
+
+    # Las claves se serializan con default=int para admitir los enteros de numpy (por ejemplo, los omm_id
+    # tomados de una columna de un Data Frame).
+    @staticmethod
+    def _clave_estado(servicio, omm_id, configuracion):
+        return json.dumps([servicio, omm_id, configuracion], default=int)
+
+    def ultima_fecha(self, servicio, omm_id, configuracion=None):
+        fecha = self.estado.get(self._clave_estado(servicio, omm_id, configuracion))
+        return datetime.date.fromisoformat(fecha) if fecha else None
+
+    # Registra la última fecha de una serie. El archivo de estado puede ser compartido por varios sincronizadores
+    # (en distintos hilos o procesos): se vuelve a leer y se combina con el estado en memoria antes de escribirlo,
+    # conservando la fecha más reciente de cada serie, mientras se mantiene bloqueado.
+    def _guardar_estado(self, servicio, omm_id, configuracion, fecha):
+        with _bloquear_estado(self._archivo_estado):
+            guardado = json.loads(self._archivo_estado.read_text()) if self._archivo_estado.exists() else {}
+            self.estado[self._clave_estado(servicio, omm_id, configuracion)] = fecha.isoformat()
+            for clave, valor in self.estado.items():
+                guardado[clave] = max(guardado.get(clave, valor), valor)
+            self.estado = guardado
+            temporal = self._archivo_estado.with_suffix(f".{os.getpid()}.tmp")
+            temporal.write_text(json.dumps(guardado, indent=1))
+            os.replace(temporal, self._archivo_estado)
+
+    # Divide el período [desde, hasta] en bloques que respeten el máximo de días por consulta
+    # (descontando el solapamiento necesario para los servicios con ventanas móviles).
+    def bloques(self, desde, hasta, solapamiento_dias=0):
+        paso = datetime.timedelta(days=self.max_dias_consulta - solapamiento_dias - 1)
+        while desde <= hasta:
+            fin = min(desde + paso, hasta)
+            yield desde, fin
+            desde = fin + datetime.timedelta(days=1)
+
+    # Sincroniza una serie: busca los datos posteriores a la última fecha almacenada, los une con los datos
+    # existentes y actualiza el estado. Devuelve la serie completa.
+    def sincronizar(self, servicio, omm_id, configuracion=None, hasta=None):
+        definicion = servicios[servicio]
+        hasta = hasta or datetime.date.today()
+        ultima = self.ultima_fecha(servicio, omm_id, configuracion)
+        desde = ultima + datetime.timedelta(days=1) if ultima else self.fecha_inicio
+        existentes = self.almacen.leer(servicio, omm_id, configuracion)
+        if desde > hasta:
+            return existentes
+
+        solapamiento = definicion.solapamiento_dias
+        solapamiento = solapamiento(configuracion) if callable(solapamiento) else solapamiento
+        nuevos = []
+        for inicio, fin in self.bloques(desde, hasta, solapamiento):
+            url = definicion.ruta(omm_id, configuracion, _fecha_url(definicion.ajustar_desde(inicio, configuracion)),
+                                  _fecha_url(fin))
+            bloque = consumir_servicio_JSON_tipado(url, self.usuario, self.clave)
+            if not bloque.empty:
+                # Se descartan los registros anteriores al bloque (ventanas solapadas)
+                nuevos.append(bloque[definicion.fechas(bloque) >= np.datetime64(inicio)])
+        if not any(len(bloque) for bloque in nuevos):
+            return existentes
+
+        datos = pandas.concat(([existentes] if existentes is not None else []) + nuevos, ignore_index=True)
+        datos = datos.drop_duplicates(subset=definicion.columnas_clave, keep='last')
+        fechas = definicion.fechas(datos)
+        datos = datos.iloc[np.argsort(fechas, kind='stable')].reset_index(drop=True)
+        self.almacen.guardar(servicio, omm_id, configuracion, datos)
+        self._guardar_estado(servicio, omm_id, configuracion, fechas.max().astype(datetime.date))
+        return datos
+
+    # Sincroniza muchas series en paralelo. Cada serie es una tupla (servicio, omm_id, configuracion).
+    # Devuelve un diccionario con los errores producidos (las demás series se sincronizan normalmente).
+    def sincronizar_todas(self, series, hasta=None, max_concurrencia=8):
+        errores = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrencia) as ejecutor:
+            futuros = {ejecutor.submit(self.sincronizar, *serie, hasta=hasta): tuple(serie) for serie in series}
+            for futuro in concurrent.futures.as_completed(futuros):
+                try:
+                    futuro.result()
+                except Exception as e:
+                    errores[futuros[futuro]] = e
+        return errores